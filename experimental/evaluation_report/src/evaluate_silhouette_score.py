@@ -23,9 +23,14 @@ def clamp_score(val):
 
 def load_vectors(dataset_path: Path, source: Literal["embedding", "umap"]):
     if source == "embedding":
-        df = pd.read_pickle(dataset_path / "embeddings.pkl")
-        vectors = np.vstack(df["embedding"].values)
-        arg_ids = df["arg-id"].tolist()
+        if (dataset_path / "embeddings.npy").exists():
+            vectors = np.load(dataset_path / "embeddings.npy", mmap_mode="r")
+            arg_ids = pd.read_csv(dataset_path / "embeddings_ids.csv", dtype={"arg-id": str})["arg-id"].tolist()
+        else:
+            # 旧形式（embeddings.pkl）
+            df = pd.read_pickle(dataset_path / "embeddings.pkl")
+            vectors = np.vstack(df["embedding"].values)
+            arg_ids = df["arg-id"].tolist()
     else:
         df = pd.read_csv(dataset_path / "hierarchical_clusters.csv")
         vectors = df[["x", "y"]].values
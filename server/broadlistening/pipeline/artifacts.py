@@ -0,0 +1,161 @@
+"""パイプラインの中間ファイル（アーティファクト）の読み書き"""
+
+import os
+import re
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+EMBEDDINGS_FILENAME = "embeddings.npy"
+EMBEDDING_IDS_FILENAME = "embeddings_ids.csv"
+LEGACY_EMBEDDINGS_FILENAME = "embeddings.pkl"
+
+# 中間ファイル（DataFrame）の保存形式。csv はそのまま開けるが、parquet は読み込みが速く型も保たれる
+ARTIFACT_FORMATS = ("csv", "parquet")
+DEFAULT_ARTIFACT_FORMAT = "csv"
+
+# 中間ファイルごとに、CSVを型推論に任せず文字列として読む列
+# （数字だけの意見やidが数値として読まれ、後段で astype(str) が必要になるのを防ぐ）
+ARTIFACT_STRING_COLUMNS: dict[str, list[str]] = {
+    "args": ["arg-id", "argument"],
+    "relations": ["arg-id"],
+    "hierarchical_clusters": ["arg-id", "argument"],
+    "hierarchical_initial_labels": ["arg-id", "argument"],
+    "hierarchical_merge_labels": ["id", "label", "description", "parent"],
+}
+# クラスタのid・ラベル・説明の列（階層の数だけある）
+CLUSTER_STRING_COLUMN_PATTERN = re.compile(r"^cluster-level-\d+-(id|label|description)$")
+
+
+def save_embeddings(output_dir: str, arg_ids: list[str], vectors: np.ndarray) -> None:
+    """埋め込みを float32 の .npy と、行順に対応する arg-id のCSVとして保存する"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if len(arg_ids) != vectors.shape[0]:
+        raise ValueError(f"arg-id count ({len(arg_ids)}) does not match embedding rows ({vectors.shape[0]})")
+    np.save(os.path.join(output_dir, EMBEDDINGS_FILENAME), vectors)
+    pd.DataFrame({"arg-id": arg_ids}).to_csv(os.path.join(output_dir, EMBEDDING_IDS_FILENAME), index=False)
+
+
+def load_embeddings(output_dir: str, mmap: bool = True) -> tuple[list[str], np.ndarray]:
+    """埋め込みを (arg-idのリスト, ベクトル行列) として読み込む
+
+    .npy はデフォルトでメモリマップとして開くため、読み込み時にコピーが発生しない。
+    旧形式の embeddings.pkl しかない場合はそちらを読み込む。
+    """
+    npy_path = os.path.join(output_dir, EMBEDDINGS_FILENAME)
+    if os.path.exists(npy_path):
+        vectors = np.load(npy_path, mmap_mode="r" if mmap else None)
+        arg_ids = pd.read_csv(os.path.join(output_dir, EMBEDDING_IDS_FILENAME), dtype={"arg-id": str})["arg-id"]
+        return arg_ids.tolist(), vectors
+
+    legacy_path = os.path.join(output_dir, LEGACY_EMBEDDINGS_FILENAME)
+    if os.path.exists(legacy_path):
+        df = pd.read_pickle(legacy_path)
+        return df["arg-id"].astype(str).tolist(), np.vstack(df["embedding"].values).astype(np.float32)
+
+    raise FileNotFoundError(f"Embeddings not found in {output_dir}")
+
+
+def artifact_format(config: dict) -> str:
+    """設定（artifact_format）から中間ファイルの保存形式を返す"""
+    fmt = config.get("artifact_format", DEFAULT_ARTIFACT_FORMAT)
+    if fmt not in ARTIFACT_FORMATS:
+        raise ValueError(f"Unknown artifact format '{fmt}'. Available: {', '.join(ARTIFACT_FORMATS)}")
+    return fmt
+
+
+def _artifact_candidates(path: str | os.PathLike) -> list[Path]:
+    path = Path(path)
+    if path.name == EMBEDDINGS_FILENAME:
+        # 旧形式の embeddings.pkl しかない出力も load_embeddings で読み込める
+        return [path, path.with_name(LEGACY_EMBEDDINGS_FILENAME)]
+    if path.suffix.lstrip(".") not in ARTIFACT_FORMATS:
+        return [path]
+    return [path.with_suffix(f".{fmt}") for fmt in ARTIFACT_FORMATS]
+
+
+def find_artifact(path: str | os.PathLike) -> Path | None:
+    """中間ファイルの実際のパスを返す（存在しなければ None）
+
+    path は形式によらず args.csv のように指定する。CSVとParquetの両方がある場合は、後から書き込まれた方を使う
+    （Parquetで実行した後にCSVを書き出して編集した場合は、編集したCSVが読まれる）。
+    """
+    existing = [candidate for candidate in _artifact_candidates(path) if candidate.exists()]
+    return max(existing, key=lambda candidate: candidate.stat().st_mtime_ns, default=None)
+
+
+def artifact_exists(path: str | os.PathLike) -> bool:
+    return find_artifact(path) is not None
+
+
+def write_artifact(df: pd.DataFrame, path: str | os.PathLike, fmt: str = DEFAULT_ARTIFACT_FORMAT) -> Path:
+    """DataFrameを中間ファイルとして保存し、保存先のパスを返す（path の拡張子は fmt に置き換える）"""
+    target = Path(path).with_suffix(f".{fmt}")
+    if fmt == "parquet":
+        df.to_parquet(target, index=False)
+    else:
+        df.to_csv(target, index=False)
+    return target
+
+
+def read_artifact(path: str | os.PathLike) -> pd.DataFrame:
+    """中間ファイルを読み込む（CSVでは ARTIFACT_STRING_COLUMNS とクラスタの列を文字列として読む）"""
+    resolved = find_artifact(path)
+    if resolved is None:
+        raise FileNotFoundError(f"Artifact not found: {path}")
+    if resolved.suffix == ".parquet":
+        return pd.read_parquet(resolved)
+
+    columns = pd.read_csv(resolved, nrows=0).columns
+    string_columns = set(ARTIFACT_STRING_COLUMNS.get(resolved.stem, []))
+    dtype = {col: str for col in columns if col in string_columns or CLUSTER_STRING_COLUMN_PATTERN.match(col)}
+    return pd.read_csv(resolved, dtype=dtype)
+
+
+def export_csv(output_dir: str | os.PathLike) -> list[Path]:
+    """Parquetの中間ファイルを、同じ名前のCSVとして書き出す（表計算ソフトなどで確認・編集する用）"""
+    exported = []
+    for parquet_path in sorted(Path(output_dir).glob("*.parquet")):
+        exported.append(write_artifact(pd.read_parquet(parquet_path), parquet_path, "csv"))
+    return exported
+
+
+class ArtifactContext:
+    """1回のパイプライン実行の中で共有する、中間ファイルの読み込みキャッシュ
+
+    同じファイルを複数のステップ（や1つのステップの複数の関数）が読む場合でも、パースは1回で済む。
+    キャッシュはファイルの更新時刻とサイズで検証するため、ステップがファイルを書き直した後は読み直す。
+    呼び出し側が変更しても影響しないよう、読み込んだDataFrameのコピーを返す。
+    """
+
+    def __init__(self):
+        self._frames: dict[str, tuple[tuple[int, int], pd.DataFrame]] = {}
+
+    def read(self, path: str | os.PathLike) -> pd.DataFrame:
+        """中間ファイル（または入力のCSV）を読み込む。path は形式によらず args.csv のように指定する"""
+        resolved = find_artifact(path)
+        if resolved is None:
+            raise FileNotFoundError(f"Artifact not found: {path}")
+        key = str(resolved.resolve())
+        stat = resolved.stat()
+        signature = (stat.st_mtime_ns, stat.st_size)
+        cached = self._frames.get(key)
+        if cached is None or cached[0] != signature:
+            cached = (signature, read_artifact(resolved))
+            self._frames[key] = cached
+        return cached[1].copy()
+
+    def clear(self) -> None:
+        self._frames.clear()
+
+
+_artifact_context = ArtifactContext()
+
+
+def artifact_context() -> ArtifactContext:
+    """パイプラインの実行中に各ステップで共有するコンテキストを返す
+
+    initialization でキャッシュを空にし、termination で解放する。
+    """
+    return _artifact_context
@@ -1,7 +1,11 @@
 import argparse
 import sys
 
+from artifacts import export_csv
 from hierarchical_utils import initialization, run_step, termination
+from services.embedding_cache import enable_embedding_cache
+from services.llm import configure_rate_limits
+from services.llm_cache import enable_llm_cache
 from steps.embedding import embedding
 from steps.extraction import extraction
 from steps.hierarchical_aggregation import hierarchical_aggregation
@@ -38,6 +42,16 @@ def parse_arguments():
         action="store_true",
         help="Skip the html output.",
     )
+    parser.add_argument(
+        "--no-llm-cache",
+        action="store_true",
+        help="Disable the persistent LLM response and embedding caches and always send requests to the provider.",
+    )
+    parser.add_argument(
+        "--export-csv",
+        action="store_true",
+        help="Also write CSV copies of intermediate files saved as Parquet (artifact_format: parquet).",
+    )
     return parser.parse_args()
 
 
@@ -56,6 +70,11 @@ def main():
         new_argv.append("--without-html")
 
     config = initialization(new_argv)
+    if not args.no_llm_cache:
+        enable_llm_cache()
+        enable_embedding_cache()
+    # 設定ファイルの rate_limits を優先し、なければ環境変数 LLM_RATE_LIMITS を使う
+    configure_rate_limits(config.get("rate_limits"))
 
     try:
         run_step("extraction", extraction, config)
@@ -66,6 +85,8 @@ def main():
         run_step("hierarchical_overview", hierarchical_overview, config)
         run_step("hierarchical_aggregation", hierarchical_aggregation, config)
         run_step("hierarchical_visualization", hierarchical_visualization, config)
+        if args.export_csv:
+            export_csv(f"outputs/{config['output_dir']}")
 
         termination(config)
     except Exception as e:
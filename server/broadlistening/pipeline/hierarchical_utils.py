@@ -5,6 +5,8 @@ import traceback
 from datetime import datetime, timedelta
 from pathlib import Path
 
+from artifacts import artifact_context, artifact_exists, artifact_format
+
 # serverディレクトリをパスに追加
 current_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 if current_dir not in sys.path:
@@ -38,7 +40,11 @@ def validate_config(config):
         "provider",
         "local_llm_address",
         "enable_source_link",
+        "rate_limits",
+        "batch",
+        "artifact_format",
     ]
+    artifact_format(config)
     step_names = [x["step"] for x in specs]
     for key in config:
         if key not in valid_fields and key not in step_names:
@@ -64,13 +70,15 @@ def decide_what_to_run(config, previous):
     # utility function to check if params changed
 
     def different_params(step):
-        keys = step["dependencies"]["params"]
+        keys = list(step["dependencies"]["params"])
         if step.get("use_llm", False):
             # automagically track prompt and model for llm jobs
             keys += ["prompt", "model"]
         match = [x for x in previous_jobs if x["step"] == step["step"]]
-        prev = match[0]["params"]
-        next = config[step["step"]]
+        # オプションの追加前に実行した結果には値がないため、デフォルト値で実行したものとみなす
+        defaults = step.get("options", {})
+        prev = {**defaults, **match[0]["params"]}
+        next = {**defaults, **config[step["step"]]}
         diff = [key for key in keys if prev.get(key, None) != next.get(key, None)]
         for key in diff:
             print(f"(!) {step} step parameter '{key}' changed from '{prev.get(key)}' to '{next.get(key)}'")
@@ -96,7 +104,7 @@ def decide_what_to_run(config, previous):
             reason = "forced this step with -o"
         elif not found_prev:
             reason = "not trace of previous run"
-        elif not os.path.exists(PIPELINE_DIR / f"outputs/{config['output_dir']}/{step['filename']}"):
+        elif not artifact_exists(PIPELINE_DIR / f"outputs/{config['output_dir']}/{step['filename']}"):
             reason = "previous data not found"
         else:
             deps = step["dependencies"]["steps"]
@@ -111,7 +119,18 @@ def decide_what_to_run(config, previous):
                 else:
                     run = False
                     reason = "nothing changed"
-        plan.append({"step": stepname, "run": run, "reason": reason})
+        entry = {"step": stepname, "run": run, "reason": reason}
+        # 途中までの結果を逐次保存するステップは、強制実行でなければ前回の続きから再開する
+        checkpoint = step.get("checkpoint")
+        if (
+            run
+            and checkpoint
+            and not config.get("force", False)
+            and os.path.exists(PIPELINE_DIR / f"outputs/{config['output_dir']}/{checkpoint}")
+        ):
+            entry["resume"] = True
+            entry["reason"] = f"{reason} (resuming from {checkpoint})"
+        plan.append(entry)
     return plan
 
 
@@ -124,6 +143,8 @@ def initialization(sysargv):
 
     validate_config(config)
     config["output_dir"] = job_name
+    # 前の実行で読み込んだ中間ファイルのキャッシュを引き継がない
+    artifact_context().clear()
 
     for i, option in enumerate(sysargv):
         if option == "-f":
@@ -294,6 +315,7 @@ def run_step(step, func, config):
 
 
 def termination(config, error=None):
+    artifact_context().clear()
     if "previous" in config:
         # remember all previously completed jobs
         old_jobs = config["previous"].get("completed_jobs", []) + config["previous"].get(
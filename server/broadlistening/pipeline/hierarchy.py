@@ -0,0 +1,77 @@
+"""クラスタの階層構造（親子関係）"""
+
+from dataclasses import dataclass, field
+
+import numpy as np
+import pandas as pd
+
+# aggregationで追加する全体クラスタのid
+ROOT_CLUSTER_ID = "0"
+
+
+def cluster_level(id_column: str) -> int:
+    """cluster-level-n-id の n を返す"""
+    return int(id_column.replace("cluster-level-", "").replace("-id", ""))
+
+
+def cluster_members(df: pd.DataFrame, id_column: str) -> dict[str, np.ndarray]:
+    """クラスタidごとの、所属する行の位置（df.iloc で使える番号）
+
+    groupby で1回だけ作り、クラスタごとに DataFrame 全体を絞り込まずに済むようにする。
+    """
+    return df.groupby(id_column, sort=False).indices
+
+
+@dataclass
+class ClusterHierarchy:
+    """各階層のクラスタと、その親子関係
+
+    levels と children の並びは、クラスタリング結果で最初に現れた順。
+    最上位のクラスタの親は ROOT_CLUSTER_ID。
+    """
+
+    levels: dict[int, list[str]] = field(default_factory=dict)
+    parents: dict[str, str] = field(default_factory=dict)
+    children: dict[str, list[str]] = field(default_factory=dict)
+
+    @classmethod
+    def from_clusters(cls, df: pd.DataFrame, cluster_id_columns: list[str]) -> "ClusterHierarchy":
+        """意見ごとのクラスタidのDataFrameから階層を作る
+
+        各階層のid列の組み合わせを1回の drop_duplicates で取り出し、そこから親子関係を作るため、
+        意見の件数に対して線形の時間で済む。
+
+        Args:
+            df: cluster-level-n-id 列を含むDataFrame
+            cluster_id_columns: クラスタIDのカラム名のリスト（順不同）
+        """
+        columns = sorted(cluster_id_columns, key=cluster_level)
+        unique_paths = df[columns].drop_duplicates()
+
+        hierarchy = cls()
+        top_ids = pd.unique(unique_paths[columns[0]]).tolist()
+        hierarchy.levels[cluster_level(columns[0])] = top_ids
+        hierarchy.children[ROOT_CLUSTER_ID] = top_ids
+        for cluster_id in top_ids:
+            hierarchy.parents[cluster_id] = ROOT_CLUSTER_ID
+
+        for parent_column, child_column in zip(columns[:-1], columns[1:], strict=False):
+            edges = unique_paths[[parent_column, child_column]].drop_duplicates()
+            # 親の出現順に並べ、同じ親の中では子の出現順を保つ
+            parent_order = {cluster_id: i for i, cluster_id in enumerate(pd.unique(unique_paths[parent_column]))}
+            edges = edges.iloc[edges[parent_column].map(parent_order).argsort(kind="stable")]
+
+            hierarchy.levels[cluster_level(child_column)] = edges[child_column].tolist()
+            for parent_id, child_id in zip(edges[parent_column], edges[child_column], strict=True):
+                hierarchy.parents[child_id] = parent_id
+                hierarchy.children.setdefault(parent_id, []).append(child_id)
+        return hierarchy
+
+    def to_frame(self) -> pd.DataFrame:
+        """(level, id, parent) のDataFrameに変換する"""
+        rows = [
+            {"level": level, "id": cluster_id, "parent": self.parents[cluster_id]}
+            for level, cluster_ids in sorted(self.levels.items())
+            for cluster_id in cluster_ids
+        ]
+        return pd.DataFrame(rows, columns=["level", "id", "parent"])
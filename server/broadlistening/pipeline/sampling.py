@@ -0,0 +1,102 @@
+"""ラベリング用に、クラスタから代表的な意見をサンプリングする"""
+
+import zlib
+from collections.abc import Callable
+
+import numpy as np
+import pandas as pd
+from artifacts import load_embeddings
+
+# MMRで、クラスタ中心への近さ（代表性）と選択済みの意見との違い（多様性）のどちらを重視するか
+MMR_LAMBDA = 0.5
+
+
+def sample_random(rows: np.ndarray, sampling_num: int, embeddings: np.ndarray | None, rng: np.random.Generator):
+    """ランダムに選ぶ"""
+    return rng.choice(rows, sampling_num, replace=False)
+
+
+def sample_centroid(rows: np.ndarray, sampling_num: int, embeddings: np.ndarray, rng: np.random.Generator):
+    """クラスタの重心に近い順に選ぶ"""
+    distances = np.linalg.norm(embeddings - embeddings.mean(axis=0), axis=1)
+    return rows[np.argsort(distances, kind="stable")[:sampling_num]]
+
+
+def sample_mmr(rows: np.ndarray, sampling_num: int, embeddings: np.ndarray, rng: np.random.Generator):
+    """Max Marginal Relevance: 重心に近く、かつ選択済みの意見と似ていないものを順に選ぶ
+
+    ほぼ同じ内容の意見ばかりがプロンプトに並ぶのを避けられるため、少ないサンプル数でもクラスタの幅を伝えられる。
+    """
+    normalized = embeddings / np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+    centroid = normalized.mean(axis=0)
+    relevance = normalized @ (centroid / max(np.linalg.norm(centroid), 1e-12))
+
+    selected = [int(np.argmax(relevance))]
+    max_similarity = normalized @ normalized[selected[0]]
+    while len(selected) < sampling_num:
+        scores = MMR_LAMBDA * relevance - (1 - MMR_LAMBDA) * max_similarity
+        scores[selected] = -np.inf
+        next_index = int(np.argmax(scores))
+        selected.append(next_index)
+        max_similarity = np.maximum(max_similarity, normalized @ normalized[next_index])
+    return rows[selected]
+
+
+SAMPLING_STRATEGIES: dict[str, Callable[..., np.ndarray]] = {
+    "random": sample_random,
+    "centroid": sample_centroid,
+    "mmr": sample_mmr,
+}
+# 埋め込みを使う戦略
+EMBEDDING_STRATEGIES = {"centroid", "mmr"}
+
+
+class ArgumentSampler:
+    """設定したサンプリング戦略で、クラスタに属する行から sampling_num 件を選ぶ
+
+    乱数はシードとクラスタidから決めるため、同じ入力・設定からは処理順によらず常に同じ意見が選ばれ、
+    プロンプトが実行ごとに変わらない（LLMのキャッシュも効く）。
+    """
+
+    def __init__(
+        self,
+        strategy: str = "random",
+        seed: int = 42,
+        vectors: np.ndarray | None = None,
+        embedding_rows: np.ndarray | None = None,
+    ):
+        if strategy not in SAMPLING_STRATEGIES:
+            raise ValueError(f"Unknown sampling strategy '{strategy}'. Available: {', '.join(SAMPLING_STRATEGIES)}")
+        if strategy in EMBEDDING_STRATEGIES and (vectors is None or embedding_rows is None):
+            raise ValueError(f"Sampling strategy '{strategy}' requires embeddings")
+        self.strategy = strategy
+        self.seed = seed
+        self.vectors = vectors
+        self.embedding_rows = embedding_rows
+
+    @classmethod
+    def from_config(cls, step_config: dict, clusters_df: pd.DataFrame, output_dir: str | None = None):
+        """ステップの設定（sampling_strategy, sampling_seed）から作る
+
+        埋め込みを使う戦略では outputs/{output_dir} の埋め込みを読み込み、clusters_df の各行に arg-id で対応付ける。
+        """
+        strategy = step_config.get("sampling_strategy", "random")
+        seed = step_config.get("sampling_seed", 42)
+        if strategy not in EMBEDDING_STRATEGIES:
+            return cls(strategy, seed)
+
+        arg_ids, vectors = load_embeddings(f"outputs/{output_dir}")
+        embedding_rows = pd.Index(arg_ids).get_indexer(clusters_df["arg-id"].astype(str))
+        if (embedding_rows < 0).any():
+            raise ValueError("Some arguments have no embeddings; rerun the embedding step")
+        return cls(strategy, seed, vectors, embedding_rows)
+
+    def sample(self, cluster_id: str, rows: np.ndarray, sampling_num: int) -> np.ndarray:
+        """クラスタに属する行の位置 rows から、最大 sampling_num 件の位置を選ぶ"""
+        if sampling_num >= len(rows):
+            return rows
+        rng = np.random.default_rng([self.seed, zlib.crc32(str(cluster_id).encode())])
+        embeddings = None
+        if self.strategy in EMBEDDING_STRATEGIES:
+            embeddings = np.asarray(self.vectors[self.embedding_rows[rows]], dtype=np.float64)
+        return SAMPLING_STRATEGIES[self.strategy](rows, sampling_num, embeddings, rng)
@@ -0,0 +1,274 @@
+"""プロバイダーのバッチAPIを使ったLLMリクエストの一括実行
+
+急がない大規模な処理では、リクエストをJSONLのジョブファイルにまとめてバッチAPIに投入し、
+完了を待ってから結果を取り込む。ワーカースレッドを長時間占有せず、通常のAPIより料金も安い。
+
+ジョブファイルと結果ファイルの形式は OpenAI Batch API に合わせている。
+投入したバッチのIDはジョブファイルと同じディレクトリに保存するため、待機中にプロセスが落ちても
+再実行時に同じバッチの完了待ちから再開できる。
+"""
+
+import hashlib
+import json
+import logging
+import os
+import time
+from abc import ABC, abstractmethod
+from collections.abc import Callable
+from dataclasses import dataclass
+
+from openai import OpenAI
+from pydantic import BaseModel
+
+from .llm import request_to_chat_ai
+
+DEFAULT_POLL_INTERVAL = 60
+
+BATCH_COMPLETED = "completed"
+BATCH_IN_PROGRESS = "in_progress"
+BATCH_FAILED = "failed"
+
+
+def _strict_schema(schema):
+    """strict モードで必須の additionalProperties: false を、スキーマ内のすべてのオブジェクトに付ける"""
+    if isinstance(schema, dict):
+        schema = {key: _strict_schema(value) for key, value in schema.items()}
+        if schema.get("type") == "object":
+            schema.setdefault("additionalProperties", False)
+    elif isinstance(schema, list):
+        schema = [_strict_schema(value) for value in schema]
+    return schema
+
+
+def _response_format(model: type[BaseModel]) -> dict:
+    """Pydanticモデルから OpenAI の response_format（json_schema）を作る"""
+    return {
+        "type": "json_schema",
+        "json_schema": {
+            "name": model.__name__,
+            "strict": True,
+            "schema": _strict_schema(model.model_json_schema()),
+        },
+    }
+
+
+@dataclass
+class BatchRequest:
+    """バッチで実行する1件のチャットリクエスト"""
+
+    custom_id: str
+    messages: list[dict]
+    model: str
+    json_schema: dict | type[BaseModel] | None = None
+    is_json: bool = False
+
+    def to_job_line(self) -> dict:
+        body = {
+            "model": self.model,
+            "messages": self.messages,
+            "temperature": 0,
+            "n": 1,
+            "seed": 0,
+        }
+        if isinstance(self.json_schema, type) and issubclass(self.json_schema, BaseModel):
+            body["response_format"] = _response_format(self.json_schema)
+        elif self.json_schema:
+            body["response_format"] = self.json_schema
+        elif self.is_json:
+            body["response_format"] = {"type": "json_object"}
+        return {"custom_id": self.custom_id, "method": "POST", "url": "/v1/chat/completions", "body": body}
+
+
+class BatchBackend(ABC):
+    """バッチの投入・状態確認・結果取得を行うバックエンド"""
+
+    @abstractmethod
+    def submit(self, input_path: str) -> str:
+        """ジョブファイルを投入し、バッチIDを返す"""
+
+    @abstractmethod
+    def poll(self, batch_id: str) -> str:
+        """BATCH_COMPLETED / BATCH_IN_PROGRESS / BATCH_FAILED のいずれかを返す"""
+
+    @abstractmethod
+    def download(self, batch_id: str, output_path: str) -> None:
+        """結果をJSONLファイルとして保存する"""
+
+
+class OpenAIBatchBackend(BatchBackend):
+    """OpenAI Batch API"""
+
+    def __init__(self, provider: str = "openai", local_llm_address: str | None = None, user_api_key: str | None = None):
+        if provider != "openai":
+            raise ValueError(f"OpenAI batch backend does not support provider '{provider}'")
+        self.client = OpenAI(api_key=user_api_key) if user_api_key else OpenAI()
+
+    def submit(self, input_path: str) -> str:
+        with open(input_path, "rb") as f:
+            input_file = self.client.files.create(file=f, purpose="batch")
+        batch = self.client.batches.create(
+            input_file_id=input_file.id, endpoint="/v1/chat/completions", completion_window="24h"
+        )
+        return batch.id
+
+    def poll(self, batch_id: str) -> str:
+        status = self.client.batches.retrieve(batch_id).status
+        if status == "completed":
+            return BATCH_COMPLETED
+        if status in ("failed", "expired", "cancelled"):
+            return BATCH_FAILED
+        return BATCH_IN_PROGRESS
+
+    def download(self, batch_id: str, output_path: str) -> None:
+        batch = self.client.batches.retrieve(batch_id)
+        with open(output_path, "w", encoding="utf-8") as f:
+            # 失敗したリクエストはエラーファイルに出力されるため、両方をまとめて保存する
+            for file_id in (batch.output_file_id, batch.error_file_id):
+                if file_id:
+                    f.write(self.client.files.content(file_id).text.rstrip("\n") + "\n")
+
+
+class LocalFileBatchBackend(BatchBackend):
+    """オフライン検証用のバックエンド
+
+    投入時にジョブファイルの各リクエストを request_to_chat_ai で順に実行し、
+    OpenAI Batch API と同じ形式の結果ファイルをジョブファイルの隣に書き出す。
+    """
+
+    def __init__(self, provider: str = "openai", local_llm_address: str | None = None, user_api_key: str | None = None):
+        self.provider = provider
+        self.local_llm_address = local_llm_address
+        self.user_api_key = user_api_key
+
+    def submit(self, input_path: str) -> str:
+        output_path = f"{input_path}.local_output"
+        with open(input_path, encoding="utf-8") as f_in, open(output_path, "w", encoding="utf-8") as f_out:
+            for line in f_in:
+                job = json.loads(line)
+                f_out.write(json.dumps(self._run(job), ensure_ascii=False) + "\n")
+        return output_path
+
+    def _run(self, job: dict) -> dict:
+        body = job["body"]
+        try:
+            content, token_input, token_output, token_total = request_to_chat_ai(
+                messages=body["messages"],
+                model=body["model"],
+                json_schema=body.get("response_format"),
+                provider=self.provider,
+                local_llm_address=self.local_llm_address,
+                user_api_key=self.user_api_key,
+            )
+        except Exception as e:
+            return {"custom_id": job["custom_id"], "response": None, "error": {"message": str(e)}}
+        if not isinstance(content, str):
+            content = json.dumps(content, ensure_ascii=False)
+        response_body = {
+            "choices": [{"message": {"role": "assistant", "content": content}}],
+            "usage": {"prompt_tokens": token_input, "completion_tokens": token_output, "total_tokens": token_total},
+        }
+        return {"custom_id": job["custom_id"], "response": {"status_code": 200, "body": response_body}, "error": None}
+
+    def poll(self, batch_id: str) -> str:
+        return BATCH_COMPLETED if os.path.exists(batch_id) else BATCH_FAILED
+
+    def download(self, batch_id: str, output_path: str) -> None:
+        with open(batch_id, encoding="utf-8") as f_in, open(output_path, "w", encoding="utf-8") as f_out:
+            f_out.write(f_in.read())
+
+
+BATCH_BACKENDS: dict[str, Callable[..., BatchBackend]] = {
+    "openai": OpenAIBatchBackend,
+    "local_file": LocalFileBatchBackend,
+}
+
+
+def register_batch_backend(name: str, factory: Callable[..., BatchBackend]) -> None:
+    """バッチバックエンドを追加する。factoryは provider, local_llm_address, user_api_key をキーワード引数で受け取る"""
+    BATCH_BACKENDS[name] = factory
+
+
+def create_batch_backend(config: dict) -> BatchBackend:
+    """設定ファイルの batch.backend（デフォルトは openai）に対応するバックエンドを作成する"""
+    name = config.get("batch", {}).get("backend", "openai")
+    if name not in BATCH_BACKENDS:
+        raise ValueError(f"Unknown batch backend '{name}'. Available: {', '.join(BATCH_BACKENDS)}")
+    return BATCH_BACKENDS[name](
+        provider=config["provider"],
+        local_llm_address=config.get("local_llm_address"),
+        user_api_key=os.getenv("USER_API_KEY"),
+    )
+
+
+def run_batch(
+    requests: list[BatchRequest],
+    job_dir: str,
+    job_name: str,
+    backend: BatchBackend,
+    poll_interval: float = DEFAULT_POLL_INTERVAL,
+    on_wait: Callable[[], None] | None = None,
+) -> dict[str, tuple[str, int, int, int] | None]:
+    """リクエストをバッチで実行し、custom_idごとに request_to_chat_ai と同じ形式の結果を返す
+
+    失敗したリクエストの結果はNoneになる。
+    on_wait は完了待ちの間、poll_interval ごとに呼ばれる（ステータスのロック延長などに使う）。
+    """
+    if not requests:
+        return {}
+    os.makedirs(job_dir, exist_ok=True)
+    input_path = os.path.join(job_dir, f"{job_name}_input.jsonl")
+    state_path = os.path.join(job_dir, f"{job_name}_state.json")
+    output_path = os.path.join(job_dir, f"{job_name}_output.jsonl")
+
+    job_content = "".join(json.dumps(r.to_job_line(), ensure_ascii=False) + "\n" for r in requests)
+    job_hash = hashlib.sha256(job_content.encode("utf-8")).hexdigest()
+
+    batch_id = None
+    if os.path.exists(state_path):
+        with open(state_path) as f:
+            state = json.load(f)
+        # 前回投入したバッチと同じ内容であれば、再投入せずに完了待ちから再開する
+        if state.get("job_hash") == job_hash:
+            batch_id = state["batch_id"]
+            print(f"Batch {job_name}: resuming batch {batch_id}")
+    if batch_id is None:
+        with open(input_path, "w", encoding="utf-8") as f:
+            f.write(job_content)
+        batch_id = backend.submit(input_path)
+        with open(state_path, "w") as f:
+            json.dump({"batch_id": batch_id, "job_hash": job_hash}, f)
+        print(f"Batch {job_name}: submitted {len(requests)} requests as {batch_id}")
+
+    while (status := backend.poll(batch_id)) == BATCH_IN_PROGRESS:
+        if on_wait is not None:
+            on_wait()
+        time.sleep(poll_interval)
+    if status == BATCH_FAILED:
+        # 失敗したバッチは次回の実行で再投入する
+        os.remove(state_path)
+        raise RuntimeError(f"Batch {batch_id} for {job_name} failed")
+
+    backend.download(batch_id, output_path)
+    return _read_batch_output(output_path, [r.custom_id for r in requests])
+
+
+def _read_batch_output(output_path: str, custom_ids: list[str]) -> dict[str, tuple[str, int, int, int] | None]:
+    results: dict[str, tuple[str, int, int, int] | None] = dict.fromkeys(custom_ids)
+    with open(output_path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            response = record.get("response")
+            if record.get("error") or not response or response.get("status_code") != 200:
+                logging.warning(f"Batch request {record.get('custom_id')} failed: {record.get('error')}")
+                continue
+            body = response["body"]
+            usage = body.get("usage") or {}
+            results[record["custom_id"]] = (
+                body["choices"][0]["message"]["content"],
+                usage.get("prompt_tokens", 0),
+                usage.get("completion_tokens", 0),
+                usage.get("total_tokens", 0),
+            )
+    return results
@@ -0,0 +1,149 @@
+"""テキスト単位の埋め込みベクトルの永続キャッシュ
+
+抽出ステップを再実行しても、大半の意見テキストは前回と同一である。
+(プロバイダー, モデル, テキストのハッシュ) をキーに埋め込みを保存し、未知のテキストだけをAPIに送る。
+
+保存形式は (プロバイダー, モデル) ごとのディレクトリに置く以下の2ファイル:
+    - meta.json: ベクトルの次元数
+    - vectors.bin: [テキストのSHA-256(hex), float32ベクトル] の固定長レコードを追記したもの。
+      np.memmap で開くため、読み込み時にファイル全体をメモリに載せない。
+"""
+
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+
+import numpy as np
+
+DEFAULT_CACHE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "../cache/embeddings"))
+
+KEY_DTYPE = "S64"
+
+
+def text_hash(text: str) -> bytes:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest().encode("ascii")
+
+
+def _safe_dirname(name: str) -> str:
+    return re.sub(r"[^A-Za-z0-9._-]", "_", name)
+
+
+class EmbeddingCache:
+    """1つの (プロバイダー, モデル) に対応する埋め込みキャッシュ"""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.meta_path = os.path.join(directory, "meta.json")
+        self.vectors_path = os.path.join(directory, "vectors.bin")
+        self.dim: int | None = None
+        self._records: np.memmap | None = None
+        self._index: dict[bytes, int] = {}
+        self._lock = threading.Lock()
+
+        os.makedirs(directory, exist_ok=True)
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path) as f:
+                self.dim = json.load(f)["dim"]
+            self._load()
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def _record_dtype(self) -> np.dtype:
+        return np.dtype([("key", KEY_DTYPE), ("vector", "<f4", (self.dim,))])
+
+    def _load(self) -> None:
+        if not os.path.exists(self.vectors_path):
+            return
+        itemsize = self._record_dtype().itemsize
+        size = os.path.getsize(self.vectors_path)
+        n_records = size // itemsize
+        if size % itemsize != 0:
+            # 書き込み途中で中断された末尾のレコードを捨てる
+            logging.warning(f"Embedding cache: truncating partial record in {self.vectors_path}")
+            os.truncate(self.vectors_path, n_records * itemsize)
+        if n_records == 0:
+            return
+        self._records = np.memmap(self.vectors_path, dtype=self._record_dtype(), mode="r", shape=(n_records,))
+        self._index = {key: i for i, key in enumerate(self._records["key"].tolist())}
+
+    def _extend(self) -> None:
+        """追記されたレコードだけを索引に加え、memmap を新しい大きさで開き直す
+
+        既存のキーは読み直さないため、キャッシュ全体の大きさによらず追記した件数に比例する時間で済む。
+        他プロセスが追記したレコードもここで取り込む。
+        """
+        start = 0 if self._records is None else len(self._records)
+        n_records = os.path.getsize(self.vectors_path) // self._record_dtype().itemsize
+        if n_records <= start:
+            return
+        self._records = np.memmap(self.vectors_path, dtype=self._record_dtype(), mode="r", shape=(n_records,))
+        self._index.update(zip(self._records["key"][start:].tolist(), range(start, n_records), strict=True))
+
+    def get_many(self, texts: list[str]) -> list[np.ndarray | None]:
+        """各テキストの埋め込みを返す。キャッシュにないテキストはNone"""
+        with self._lock:
+            if self._records is None:
+                return [None] * len(texts)
+            rows = [self._index.get(text_hash(text)) for text in texts]
+            return [None if row is None else np.asarray(self._records[row]["vector"]) for row in rows]
+
+    def add_many(self, texts: list[str], vectors: list[list[float]] | np.ndarray) -> None:
+        """埋め込みを追記する"""
+        if len(texts) == 0:
+            return
+        vectors = np.asarray(vectors, dtype=np.float32)
+        with self._lock:
+            if self.dim is None:
+                self.dim = int(vectors.shape[1])
+                with open(self.meta_path, "w") as f:
+                    json.dump({"dim": self.dim}, f)
+            elif vectors.shape[1] != self.dim:
+                # ローカルLLMからのフォールバック等で別モデルのベクトルが来た場合は保存しない
+                logging.warning(
+                    f"Embedding cache: dimension mismatch (cache={self.dim}, got={vectors.shape[1]}), skipped"
+                )
+                return
+
+            records = np.empty(len(texts), dtype=self._record_dtype())
+            records["key"] = [text_hash(text) for text in texts]
+            records["vector"] = vectors
+            # 1回のwriteで追記し、他プロセスの追記とレコードが混ざらないようにする
+            with open(self.vectors_path, "ab") as f:
+                f.write(records.tobytes())
+            self._extend()
+
+
+_cache_dir: str | None = None
+_caches: dict[str, EmbeddingCache] = {}
+_caches_lock = threading.Lock()
+
+
+def enable_embedding_cache(cache_dir: str | None = None) -> None:
+    """プロセス全体で埋め込みキャッシュを有効化する
+
+    保存先は引数 > 環境変数(EMBEDDING_CACHE_DIR) > デフォルト値の順で決まる。
+    """
+    global _cache_dir
+    _cache_dir = cache_dir or os.getenv("EMBEDDING_CACHE_DIR") or DEFAULT_CACHE_DIR
+    _caches.clear()
+
+
+def disable_embedding_cache() -> None:
+    global _cache_dir
+    _cache_dir = None
+    _caches.clear()
+
+
+def get_embedding_cache(provider: str, model: str) -> EmbeddingCache | None:
+    """(プロバイダー, モデル) に対応するキャッシュを返す。キャッシュが無効ならNone"""
+    if _cache_dir is None:
+        return None
+    directory = os.path.join(_cache_dir, _safe_dirname(provider), _safe_dirname(model))
+    with _caches_lock:
+        if directory not in _caches:
+            _caches[directory] = EmbeddingCache(directory)
+        return _caches[directory]
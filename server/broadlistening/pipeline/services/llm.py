@@ -1,8 +1,10 @@
+import json
 import logging
 import os
 import random
 import threading
 import time
+from collections.abc import Callable
 from typing import Any
 
 import openai
@@ -11,6 +13,8 @@ from openai import AzureOpenAI, OpenAI
 from pydantic import BaseModel
 from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_exponential
 
+from .llm_cache import build_cache_key, get_llm_cache
+
 try:  # Optional dependency
     import google.generativeai as genai
     from google.api_core import exceptions as google_exceptions
@@ -21,11 +25,120 @@ except ModuleNotFoundError:  # pragma: no cover - library might be unavailable i
 DOTENV_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), "../../../../.env"))
 load_dotenv(DOTENV_PATH)
 
+# プロバイダーへの1回のリクエストのタイムアウト（秒）
+DEFAULT_REQUEST_TIMEOUT = 30
+
+
+class TokenBucket:
+    """1分あたりの量で指定するトークンバケット
+
+    容量を超える量の取得は、バケットが埋まるまで待ってから負債として差し引くため、長期的なレートは守られる。
+    """
+
+    BURST_SECONDS = 10
+
+    def __init__(self, per_minute: float):
+        self.rate_per_second = per_minute / 60
+        self.capacity = max(1.0, self.rate_per_second * self.BURST_SECONDS)
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate_per_second)
+        self._updated_at = now
+
+    def acquire(self, amount: float = 1) -> None:
+        required = min(amount, self.capacity)
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= required:
+                    self._tokens -= amount
+                    return
+                wait = (required - self._tokens) / self.rate_per_second
+            time.sleep(wait)
+
+    def adjust(self, amount: float) -> None:
+        """見積もりとの差分を精算する（正なら追加で消費、負なら返却）"""
+        with self._lock:
+            self._refill()
+            self._tokens = min(self.capacity, self._tokens - amount)
+
+
+class RateLimiter:
+    """プロバイダー・モデル単位のリクエスト数（RPM）とトークン数（TPM）の制限"""
+
+    def __init__(self, requests_per_minute: float | None = None, tokens_per_minute: float | None = None):
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+
+    def acquire(self, estimated_tokens: int) -> None:
+        if self.requests is not None:
+            self.requests.acquire(1)
+        if self.tokens is not None:
+            self.tokens.acquire(estimated_tokens)
+
+    def settle(self, estimated_tokens: int, actual_tokens: int) -> None:
+        if self.tokens is not None and actual_tokens:
+            self.tokens.adjust(actual_tokens - estimated_tokens)
+
+
+_rate_limiters: dict[tuple[str, str | None], RateLimiter] = {}
+
+
+def configure_rate_limits(limits: list[dict] | None = None) -> None:
+    """プロセス全体で共有するレート制限を設定する
+
+    Args:
+        limits: [{"provider": "openai", "model": "gpt-4o-mini", "requests_per_minute": 500, "tokens_per_minute": 200000}]
+            の形式のリスト。modelを省略するとプロバイダー全体の制限になる。
+            Noneの場合は環境変数 LLM_RATE_LIMITS（同じ形式のJSON）から読み込む。
+    """
+    if limits is None:
+        limits = json.loads(os.getenv("LLM_RATE_LIMITS") or "[]")
+    _rate_limiters.clear()
+    for limit in limits:
+        _rate_limiters[(limit["provider"], limit.get("model"))] = RateLimiter(
+            requests_per_minute=limit.get("requests_per_minute"),
+            tokens_per_minute=limit.get("tokens_per_minute"),
+        )
+
+
+def get_rate_limiter(provider: str, model: str | None) -> RateLimiter | None:
+    """モデル単位の制限を優先し、なければプロバイダー全体の制限を返す"""
+    return _rate_limiters.get((provider, model)) or _rate_limiters.get((provider, None))
+
+
+def _estimate_message_tokens(messages: list[dict]) -> int:
+    """入力トークン数の概算。日本語はおおよそ1文字1トークン以下のため、文字数を上限の目安として使う"""
+    return sum(len(m["content"]) for m in messages if isinstance(m.get("content"), str))
+
+
+# _send_chat_request が送信中のリクエストの (RateLimiter, 見積もりトークン数)。スレッドごとに保持する
+_rate_limit_context = threading.local()
+
+
+def _acquire_for_retry(retry_state=None) -> None:
+    """プロバイダー関数内のリトライ（2回目以降の試行）でも、送信前にレート制限のトークンを取得する
+
+    tenacity の before に渡すほか、独自にリトライするプロバイダーは2回目以降の試行の前に呼ぶ。
+    """
+    if retry_state is not None and retry_state.attempt_number == 1:
+        # 1回目の試行分は _send_chat_request で取得済み
+        return
+    pending = getattr(_rate_limit_context, "pending", None)
+    if pending is not None:
+        limiter, estimated_tokens = pending
+        limiter.acquire(estimated_tokens)
+
 
 @retry(
     retry=retry_if_exception_type(openai.RateLimitError),
     wait=wait_exponential(multiplier=3, min=3, max=20),
     stop=stop_after_attempt(3),
+    before=_acquire_for_retry,
     reraise=True,
 )
 def request_to_openai(
@@ -34,6 +147,7 @@ def request_to_openai(
     is_json: bool = False,
     json_schema: dict | type[BaseModel] | None = None,
     user_api_key: str | None = None,
+    timeout: float = DEFAULT_REQUEST_TIMEOUT,
 ) -> tuple[str, int, int, int]:  # 戻り値を文字列とトークン使用量(入力・出力・合計)のタプルに変更
     openai.api_type = "openai"
     token_usage_input = 0  # 入力トークン使用量を追跡する変数
@@ -52,7 +166,7 @@ def request_to_openai(
                 n=1,
                 seed=0,
                 response_format=json_schema,
-                timeout=30,
+                timeout=timeout,
             )
             if hasattr(response, "usage") and response.usage:
                 token_usage_input = response.usage.prompt_tokens or 0
@@ -73,7 +187,7 @@ def request_to_openai(
                 "temperature": 0,
                 "n": 1,
                 "seed": 0,
-                "timeout": 30,
+                "timeout": timeout,
             }
             if response_format:
                 payload["response_format"] = response_format
@@ -101,6 +215,7 @@ def request_to_openai(
     retry=retry_if_exception_type(openai.RateLimitError),
     wait=wait_exponential(multiplier=1, min=2, max=20),
     stop=stop_after_attempt(3),
+    before=_acquire_for_retry,
     reraise=True,
 )
 def request_to_azure_chatcompletion(
@@ -108,6 +223,7 @@ def request_to_azure_chatcompletion(
     is_json: bool = False,
     json_schema: dict | type[BaseModel] | None = None,
     user_api_key: str | None = None,
+    timeout: float = DEFAULT_REQUEST_TIMEOUT,
 ) -> tuple[str, int, int, int]:  # 戻り値を文字列とトークン使用量(入力・出力・合計)のタプルに変更
     azure_endpoint = os.getenv("AZURE_CHATCOMPLETION_ENDPOINT")
     deployment = os.getenv("AZURE_CHATCOMPLETION_DEPLOYMENT_NAME")
@@ -152,7 +268,7 @@ def request_to_azure_chatcompletion(
                 n=1,
                 seed=0,
                 response_format=json_schema,
-                timeout=30,
+                timeout=timeout,
             )
             if hasattr(response, "usage") and response.usage:
                 token_usage_input = response.usage.prompt_tokens or 0
@@ -177,7 +293,7 @@ def request_to_azure_chatcompletion(
                 "temperature": 0,
                 "n": 1,
                 "seed": 0,
-                "timeout": 30,
+                "timeout": timeout,
             }
             if response_format:
                 payload["response_format"] = response_format
@@ -207,6 +323,7 @@ def request_to_gemini_chatcompletion(
     is_json: bool = False,
     json_schema: dict | type[BaseModel] | None = None,
     user_api_key: str | None = None,
+    timeout: float = DEFAULT_REQUEST_TIMEOUT,
 ) -> tuple[str, int, int, int]:
     token_usage_input = 0
     token_usage_output = 0
@@ -298,8 +415,12 @@ def request_to_gemini_chatcompletion(
     base_wait = 8
 
     for attempt in range(max_retries):
+        if attempt > 0:
+            _acquire_for_retry()
         try:
-            response = model_client.generate_content(history, generation_config=generation_config)
+            response = model_client.generate_content(
+                history, generation_config=generation_config, request_options={"timeout": timeout}
+            )
             usage = getattr(response, "usage_metadata", None)
             if usage:
                 token_usage_input = getattr(usage, "prompt_token_count", 0) or 0
@@ -401,6 +522,7 @@ def request_to_local_llm(
     is_json: bool = False,
     json_schema: dict | type[BaseModel] | None = None,
     address: str = "localhost:11434",
+    timeout: float = DEFAULT_REQUEST_TIMEOUT,
 ) -> tuple[str, int, int, int]:  # 戻り値を文字列とトークン使用量(入力・出力・合計)のタプルに変更
     """ローカルLLM（OllamaやLM Studio）にリクエストを送信する関数
 
@@ -412,6 +534,7 @@ def request_to_local_llm(
         is_json: JSONレスポンスを要求するかどうか
         json_schema: JSONスキーマ（Pydanticモデルまたは辞書）
         address: ローカルLLMのアドレス（例: 127.0.0.1:1234）
+        timeout: 1回のリクエストのタイムアウト（秒）
 
     Returns:
         LLMからのレスポンスとトークン使用量(入力・出力・合計)のタプル
@@ -460,7 +583,7 @@ def request_to_local_llm(
             "temperature": 0,
             "n": 1,
             "seed": 0,
-            "timeout": 30,
+            "timeout": timeout,
         }
 
         if response_format:
@@ -489,6 +612,8 @@ def request_to_chat_ai(
     provider: str = "openai",
     local_llm_address: str | None = None,
     user_api_key: str | None = None,
+    timeout: float = DEFAULT_REQUEST_TIMEOUT,
+    validate: Callable[[Any], bool] | None = None,
 ) -> tuple[str, int, int, int]:  # 戻り値を文字列とトークン使用量(入力・出力・合計)のタプルに変更
     """AIプロバイダーにチャットリクエストを送信する関数
 
@@ -499,6 +624,8 @@ def request_to_chat_ai(
         json_schema: JSONスキーマ（Pydanticモデルまたは辞書）
         provider: 使用するプロバイダー（"openai", "azure", "local", "openrouter", "gemini"）
         local_llm_address: ローカルLLMのアドレス（provider="local"の場合のみ使用）
+        timeout: プロバイダーへの1回のリクエストのタイムアウト（秒）
+        validate: 呼び出し側がレスポンスを解釈できるかを返す関数。Falseを返したレスポンスはキャッシュに保存しない
 
     Returns:
         AIからのレスポンスとトークン使用量(入力・出力・合計)のタプル
@@ -509,19 +636,105 @@ def request_to_chat_ai(
         - provider="local": ローカルLLM（OllamaやLM Studio）を使用
         - provider="openrouter": OpenRouter APIを使用（OpenAIやGeminiのモデルにアクセス可能）
         - provider="gemini": Google Gemini APIを使用
+        - enable_llm_cache() で有効化されている場合、同一リクエストはキャッシュから返す（トークン使用量は0）。
+          キャッシュ済みのレスポンスが validate を満たさない場合は削除して送信し直す
+        - configure_rate_limits() でレート制限が設定されている場合、制限内に収まるよう送信を待機する
+    """
+    cache = get_llm_cache()
+    if cache is None:
+        return _send_chat_request(
+            messages, model, is_json, json_schema, provider, local_llm_address, user_api_key, timeout
+        )
+
+    cache_key = build_cache_key(
+        provider, _resolve_cache_model(provider, model, local_llm_address), messages, is_json, json_schema
+    )
+    cached_response = cache.get(cache_key)
+    if cached_response is not None:
+        if validate is None or validate(cached_response):
+            logging.debug(f"LLM cache hit: {cache_key}")
+            return cached_response, 0, 0, 0
+        logging.debug(f"LLM cache: discard unparsable response: {cache_key}")
+        cache.delete(cache_key)
+
+    result = _send_chat_request(
+        messages, model, is_json, json_schema, provider, local_llm_address, user_api_key, timeout
+    )
+    if result[0] and (validate is None or validate(result[0])):
+        cache.set(cache_key, result[0])
+    return result
+
+
+def _send_chat_request(
+    messages: list[dict],
+    model: str,
+    is_json: bool,
+    json_schema: dict | type[BaseModel] | None,
+    provider: str,
+    local_llm_address: str | None,
+    user_api_key: str | None,
+    timeout: float,
+) -> tuple[str, int, int, int]:
+    """レート制限が設定されていれば、その範囲内に収まるよう待ってからリクエストを送信する
+
+    プロバイダー関数内でリトライする場合も、試行ごとに _acquire_for_retry でトークンを取得する。
     """
+    limiter = get_rate_limiter(provider, _resolve_provider_model(provider, model))
+    if limiter is None:
+        return _request_to_provider(
+            messages, model, is_json, json_schema, provider, local_llm_address, user_api_key, timeout
+        )
+
+    estimated_tokens = _estimate_message_tokens(messages)
+    limiter.acquire(estimated_tokens)
+    _rate_limit_context.pending = (limiter, estimated_tokens)
+    try:
+        result = _request_to_provider(
+            messages, model, is_json, json_schema, provider, local_llm_address, user_api_key, timeout
+        )
+    finally:
+        _rate_limit_context.pending = None
+    # 出力トークンも含めた実際の使用量で精算する
+    limiter.settle(estimated_tokens, result[3])
+    return result
+
+
+def _resolve_provider_model(provider: str, model: str) -> str:
+    """実際にリクエストされるモデル名を返す（Azureではmodel引数ではなくデプロイメント名でモデルが決まる）"""
     if provider == "azure":
-        return request_to_azure_chatcompletion(messages, is_json, json_schema, user_api_key)
+        return os.getenv("AZURE_CHATCOMPLETION_DEPLOYMENT_NAME") or model
+    return model
+
+
+def _resolve_cache_model(provider: str, model: str, local_llm_address: str | None) -> str:
+    """キャッシュキーに使うモデル名を、実際にリクエストされるモデルに合わせて解決する"""
+    if provider == "local":
+        return f"{local_llm_address or 'localhost:11434'}/{model}"
+    return _resolve_provider_model(provider, model)
+
+
+def _request_to_provider(
+    messages: list[dict],
+    model: str,
+    is_json: bool,
+    json_schema: dict | type[BaseModel] | None,
+    provider: str,
+    local_llm_address: str | None,
+    user_api_key: str | None,
+    timeout: float,
+) -> tuple[str, int, int, int]:
+    if provider == "azure":
+        return request_to_azure_chatcompletion(messages, is_json, json_schema, user_api_key, timeout)
     elif provider == "openai":
-        return request_to_openai(messages, model, is_json, json_schema, user_api_key)
+        return request_to_openai(messages, model, is_json, json_schema, user_api_key, timeout)
     elif provider == "local":
         address = local_llm_address or "localhost:11434"
-        return request_to_local_llm(messages, model, is_json, json_schema, address)
+        return request_to_local_llm(messages, model, is_json, json_schema, address, timeout)
     elif provider == "gemini":
-        return request_to_gemini_chatcompletion(messages, model, is_json, json_schema, user_api_key)
+        return request_to_gemini_chatcompletion(messages, model, is_json, json_schema, user_api_key, timeout)
     elif provider == "openrouter":
         # OpenRouterのモデル名を直接使用
-        return request_to_openrouter_chatcompletion(messages, model, is_json, json_schema, user_api_key)
+        return request_to_openrouter_chatcompletion(messages, model, is_json, json_schema, user_api_key, timeout)
     else:
         raise ValueError(f"Unknown provider: {provider}")
 
@@ -590,6 +803,11 @@ def request_to_embed(
     if is_embedded_at_local:
         return request_to_local_embed(args)
 
+    limiter = get_rate_limiter(provider, model)
+    if limiter is not None:
+        texts = [args] if isinstance(args, str) else args
+        limiter.acquire(sum(len(text) for text in texts))
+
     if provider == "azure":
         logging.info("request_to_azure_embed")
         return request_to_azure_embed(args, model, user_api_key)
@@ -724,6 +942,8 @@ def request_to_azure_embed(args, model, user_api_key: str | None = None):
     return [item.embedding for item in response.data]
 
 
+LOCAL_EMBEDDING_MODEL = "sentence-transformers/paraphrase-multilingual-mpnet-base-v2"
+
 __local_emb_model = None
 __local_emb_model_loading_lock = threading.Lock()
 
@@ -737,8 +957,7 @@ def request_to_local_embed(args):
         if __local_emb_model is None:
             from sentence_transformers import SentenceTransformer
 
-            model_name = "sentence-transformers/paraphrase-multilingual-mpnet-base-v2"
-            __local_emb_model = SentenceTransformer(model_name)
+            __local_emb_model = SentenceTransformer(LOCAL_EMBEDDING_MODEL)
 
     result = __local_emb_model.encode(args)
     return result.tolist()
@@ -849,6 +1068,7 @@ def _local_llm_test():
     retry=retry_if_exception_type(openai.RateLimitError),
     wait=wait_exponential(multiplier=3, min=3, max=20),
     stop=stop_after_attempt(3),
+    before=_acquire_for_retry,
     reraise=True,
 )
 def request_to_openrouter_chatcompletion(
@@ -857,6 +1077,7 @@ def request_to_openrouter_chatcompletion(
     is_json: bool = False,
     json_schema: dict | type[BaseModel] = None,
     user_api_key: str | None = None,
+    timeout: float = DEFAULT_REQUEST_TIMEOUT,
 ) -> tuple[str, int, int, int]:  # 戻り値を文字列とトークン使用量(入力・出力・合計)のタプルに変更
     api_key = user_api_key or os.getenv("OPENROUTER_API_KEY")
     if not api_key:
@@ -880,7 +1101,7 @@ def request_to_openrouter_chatcompletion(
                 n=1,
                 seed=0,
                 response_format=json_schema,
-                timeout=30,
+                timeout=timeout,
             )
             if hasattr(response, "usage") and response.usage:
                 token_usage_input = response.usage.prompt_tokens or 0
@@ -894,7 +1115,7 @@ def request_to_openrouter_chatcompletion(
                 "temperature": 0,
                 "n": 1,
                 "seed": 0,
-                "timeout": 30,
+                "timeout": timeout,
             }
 
             if is_json:
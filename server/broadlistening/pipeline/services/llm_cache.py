@@ -0,0 +1,169 @@
+"""LLMレスポンスの永続キャッシュ
+
+全てのチャットリクエストは temperature=0, seed=0 で送信しているため、
+同一の (プロバイダー, モデル, メッセージ, スキーマ) に対する応答は再利用できる。
+パイプラインを再実行した際に、変更のないリクエストをディスクから返すためのキャッシュ。
+"""
+
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any
+
+from pydantic import BaseModel
+
+DEFAULT_CACHE_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), "../cache/llm_responses.sqlite3"))
+DEFAULT_MAX_SIZE_MB = 1024
+
+# キャッシュキーの形式を変更した場合はバージョンを上げる
+CACHE_KEY_VERSION = 1
+
+
+def _schema_to_jsonable(json_schema: dict | type[BaseModel] | None) -> Any:
+    if isinstance(json_schema, type) and issubclass(json_schema, BaseModel):
+        return {"pydantic": json_schema.__name__, "schema": json_schema.model_json_schema()}
+    return json_schema
+
+
+def build_cache_key(
+    provider: str,
+    model: str,
+    messages: list[dict],
+    is_json: bool = False,
+    json_schema: dict | type[BaseModel] | None = None,
+) -> str:
+    """リクエスト内容から決定的なキャッシュキー（SHA-256）を生成する"""
+    payload = {
+        "version": CACHE_KEY_VERSION,
+        "provider": provider,
+        "model": model,
+        "messages": messages,
+        "is_json": is_json,
+        "json_schema": _schema_to_jsonable(json_schema),
+    }
+    serialized = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+
+
+class LLMResponseCache:
+    """SQLiteに保存する、サイズ上限付きLRUのレスポンスキャッシュ
+
+    複数スレッドから同時に呼び出されるため、接続は1つに限定してロックで保護する。
+    複数プロセスからの同時利用はSQLiteのロックに任せる。
+    """
+
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, max_size_bytes: int = DEFAULT_MAX_SIZE_MB * 1024 * 1024):
+        self.path = path
+        self.max_size_bytes = max_size_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                response TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                last_access REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)")
+        self._conn.commit()
+        self._total_size = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def get(self, key: str) -> Any | None:
+        """キャッシュされたレスポンスを返す。存在しない場合はNone"""
+        with self._lock:
+            row = self._conn.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+            self.hits += 1
+        return json.loads(row[0])
+
+    def set(self, key: str, response: Any) -> None:
+        """レスポンスを保存する。JSONにできないレスポンスは保存しない"""
+        try:
+            serialized = json.dumps(response, ensure_ascii=False)
+        except (TypeError, ValueError):
+            logging.debug("LLM cache: skip non-serializable response")
+            return
+        size = len(serialized.encode("utf-8"))
+        if size > self.max_size_bytes:
+            return
+
+        with self._lock:
+            previous = self._conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, response, size, last_access) VALUES (?, ?, ?, ?)",
+                (key, serialized, size, time.time()),
+            )
+            self._total_size += size - (previous[0] if previous else 0)
+            if self._total_size > self.max_size_bytes:
+                self._evict()
+            self._conn.commit()
+
+    def delete(self, key: str) -> None:
+        """キャッシュからレスポンスを削除する"""
+        with self._lock:
+            row = self._conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return
+            self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self._total_size -= row[0]
+            self._conn.commit()
+
+    def _evict(self) -> None:
+        """最終アクセスが古いものから、上限の9割に収まるまで削除する（ロック取得済みで呼ぶこと）"""
+        target = int(self.max_size_bytes * 0.9)
+        evicted_keys = []
+        for key, size in self._conn.execute("SELECT key, size FROM responses ORDER BY last_access ASC"):
+            if self._total_size <= target:
+                break
+            evicted_keys.append((key,))
+            self._total_size -= size
+        self._conn.executemany("DELETE FROM responses WHERE key = ?", evicted_keys)
+        logging.info(f"LLM cache: evicted {len(evicted_keys)} entries")
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+_llm_cache: LLMResponseCache | None = None
+
+
+def enable_llm_cache(path: str | None = None, max_size_mb: int | None = None) -> LLMResponseCache:
+    """プロセス全体で使うキャッシュを有効化する
+
+    パスと上限サイズは引数 > 環境変数(LLM_CACHE_PATH, LLM_CACHE_MAX_SIZE_MB) > デフォルト値の順で決まる。
+    """
+    global _llm_cache
+    path = path or os.getenv("LLM_CACHE_PATH") or DEFAULT_CACHE_PATH
+    max_size_mb = max_size_mb or int(os.getenv("LLM_CACHE_MAX_SIZE_MB", DEFAULT_MAX_SIZE_MB))
+    if _llm_cache is not None:
+        _llm_cache.close()
+    _llm_cache = LLMResponseCache(path, max_size_mb * 1024 * 1024)
+    return _llm_cache
+
+
+def disable_llm_cache() -> None:
+    global _llm_cache
+    if _llm_cache is not None:
+        _llm_cache.close()
+    _llm_cache = None
+
+
+def get_llm_cache() -> LLMResponseCache | None:
+    return _llm_cache
@@ -102,6 +102,47 @@ def parse_extraction_response(response: str | dict) -> list[str]:
         return []
 
 
+def parse_batch_extraction_response(response: str | dict) -> dict[str, list[str]]:
+    """
+    複数コメントをまとめて抽出したstructured outputのresponseをパースし、commentIdごとの意見のリストを返す。
+    responseは以下のような形式の文字列。
+    {"results": [{"commentId": "1", "extractedOpinionList": ["arg1", "arg2"]}, ...]}
+    解釈できない要素は結果に含めない（呼び出し側で1件ずつ抽出し直す）。
+    """
+
+    try:
+        response_dict = response if isinstance(response, dict) else json.loads(response)
+        results = {}
+        for item in response_dict["results"]:
+            opinions = item.get("extractedOpinionList")
+            if isinstance(opinions, list):
+                results[str(item["commentId"])] = opinions
+        return results
+    except Exception as e:
+        print("Failed to parse batch extraction response", response, e)
+        return {}
+
+
+def has_json_key(response: str | dict, key: str) -> bool:
+    """
+    responseが、keyを持つJSONオブジェクトとして解釈できるかを返す。
+    解釈できないレスポンスをLLMキャッシュに保存しないための判定に使う。
+
+    >>> has_json_key('{"label": "交通"}', "label")
+    True
+    >>> has_json_key('{"label": "交通"', "label")
+    False
+    >>> has_json_key({"results": []}, "label")
+    False
+    """
+
+    try:
+        response_dict = response if isinstance(response, dict) else json.loads(response)
+    except (TypeError, ValueError):
+        return False
+    return isinstance(response_dict, dict) and key in response_dict
+
+
 if __name__ == "__main__":
     import doctest
 
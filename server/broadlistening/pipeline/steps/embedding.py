@@ -1,9 +1,17 @@
+import logging
 import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-import pandas as pd
+import numpy as np
+import openai
 from tqdm import tqdm
 
-from services.llm import request_to_embed
+from artifacts import artifact_context, save_embeddings
+from services.embedding_cache import get_embedding_cache
+from services.llm import LOCAL_EMBEDDING_MODEL, request_to_embed
 
 
 def embedding(config):
@@ -13,13 +21,24 @@ def embedding(config):
     # print(f"embedding model: {model}, is_embedded_at_local: {is_embedded_at_local}")
 
     dataset = config["output_dir"]
-    path = f"outputs/{dataset}/embeddings.pkl"
-    arguments = pd.read_csv(f"outputs/{dataset}/args.csv", usecols=["arg-id", "argument"])
-    embeddings = []
-    batch_size = 1000
-    for i in tqdm(range(0, len(arguments), batch_size)):
-        args = arguments["argument"].tolist()[i : i + batch_size]
-        embeds = request_to_embed(
+    arguments = artifact_context().read(f"outputs/{dataset}/args.csv")[["arg-id", "argument"]]
+    texts = arguments["argument"].tolist()
+
+    cache = get_embedding_cache(*_cache_identity(config))
+    embeddings = cache.get_many(texts) if cache is not None else [None] * len(texts)
+    # キャッシュにないテキストだけを重複なく埋め込む
+    missing_texts = list(dict.fromkeys(text for text, e in zip(texts, embeddings, strict=True) if e is None))
+    cached_num = sum(e is not None for e in embeddings)
+    print(f"Embedding: {cached_num} cached, {len(missing_texts)} unique texts to request")
+
+    # ローカルのSentenceTransformerはスレッドセーフでないため並列化しない
+    workers = 1 if is_embedded_at_local else config["embedding"]["workers"]
+    batches = _make_batches(missing_texts, config["embedding"]["batch_size"], config["embedding"]["batch_max_tokens"])
+    backoff = _get_backoff("local" if is_embedded_at_local else config["provider"])
+
+    def embed_batch(args: list[str]) -> list[list[float]]:
+        embeds = _request_with_backoff(
+            backoff,
             args,
             model,
             is_embedded_at_local,
@@ -27,6 +46,116 @@ def embedding(config):
             local_llm_address=config.get("local_llm_address"),
             user_api_key=os.getenv("USER_API_KEY"),
         )
-        embeddings.extend(embeds)
-    df = pd.DataFrame([{"arg-id": arguments.iloc[i]["arg-id"], "embedding": e} for i, e in enumerate(embeddings)])
-    df.to_pickle(path)
+        if cache is not None:
+            cache.add_many(args, embeds)
+        return embeds
+
+    new_embeddings = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(embed_batch, batch): batch for batch in batches}
+        for future in tqdm(as_completed(futures), total=len(futures)):
+            new_embeddings.update(zip(futures[future], future.result(), strict=True))
+
+    embeddings = [new_embeddings[text] if e is None else e for text, e in zip(texts, embeddings, strict=True)]
+    save_embeddings(f"outputs/{dataset}", arguments["arg-id"].tolist(), np.asarray(embeddings, dtype=np.float32))
+
+
+def _estimate_tokens(text: str) -> int:
+    """トークン数の概算。日本語はおおよそ1文字1トークン以下のため、文字数を上限の目安として使う"""
+    return max(1, len(text))
+
+
+def _make_batches(texts: list[str], max_items: int, max_tokens: int) -> list[list[str]]:
+    """件数とトークン数の両方の上限を超えないようにテキストをバッチに分割する"""
+    batches: list[list[str]] = []
+    current: list[str] = []
+    current_tokens = 0
+    for text in texts:
+        tokens = _estimate_tokens(text)
+        if current and (len(current) >= max_items or current_tokens + tokens > max_tokens):
+            batches.append(current)
+            current, current_tokens = [], 0
+        current.append(text)
+        current_tokens += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+
+class RateLimitBackoff:
+    """プロバイダー単位で共有するバックオフ状態
+
+    あるバッチがレート制限に当たったら、同じプロバイダーへの他のバッチの送信も一緒に待たせる。
+    """
+
+    def __init__(self, base_wait: float = 2.0, max_wait: float = 60.0):
+        self.base_wait = base_wait
+        self.max_wait = max_wait
+        self._lock = threading.Lock()
+        self._resume_at = 0.0
+        self._consecutive_failures = 0
+
+    def wait(self) -> None:
+        delay = self._resume_at - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+    def failed(self) -> float:
+        with self._lock:
+            self._consecutive_failures += 1
+            # ジッターを含む指数バックオフ: base * 2^(n-1) * (0.5 ~ 1.5)
+            delay = min(self.max_wait, self.base_wait * 2 ** (self._consecutive_failures - 1)) * (0.5 + random.random())
+            self._resume_at = max(self._resume_at, time.monotonic() + delay)
+            return delay
+
+    def succeeded(self) -> None:
+        with self._lock:
+            self._consecutive_failures = 0
+
+
+_backoffs: dict[str, RateLimitBackoff] = {}
+_backoffs_lock = threading.Lock()
+
+
+def _get_backoff(provider: str) -> RateLimitBackoff:
+    with _backoffs_lock:
+        if provider not in _backoffs:
+            _backoffs[provider] = RateLimitBackoff()
+        return _backoffs[provider]
+
+
+def _is_rate_limit_error(e: Exception) -> bool:
+    if isinstance(e, openai.RateLimitError):
+        return True
+    # Gemini(ResourceExhausted)など、openai以外のクライアントのレート制限エラー
+    return getattr(e, "code", None) == 429 or getattr(e, "status_code", None) == 429
+
+
+def _request_with_backoff(
+    backoff: RateLimitBackoff, args: list[str], *request_args, max_attempts: int = 6, **request_kwargs
+):
+    for attempt in range(1, max_attempts + 1):
+        backoff.wait()
+        try:
+            embeds = request_to_embed(args, *request_args, **request_kwargs)
+            backoff.succeeded()
+            return embeds
+        except Exception as e:
+            if not _is_rate_limit_error(e) or attempt == max_attempts:
+                raise
+            delay = backoff.failed()
+            logging.warning(f"Embedding rate limit hit, retrying after {delay:.1f}s (attempt {attempt}/{max_attempts})")
+
+
+def _cache_identity(config) -> tuple[str, str]:
+    """埋め込みキャッシュのキーとなる (プロバイダー, モデル) を、実際に使われるモデルに合わせて解決する"""
+    if config["is_embedded_at_local"]:
+        return "sentence-transformers", LOCAL_EMBEDDING_MODEL
+    provider = config["provider"]
+    model = config["embedding"]["model"]
+    if provider == "azure":
+        # Azureではmodel引数ではなくデプロイメント名でモデルが決まる
+        return provider, os.getenv("AZURE_EMBEDDING_DEPLOYMENT_NAME") or model
+    if provider == "local":
+        return provider, f"{config.get('local_llm_address') or 'localhost:11434'}/{model}"
+    return provider, model
@@ -1,24 +1,55 @@
 import concurrent.futures
+import hashlib
 import json
 import logging
 import os
 import re
+import threading
+import time
 
 import pandas as pd
 from pydantic import BaseModel, Field
 from tqdm import tqdm
 
+from artifacts import artifact_context, artifact_format, write_artifact
+from hierarchical_utils import update_status
+from services.batch_api import DEFAULT_POLL_INTERVAL, BatchRequest, create_batch_backend, run_batch
 from services.llm import request_to_chat_ai
-from services.parse_json_list import parse_extraction_response
+from services.parse_json_list import has_json_key, parse_batch_extraction_response, parse_extraction_response
 from utils import update_progress
 
 COMMA_AND_SPACE_AND_RIGHT_BRACKET = re.compile(r",\s*(\])")
+# 1件の抽出リクエストを待つ最大秒数のデフォルト値
+EXTRACTION_TIMEOUT = 30
+# コメントごとの抽出結果を逐次追記するファイル。中断後の再実行ではここから再開する
+CHECKPOINT_FILENAME = "extraction_checkpoint.jsonl"
+# 再試行しても抽出できなかったコメントの一覧
+FAILURE_REPORT_FILENAME = "extraction_failed.csv"
 
 
 class ExtractionResponse(BaseModel):
     extractedOpinionList: list[str] = Field(..., description="抽出した意見のリスト")
 
 
+class CommentExtraction(BaseModel):
+    commentId: str = Field(..., description="入力のcommentId")
+    extractedOpinionList: list[str] = Field(..., description="このコメントから抽出した意見のリスト")
+
+
+class BatchExtractionResponse(BaseModel):
+    results: list[CommentExtraction] = Field(..., description="コメントごとの抽出結果")
+
+
+# 複数コメントをまとめて抽出する際に、ユーザー指定のプロンプトの後ろに追加する指示
+BATCH_EXTRACTION_INSTRUCTION = """
+
+# 複数コメントの一括処理
+入力は {"comments": [{"commentId": "...", "text": "..."}, ...]} 形式のJSONで、複数のコメントを含みます。
+各コメントについて上記の指示に従って個別に意見を抽出し、commentIdごとに結果を返してください。
+あるコメントの結果に、他のコメントの内容を混ぜないでください。
+"""
+
+
 def _validate_property_columns(property_columns: list[str], comments: pd.DataFrame) -> None:
     if not all(property in comments.columns for property in property_columns):
         raise ValueError(f"Properties {property_columns} not found in comments. Columns are {comments.columns}")
@@ -41,9 +72,9 @@ def extraction(config):
     comments = pd.read_csv(f"inputs/{config['input']}.csv", nrows=0)
     _validate_property_columns(property_columns, comments)
     # エラーが出なかった場合、すべての行を読み込む
-    comments = pd.read_csv(
-        f"inputs/{config['input']}.csv", usecols=["comment-id", "comment-body"] + config["extraction"]["properties"]
-    )
+    comments = artifact_context().read(f"inputs/{config['input']}.csv")[
+        ["comment-id", "comment-body"] + config["extraction"]["properties"]
+    ]
     comment_ids = (comments["comment-id"].values)[:limit]
     comments.set_index("comment-id", inplace=True)
     results = pd.DataFrame()
@@ -52,34 +83,140 @@ def extraction(config):
     argument_map = {}
     relation_rows = []
 
-    for i in tqdm(range(0, len(comment_ids), workers)):
-        batch = comment_ids[i : i + workers]
-        batch_inputs = [comments.loc[id]["comment-body"] for id in batch]
-        batch_results = extract_batch(
-            batch_inputs, prompt, model, workers, provider, config.get("local_llm_address"), config
-        )
+    def add_arguments(comment_id, extracted_args):
+        for j, arg in enumerate(extracted_args):
+            if arg not in argument_map:
+                # argumentテーブルに追加
+                arg_id = f"A{comment_id}_{j}"
+                argument = arg
+                argument_map[arg] = {
+                    "arg-id": arg_id,
+                    "argument": argument,
+                }
+            else:
+                arg_id = argument_map[arg]["arg-id"]
+
+            # relationテーブルにcommentとargの関係を追加
+            relation_row = {
+                "arg-id": arg_id,
+                "comment-id": comment_id,
+            }
+            relation_rows.append(relation_row)
+
+    inputs = [comments.loc[id]["comment-body"] for id in comment_ids]
+    keys = [_checkpoint_key(prompt, model, provider, input) for input in inputs]
+
+    checkpoint_path = f"outputs/{dataset}/{CHECKPOINT_FILENAME}"
+    if _should_resume(config):
+        checkpoint = _load_checkpoint(checkpoint_path)
+    else:
+        checkpoint = {}
+        if os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
+
+    # 結果は完了順に届くが、重複する意見のarg-idが実行ごとに変わらないよう入力順に反映する
+    pending = {}
+    for index, (comment_id, key) in enumerate(zip(comment_ids, keys, strict=True)):
+        saved = checkpoint.get(str(comment_id))
+        if saved is not None and saved["key"] == key:
+            pending[index] = saved["arguments"]
+    remaining = [index for index in range(len(inputs)) if index not in pending]
+    if pending:
+        print(f"Extraction: resuming from checkpoint, {len(pending)} comments already extracted")
+        update_progress(config, incr=len(pending))
+
+    next_index = 0
+
+    def flush():
+        nonlocal next_index
+        while next_index in pending:
+            add_arguments(comment_ids[next_index], pending.pop(next_index))
+            next_index += 1
 
-        for comment_id, extracted_args in zip(batch, batch_results, strict=False):
-            for j, arg in enumerate(extracted_args):
-                if arg not in argument_map:
-                    # argumentテーブルに追加
-                    arg_id = f"A{comment_id}_{j}"
-                    argument = arg
-                    argument_map[arg] = {
-                        "arg-id": arg_id,
-                        "argument": argument,
-                    }
+    flush()
+    failures = {}  # index -> 直近の失敗理由
+    attempts = dict.fromkeys(remaining, 0)
+
+    with open(checkpoint_path, "a", encoding="utf-8") as checkpoint_file:
+
+        def run_pass(indices, timeout, report_progress, comments_per_request=1, use_batch_api=False):
+            if comments_per_request > 1:
+                groups = _pack_comments(
+                    indices, inputs, comments_per_request, config["extraction"]["request_max_tokens"]
+                )
+                units = [[(str(comment_ids[index]), inputs[index]) for index in group] for group in groups]
+                extract_fn = extract_arguments_batch
+            else:
+                groups = [[index] for index in indices]
+                units = [inputs[index] for index in indices]
+                extract_fn = None
+            if use_batch_api:
+                stream = extract_with_batch_api(
+                    units, prompt, model, config, "extraction", batched=comments_per_request > 1
+                )
+            else:
+                stream = extract_stream(
+                    units,
+                    prompt,
+                    model,
+                    workers,
+                    provider,
+                    config.get("local_llm_address"),
+                    config,
+                    timeout=timeout,
+                    extract_fn=extract_fn,
+                )
+            for i, extracted, error in tqdm(stream, total=len(units)):
+                group = groups[i]
+                if error is not None:
+                    extracted_per_comment = [None] * len(group)
+                elif comments_per_request > 1:
+                    extracted_per_comment = extracted
                 else:
-                    arg_id = argument_map[arg]["arg-id"]
+                    extracted_per_comment = [extracted]
+                for index, extracted_args in zip(group, extracted_per_comment, strict=True):
+                    attempts[index] += 1
+                    if error is not None:
+                        # 失敗したコメントはチェックポイントに残さず、再試行キューに回す
+                        failures[index] = error
+                    else:
+                        failures.pop(index, None)
+                        _append_checkpoint(checkpoint_file, comment_ids[index], keys[index], extracted_args)
+                        pending[index] = extracted_args
+                        flush()
+                if report_progress:
+                    update_progress(config, incr=len(group))
 
-                # relationテーブルにcommentとargの関係を追加
-                relation_row = {
-                    "arg-id": arg_id,
-                    "comment-id": comment_id,
-                }
-                relation_rows.append(relation_row)
+        run_pass(
+            remaining,
+            config["extraction"]["timeout"],
+            report_progress=True,
+            comments_per_request=config["extraction"]["comments_per_request"],
+            use_batch_api=config["extraction"]["execution_mode"] == "batch",
+        )
+        retried = len(failures)
+        # 再試行は、まとめて抽出する設定やバッチAPIを使う設定でも、通常のAPIで1件ずつ行う
+        for retry_timeout in config["extraction"]["retry_timeouts"]:
+            if not failures:
+                break
+            print(f"Extraction: retrying {len(failures)} failed comments (timeout={retry_timeout}s)")
+            run_pass(sorted(failures), retry_timeout, report_progress=False)
 
-        update_progress(config, incr=len(batch))
+    # 再試行しても失敗したコメントは意見なしとして扱い、一覧をファイルに残す
+    for index in failures:
+        pending[index] = []
+    flush()
+    _write_failure_report(
+        f"outputs/{dataset}/{FAILURE_REPORT_FILENAME}",
+        [(comment_ids[index], attempts[index], failures[index]) for index in sorted(failures)],
+    )
+    config["extraction_retry_summary"] = {
+        "retried": retried,
+        "recovered": retried - len(failures),
+        "failed": len(failures),
+    }
+    if failures:
+        logging.warning(f"Extraction: {len(failures)} comments failed after retries, see {FAILURE_REPORT_FILENAME}")
 
     # DataFrame化
     results = pd.DataFrame(argument_map.values())
@@ -88,63 +225,192 @@ def extraction(config):
     if results.empty:
         raise RuntimeError("result is empty, maybe bad prompt")
 
-    results.to_csv(path, index=False)
+    fmt = artifact_format(config)
+    write_artifact(results, path, fmt)
     # comment-idとarg-idの関係を保存
-    relation_df.to_csv(f"outputs/{dataset}/relations.csv", index=False)
+    write_artifact(relation_df, f"outputs/{dataset}/relations.csv", fmt)
 
 
 logging.basicConfig(level=logging.DEBUG)
 
 
-def extract_batch(batch, prompt, model, workers, provider="openai", local_llm_address=None, config=None):
-    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
-        futures_with_index = [
-            (i, executor.submit(extract_arguments, input, prompt, model, provider, local_llm_address))
-            for i, input in enumerate(batch)
-        ]
+def _checkpoint_key(prompt, model, provider, input):
+    """プロンプト・モデル・コメント本文のいずれかが変われば、保存済みの抽出結果は再利用しない"""
+    payload = json.dumps([prompt, model, provider, input], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _should_resume(config):
+    """decide_what_to_run がチェックポイントからの再開を計画した場合のみ、保存済みの抽出結果を再利用する"""
+    plan = [x for x in config.get("plan", []) if x["step"] == "extraction"]
+    return bool(plan) and plan[0].get("resume", False)
+
+
+def _load_checkpoint(path):
+    """comment-id(文字列) -> {"key", "arguments"} を返す。同じcomment-idが複数あれば後のものを優先する"""
+    checkpoint = {}
+    if not os.path.exists(path):
+        return checkpoint
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # 書き込み途中で中断された行は無視する
+                continue
+            checkpoint[record["comment-id"]] = {"key": record["key"], "arguments": record["arguments"]}
+    return checkpoint
+
+
+def _pack_comments(indices, inputs, max_comments, max_tokens):
+    """1リクエストにまとめるコメントを、件数とトークン数（文字数で概算）の上限を超えないようにグループ化する"""
+    groups = []
+    current = []
+    current_tokens = 0
+    for index in indices:
+        tokens = len(inputs[index])
+        if current and (len(current) >= max_comments or current_tokens + tokens > max_tokens):
+            groups.append(current)
+            current, current_tokens = [], 0
+        current.append(index)
+        current_tokens += tokens
+    if current:
+        groups.append(current)
+    return groups
+
+
+def _write_failure_report(path, rows):
+    """最終的に抽出できなかったコメントを (comment-id, 試行回数, 失敗理由) のCSVとして保存する"""
+    if not rows:
+        if os.path.exists(path):
+            os.remove(path)
+        return
+    pd.DataFrame(rows, columns=["comment-id", "attempts", "error"]).to_csv(path, index=False)
+
+
+def _append_checkpoint(file, comment_id, key, arguments):
+    record = {"comment-id": str(comment_id), "key": key, "arguments": arguments}
+    file.write(json.dumps(record, ensure_ascii=False) + "\n")
+    file.flush()
 
-        done, not_done = concurrent.futures.wait([f for _, f in futures_with_index], timeout=30)
-        results = [[] for _ in range(len(batch))]
-        total_token_input = 0
-        total_token_output = 0
-        total_token_usage = 0
 
-        for _, future in futures_with_index:
-            if future in not_done and not future.cancelled():
-                future.cancel()
+def extract_stream(
+    inputs,
+    prompt,
+    model,
+    workers,
+    provider="openai",
+    local_llm_address=None,
+    config=None,
+    timeout=EXTRACTION_TIMEOUT,
+    extract_fn=None,
+):
+    """常に最大workers件のリクエストを送信中に保ち、完了したものから (入力のindex, 抽出結果, 失敗理由) を返す
 
-        for i, future in futures_with_index:
-            if future in done:
+    バッチ単位で最も遅いリクエストを待つことはしない。
+    各入力は extract_fn（デフォルトは extract_arguments）で処理し、timeout をLLMクライアントのタイムアウトとしても渡す。
+    失敗したリクエストと timeout 秒を超えたリクエストは、待たずに抽出結果をNone、失敗理由を文字列として返す。
+    タイムアウトしたリクエストはworkersの数に含めず、すぐに次のリクエストを送信する。
+    """
+    in_flight = {}  # future -> 入力のindex
+    started_at = {}  # 入力のindex -> 実行開始時刻
+    next_index = 0
+    total_token_input = 0
+    total_token_output = 0
+    total_token_usage = 0
+
+    extract_fn = extract_fn or extract_arguments
+
+    try:
+        while next_index < len(inputs) or in_flight:
+            while next_index < len(inputs) and len(in_flight) < workers:
+                started_at[next_index] = time.monotonic()
+                future = _run_in_thread(
+                    extract_fn, inputs[next_index], prompt, model, provider, local_llm_address, timeout
+                )
+                in_flight[future] = next_index
+                next_index += 1
+
+            wait_timeout = max(0, min(started_at[index] for index in in_flight.values()) + timeout - time.monotonic())
+            done, _ = concurrent.futures.wait(
+                in_flight, timeout=wait_timeout, return_when=concurrent.futures.FIRST_COMPLETED
+            )
+
+            for future in done:
+                index = in_flight.pop(future)
+                items = None
+                error = None
                 try:
                     result = future.result()
                     if isinstance(result, tuple) and len(result) == 4:
                         items, token_input, token_output, token_total = result
-                        results[i] = items
                         total_token_input += token_input
                         total_token_output += token_output
                         total_token_usage += token_total
                     else:
-                        results[i] = result
+                        items = result
                 except Exception as e:
                     logging.error(f"Task {future} failed with error: {e}")
-                    results[i] = []
+                    error = f"{type(e).__name__}: {e}"
+                yield index, items, error
 
+            now = time.monotonic()
+            for future, index in list(in_flight.items()):
+                if now - started_at[index] >= timeout:
+                    # 実行中のリクエストは止められないため、結果を待たずに見捨てる
+                    del in_flight[future]
+                    logging.error(f"Extraction for input {index} timed out after {timeout}s")
+                    yield index, None, f"timed out after {timeout}s"
+    finally:
         if config is not None:
             config["total_token_usage"] = config.get("total_token_usage", 0) + total_token_usage
             config["token_usage_input"] = config.get("token_usage_input", 0) + total_token_input
             config["token_usage_output"] = config.get("token_usage_output", 0) + total_token_output
             print(
-                f"Extraction batch: input={total_token_input}, output={total_token_output}, total={total_token_usage} tokens"
+                f"Extraction: input={total_token_input}, output={total_token_output}, total={total_token_usage} tokens"
             )
 
-        return results
 
+def _run_in_thread(fn, *args) -> concurrent.futures.Future:
+    """fnを専用のデーモンスレッドで実行し、結果をFutureで返す
+
+    スレッドプールでは、タイムアウトで見捨てたリクエストが終わるまでワーカーが空かず、後続のリクエストが待たされる。
+    """
+    future = concurrent.futures.Future()
+
+    def target():
+        future.set_running_or_notify_cancel()
+        try:
+            future.set_result(fn(*args))
+        except Exception as e:
+            future.set_exception(e)
+
+    threading.Thread(target=target, daemon=True).start()
+    return future
 
-def extract_arguments(input, prompt, model, provider="openai", local_llm_address=None):
-    messages = [
+
+def _extraction_messages(input, prompt):
+    return [
         {"role": "system", "content": prompt},
         {"role": "user", "content": input},
     ]
+
+
+def _batch_extraction_messages(comments, prompt):
+    return [
+        {"role": "system", "content": prompt + BATCH_EXTRACTION_INSTRUCTION},
+        {
+            "role": "user",
+            "content": json.dumps(
+                {"comments": [{"commentId": comment_id, "text": text} for comment_id, text in comments]},
+                ensure_ascii=False,
+            ),
+        },
+    ]
+
+
+def extract_arguments(input, prompt, model, provider="openai", local_llm_address=None, timeout=EXTRACTION_TIMEOUT):
+    messages = _extraction_messages(input, prompt)
     try:
         response, token_input, token_output, token_total = request_to_chat_ai(
             messages=messages,
@@ -154,6 +420,8 @@ def extract_arguments(input, prompt, model, provider="openai", local_llm_address
             provider=provider,
             local_llm_address=local_llm_address,
             user_api_key=os.getenv("USER_API_KEY"),
+            timeout=timeout,
+            validate=lambda response: has_json_key(response, "extractedOpinionList"),
         )
         items = parse_extraction_response(response)
         items = list(filter(None, items))  # omit empty strings
@@ -164,3 +432,103 @@ def extract_arguments(input, prompt, model, provider="openai", local_llm_address
         print("Response was:", response)
         print("Silently giving up on trying to generate valid list.")
         return []
+
+
+def extract_arguments_batch(
+    comments, prompt, model, provider="openai", local_llm_address=None, timeout=EXTRACTION_TIMEOUT
+):
+    """複数の (comment-id, 本文) を1リクエストでまとめて抽出し、コメントごとの意見のリストを返す
+
+    レスポンスを解釈できない、または一部のコメントの結果が欠けている場合は、そのコメントだけ1件ずつ抽出し直す。
+    """
+    response, token_input, token_output, token_total = request_to_chat_ai(
+        messages=_batch_extraction_messages(comments, prompt),
+        model=model,
+        is_json=False,
+        json_schema=BatchExtractionResponse,
+        provider=provider,
+        local_llm_address=local_llm_address,
+        user_api_key=os.getenv("USER_API_KEY"),
+        timeout=timeout,
+        validate=lambda response: has_json_key(response, "results"),
+    )
+    results, fallback_usage = _resolve_batch_extraction(
+        comments, response, prompt, model, provider, local_llm_address, timeout
+    )
+    return (
+        results,
+        token_input + fallback_usage[0],
+        token_output + fallback_usage[1],
+        token_total + fallback_usage[2],
+    )
+
+
+def _resolve_batch_extraction(
+    comments, response, prompt, model, provider, local_llm_address, timeout=EXTRACTION_TIMEOUT
+):
+    """まとめて抽出したレスポンスをコメントごとの意見のリストに分け、欠けているコメントは1件ずつ抽出し直す
+
+    Returns:
+        (コメントごとの意見のリスト, 抽出し直しに使った (入力, 出力, 合計) トークン数)
+    """
+    extracted = parse_batch_extraction_response(response)
+    results = []
+    usage = [0, 0, 0]
+    for comment_id, text in comments:
+        items = extracted.get(comment_id)
+        if items is None:
+            logging.warning(f"Batch extraction result for comment {comment_id} is missing, extracting it alone")
+            result = extract_arguments(text, prompt, model, provider, local_llm_address, timeout)
+            if isinstance(result, tuple) and len(result) == 4:
+                items = result[0]
+                usage = [total + used for total, used in zip(usage, result[1:], strict=True)]
+            else:
+                items = result
+        results.append(list(filter(None, items)))  # omit empty strings
+    return results, tuple(usage)
+
+
+def extract_with_batch_api(inputs, prompt, model, config, job_name, batched=False):
+    """バッチAPIでまとめて抽出し、extract_stream と同じ形式で (入力のindex, 抽出結果, 失敗理由) を返す
+
+    batched=True の場合、各入力は (comment-id, 本文) のリストで、複数コメントを1リクエストで抽出する。
+    """
+    requests = [
+        BatchRequest(
+            custom_id=str(i),
+            messages=_batch_extraction_messages(input, prompt) if batched else _extraction_messages(input, prompt),
+            model=model,
+            json_schema=BatchExtractionResponse if batched else ExtractionResponse,
+        )
+        for i, input in enumerate(inputs)
+    ]
+    results = run_batch(
+        requests,
+        f"outputs/{config['output_dir']}/batch",
+        job_name,
+        create_batch_backend(config),
+        poll_interval=config.get("batch", {}).get("poll_interval", DEFAULT_POLL_INTERVAL),
+        on_wait=lambda: update_status(config, {}),
+    )
+
+    usage = [0, 0, 0]
+    for i, input in enumerate(inputs):
+        result = results[str(i)]
+        if result is None:
+            yield i, None, "batch request failed"
+            continue
+        response, *request_usage = result
+        usage = [total + used for total, used in zip(usage, request_usage, strict=True)]
+        if batched:
+            items, fallback_usage = _resolve_batch_extraction(
+                input, response, prompt, model, config["provider"], config.get("local_llm_address")
+            )
+            usage = [total + used for total, used in zip(usage, fallback_usage, strict=True)]
+        else:
+            items = list(filter(None, parse_extraction_response(response)))  # omit empty strings
+        yield i, items, None
+
+    config["token_usage_input"] = config.get("token_usage_input", 0) + usage[0]
+    config["token_usage_output"] = config.get("token_usage_output", 0) + usage[1]
+    config["total_token_usage"] = config.get("total_token_usage", 0) + usage[2]
+    print(f"Extraction (batch): input={usage[0]}, output={usage[1]}, total={usage[2]} tokens")
@@ -6,37 +6,72 @@ from pathlib import Path
 from typing import Any, TypedDict
 
 import numpy as np
+import orjson
 import pandas as pd
+from artifacts import artifact_context
 
 ROOT_DIR = Path(__file__).parent.parent.parent.parent
 CONFIG_DIR = ROOT_DIR / "scatter" / "pipeline" / "configs"
 PIPELINE_DIR = ROOT_DIR / "broadlistening" / "pipeline"
 
 
-def json_serialize_numpy(obj: Any) -> Any:
-    """
-    Recursively convert NumPy data types to native Python types for JSON serialization.
+def _orjson_default(obj: Any) -> Any:
+    """orjson がそのまま扱えない NumPy の値（非連続な配列など）を Python の値に変換する"""
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
 
-    Args:
-        obj: Any Python object which might contain NumPy data types
 
-    Returns:
-        The same object structure with NumPy types converted to Python native types
+def _dump_json(obj: Any, compact: bool) -> bytes:
+    option = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+    if not compact:
+        option |= orjson.OPT_INDENT_2
+    return orjson.dumps(obj, default=_orjson_default, option=option)
+
+
+# 要素ごとに書き出すキー（レポートの大部分を占める）
+STREAMED_RESULT_KEYS = ("arguments",)
+
+
+def write_result_json(path: str | Path, results: dict[str, Any], compact: bool = False) -> None:
+    """hierarchical_result.json を orjson で書き出す
+
+    結果全体をまとめてシリアライズすると、出力と同じ大きさのバイト列がメモリに載るため、
+    トップレベルのキーごとに書き出し、arguments は1件ずつ書き出す。
+    出力は orjson.dumps(results) と同じバイト列になる。NaN は null として出力される。
+
+    Args:
+        path: 出力先のパス
+        results: 出力する結果（NumPy の値を含んでいてよい）
+        compact: True ならインデントせずに出力する
     """
-    if isinstance(obj, np.integer):
-        return int(obj)
-    elif isinstance(obj, np.floating):
-        return float(obj)
-    elif isinstance(obj, np.ndarray):
-        return obj.tolist()
-    elif isinstance(obj, dict):
-        return {k: json_serialize_numpy(v) for k, v in obj.items()}
-    elif isinstance(obj, list):
-        return [json_serialize_numpy(item) for item in obj]
-    elif isinstance(obj, tuple):
-        return tuple(json_serialize_numpy(item) for item in obj)
-    else:
-        return obj
+    # インデントありの場合は、ネストした値の各行をその深さに合わせて字下げする
+    key_separator = b":" if compact else b": "
+
+    def indent(depth: int) -> bytes:
+        return b"" if compact else b"\n" + b"  " * depth
+
+    def dump(value: Any, depth: int) -> bytes:
+        value_bytes = _dump_json(value, compact)
+        return value_bytes if compact else value_bytes.replace(b"\n", indent(depth))
+
+    with open(path, "wb") as file:
+        if not results:
+            file.write(b"{}")
+            return
+        file.write(b"{")
+        for i, (key, value) in enumerate(results.items()):
+            file.write((b"," if i else b"") + indent(1) + _dump_json(str(key), compact) + key_separator)
+            if key not in STREAMED_RESULT_KEYS or not isinstance(value, list) or not value:
+                file.write(dump(value, 1))
+                continue
+            file.write(b"[")
+            for j, item in enumerate(value):
+                file.write((b"," if j else b"") + indent(2) + dump(item, 2))
+            file.write(indent(1) + b"]")
+        file.write(indent(0) + b"}")
 
 
 class Argument(TypedDict):
@@ -74,13 +109,14 @@ def hierarchical_aggregation(config) -> bool:
             "config": config,
         }
 
-        arguments = pd.read_csv(f"outputs/{config['output_dir']}/args.csv")
+        context = artifact_context()
+        arguments = context.read(f"outputs/{config['output_dir']}/args.csv")
         arguments.set_index("arg-id", inplace=True)
         arg_num = len(arguments)
-        relation_df = pd.read_csv(f"outputs/{config['output_dir']}/relations.csv")
-        comments = pd.read_csv(f"inputs/{config['input']}.csv")
-        clusters = pd.read_csv(f"outputs/{config['output_dir']}/hierarchical_clusters.csv")
-        labels = pd.read_csv(f"outputs/{config['output_dir']}/hierarchical_merge_labels.csv")
+        relation_df = context.read(f"outputs/{config['output_dir']}/relations.csv")
+        comments = context.read(f"inputs/{config['input']}.csv")
+        clusters = context.read(f"outputs/{config['output_dir']}/hierarchical_clusters.csv")
+        labels = context.read(f"outputs/{config['output_dir']}/hierarchical_merge_labels.csv")
 
         hidden_properties_map: dict[str, list[str]] = config["hierarchical_aggregation"]["hidden_properties"]
 
@@ -101,13 +137,11 @@ def hierarchical_aggregation(config) -> bool:
         print(overview)
         results["overview"] = overview
 
-        # Convert non-serializable NumPy types to native Python types
-        results = json_serialize_numpy(results)
+        # 意見数・コメント数は読み込み済みのデータから求め、出力後にファイルを読み直さずに済むようにする
+        results["config"] = {**config, "intro": _build_custom_intro(config, len(comments), arg_num)}
 
-        with open(path, "w") as file:
-            json.dump(results, file, indent=2, ensure_ascii=False)
         # TODO: サンプリングロジックを実装したいが、現状は全件抽出
-        create_custom_intro(config)
+        write_result_json(path, results, compact=config["hierarchical_aggregation"].get("compact_json", False))
         if config["is_pubcom"]:
             add_original_comments(labels, arguments, relation_df, clusters, config)
         return True
@@ -117,14 +151,7 @@ def hierarchical_aggregation(config) -> bool:
         return False
 
 
-def create_custom_intro(config):
-    dataset = config["output_dir"]
-    args_path = PIPELINE_DIR / f"outputs/{dataset}/args.csv"
-    comments = pd.read_csv(PIPELINE_DIR / f"inputs/{config['input']}.csv")
-    result_path = PIPELINE_DIR / f"outputs/{dataset}/hierarchical_result.json"
-
-    input_count = len(comments)
-    args_count = len(pd.read_csv(args_path))
+def _build_custom_intro(config: dict, input_count: int, args_count: int) -> str:
     processed_num = min(input_count, config["extraction"]["limit"])
 
     print(f"Input count: {input_count}")
@@ -154,16 +181,10 @@ def create_custom_intro(config):
 """
 
     intro = config["intro"]
-    custom_intro = base_custom_intro.format(
+    return base_custom_intro.format(
         intro=intro, processed_num=processed_num, args_count=args_count, llm_provider=llm_provider
     )
 
-    with open(result_path) as f:
-        result = json.load(f)
-    result["config"]["intro"] = custom_intro
-    with open(result_path, "w") as f:
-        json.dump(result, f, indent=2, ensure_ascii=False)
-
 
 def add_original_comments(labels, arguments, relation_df, clusters, config):
     # 大カテゴリ（cluster-level-1）に該当するラベルだけ抽出
@@ -180,7 +201,7 @@ def add_original_comments(labels, arguments, relation_df, clusters, config):
     merged = merged.merge(relation_df, on="arg-id", how="left")
 
     # 元コメント取得
-    comments = pd.read_csv(PIPELINE_DIR / f"inputs/{config['input']}.csv")
+    comments = artifact_context().read(PIPELINE_DIR / f"inputs/{config['input']}.csv")
     comments["comment-id"] = comments["comment-id"].astype(str)
     merged["comment-id"] = merged["comment-id"].astype(str)
 
@@ -238,6 +259,8 @@ def _build_arguments(
     # Prepare for merging with original comments to get attributes
     comments_copy = comments.copy()
     comments_copy["comment-id"] = comments_copy["comment-id"].astype(str)
+    # 同じcomment-idが複数ある場合は最初の行を使う
+    comments_copy = comments_copy.drop_duplicates("comment-id", keep="first").set_index("comment-id")
 
     # Get argument to comment mapping
     arg_comment_map = {}
@@ -249,61 +272,92 @@ def _build_arguments(
     attribute_columns = [col for col in comments.columns if col.startswith("attribute_")]
     print(f"属性カラム検出: {attribute_columns}")
 
-    arguments: list[Argument] = []
-    for _, row in clusters.iterrows():
-        cluster_ids = ["0"]
-        for cluster_column in cluster_columns:
-            cluster_ids.append(str(row[cluster_column]))  # Convert to string to ensure serializable
-
-        # Create base argument
-        argument: Argument = {
-            "arg_id": str(row["arg-id"]),  # Convert to string to ensure serializable
-            "argument": str(row["argument"]),
-            "x": float(row["x"]),  # Convert to native float
-            "y": float(row["y"]),  # Convert to native float
+    # 各意見に対応するコメントの行位置（コメントがなければ -1）
+    comment_positions = comments_copy.index.get_indexer([arg_comment_map.get(arg_id) for arg_id in clusters["arg-id"]])
+    has_comment = comment_positions >= 0
+
+    urls = [None] * len(clusters)
+    if config.get("enable_source_link", False) and "url" in comments_copy.columns:
+        url_values = comments_copy["url"].to_numpy(dtype=object)[comment_positions]
+        urls = [
+            str(url) if found and url is not None else None for url, found in zip(url_values, has_comment, strict=True)
+        ]
+
+    attributes_list = [None] * len(clusters)
+    if attribute_columns:
+        attribute_names = [attr_col[len("attribute_") :] for attr_col in attribute_columns]
+        attribute_values = [
+            _column_to_native(comments_copy[attr_col])[comment_positions] for attr_col in attribute_columns
+        ]
+        for i in np.flatnonzero(has_comment):
+            attributes = {name: values[i] for name, values in zip(attribute_names, attribute_values, strict=True)}
+            # Only add non-empty attributes
+            if any(v is not None for v in attributes.values()):
+                attributes_list[i] = attributes
+
+    cluster_id_lists = (
+        [["0", *ids] for ids in zip(*(clusters[col].map(str) for col in cluster_columns), strict=True)]
+        if cluster_columns
+        else [["0"] for _ in range(len(clusters))]
+    )
+
+    arguments: list[Argument] = [
+        {
+            "arg_id": arg_id,
+            "argument": argument,
+            "x": x,
+            "y": y,
             "p": 0,  # NOTE: 一旦全部0でいれる
             "cluster_ids": cluster_ids,
-            "attributes": None,
-            "url": None,
+            "attributes": attributes,
+            "url": url,
         }
-
-        # Add attributes and URL if available
-        if row["arg-id"] in arg_comment_map:
-            comment_id = arg_comment_map[row["arg-id"]]
-            comment_rows = comments_copy[comments_copy["comment-id"] == comment_id]
-
-            if not comment_rows.empty:
-                comment_row = comment_rows.iloc[0]
-
-                # Add URL if available and enabled
-                if config.get("enable_source_link", False) and "url" in comment_row and comment_row["url"] is not None:
-                    argument["url"] = str(comment_row["url"])
-
-                # Add attributes if available
-                if attribute_columns:
-                    attributes = {}
-                    for attr_col in attribute_columns:
-                        # Remove "attribute_" prefix for cleaner attribute names
-                        attr_name = attr_col[len("attribute_") :]
-                        # Convert potential numpy types to Python native types
-                        attr_value = comment_row.get(attr_col, None)
-                        if attr_value is not None:
-                            if isinstance(attr_value, np.integer):
-                                attr_value = int(attr_value)
-                            elif isinstance(attr_value, np.floating):
-                                attr_value = float(attr_value)
-                            elif isinstance(attr_value, np.ndarray):
-                                attr_value = attr_value.tolist()
-                        attributes[attr_name] = attr_value
-
-                    # Only add non-empty attributes
-                    if any(v is not None for v in attributes.values()):
-                        argument["attributes"] = attributes
-
-        arguments.append(argument)
+        for arg_id, argument, x, y, cluster_ids, attributes, url in zip(
+            clusters["arg-id"].map(str),
+            clusters["argument"].map(str),
+            clusters["x"].astype(float).tolist(),
+            clusters["y"].astype(float).tolist(),
+            cluster_id_lists,
+            attributes_list,
+            urls,
+            strict=True,
+        )
+    ]
     return arguments
 
 
+def _column_to_native(column: pd.Series) -> np.ndarray:
+    """列の値をJSONに書き出せるPythonの型に揃えたobject配列にする"""
+    if column.dtype != object:
+        # 数値・真偽値の列は to_numpy(dtype=object) でPythonの型になる
+        return column.to_numpy(dtype=object)
+    # object列の中に残っているNumPyの値だけを変換する
+    values = np.empty(len(column), dtype=object)
+    for i, value in enumerate(column):
+        values[i] = _to_native(value)
+    return values
+
+
+def _to_native(value: Any) -> Any:
+    if isinstance(value, np.integer):
+        return int(value)
+    if isinstance(value, np.floating):
+        return float(value)
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    return value
+
+
+def _property_values(column: pd.Series) -> list[str | None]:
+    """propertyMapの値を列ごとにまとめて文字列に変換する
+
+    LLMによるcategory classificationがうまく行かず、NaNの場合はNoneにする。
+    tolist() で列のdtypeに応じたPythonの型になるため、値ごとの型判定は不要。
+    """
+    missing = column.isna().to_numpy()
+    return [None if is_missing else str(value) for value, is_missing in zip(column.tolist(), missing, strict=True)]
+
+
 def _build_cluster_value(melted_labels: pd.DataFrame, total_num: int) -> list[Cluster]:
     results: list[Cluster] = [
         Cluster(
@@ -317,37 +371,35 @@ def _build_cluster_value(melted_labels: pd.DataFrame, total_num: int) -> list[Cl
         )
     ]
 
-    for _, melted_label in melted_labels.iterrows():
-        # Convert potential NumPy types to native Python types
-        level = (
-            int(melted_label["level"]) if isinstance(melted_label["level"], int | np.integer) else melted_label["level"]
-        )
-        cluster_id = str(melted_label["id"])
-        label = str(melted_label["label"])
-        takeaway = str(melted_label["description"])
-        value = (
-            int(melted_label["value"]) if isinstance(melted_label["value"], int | np.integer) else melted_label["value"]
-        )
-        parent = str(melted_label.get("parent", "全体"))
-
-        # Handle density_rank_percentile which might be None or a numeric value
-        density_rank = melted_label.get("density_rank_percentile")
-        if density_rank is not None:
-            if isinstance(density_rank, float | np.floating):
-                density_rank = float(density_rank)
-            elif isinstance(density_rank, int | np.integer):
-                density_rank = int(density_rank)
-
-        cluster_value = Cluster(
-            level=level,
-            id=cluster_id,
-            label=label,
-            takeaway=takeaway,
-            value=value,
-            parent=parent,
-            density_rank_percentile=density_rank,
+    n_clusters = len(melted_labels)
+    # 列ごとにPythonの型へ変換してから、行ごとの辞書を組み立てる
+    parents = melted_labels["parent"].tolist() if "parent" in melted_labels.columns else ["全体"] * n_clusters
+    density_ranks = (
+        melted_labels["density_rank_percentile"].tolist()
+        if "density_rank_percentile" in melted_labels.columns
+        else [None] * n_clusters
+    )
+    for level, cluster_id, label, takeaway, value, parent, density_rank in zip(
+        melted_labels["level"].tolist(),
+        melted_labels["id"].tolist(),
+        melted_labels["label"].tolist(),
+        melted_labels["description"].tolist(),
+        melted_labels["value"].tolist(),
+        parents,
+        density_ranks,
+        strict=True,
+    ):
+        results.append(
+            Cluster(
+                level=level,
+                id=str(cluster_id),
+                label=str(label),
+                takeaway=str(takeaway),
+                value=value,
+                parent=str(parent),
+                density_rank_percentile=density_rank,
+            )
         )
-        results.append(cluster_value)
     return results
 
 
@@ -393,29 +445,9 @@ def _build_property_map(
             "設定ファイルaggregation / hidden_propertiesから該当カラムを取り除いてください。"
         )
 
+    # Make sure arg_id is string
+    arg_ids = [str(arg_id) for arg_id in arguments.index]
     for prop in property_columns:
-        for arg_id, row in arguments.iterrows():
-            # LLMによるcategory classificationがうまく行かず、NaNの場合はNoneにする
-            value = row[prop] if not pd.isna(row[prop]) else None
-
-            # Convert NumPy types to Python native types
-            if value is not None:
-                if isinstance(value, np.integer):
-                    value = int(value)
-                elif isinstance(value, np.floating):
-                    value = float(value)
-                elif isinstance(value, np.ndarray):
-                    value = value.tolist()
-                else:
-                    # Convert any other types to string to ensure serialization
-                    try:
-                        value = str(value)
-                    except Exception as e:
-                        print(f"Error converting value to string: {e}")
-                        value = None
-
-            # Make sure arg_id is string
-            str_arg_id = str(arg_id)
-            property_map[prop][str_arg_id] = value
+        property_map[prop] = dict(zip(arg_ids, _property_values(arguments[prop]), strict=True))
 
     return property_map
@@ -1,43 +1,80 @@
 """Cluster the arguments using UMAP + HDBSCAN and GPT-4."""
 
+import logging
+import os
+import time
 from importlib import import_module
 
+import joblib
 import numpy as np
 import pandas as pd
 import scipy.cluster.hierarchy as sch
-from sklearn.cluster import KMeans
+from artifacts import artifact_context, artifact_exists, artifact_format, load_embeddings, write_artifact
+from sklearn.cluster import KMeans, MiniBatchKMeans
+from sklearn.decomposition import PCA
+from sklearn.metrics import calinski_harabasz_score, silhouette_score
+from threadpoolctl import threadpool_limits
 
+# フィット済みのUMAP・クラスタ中心・樹形図の保存先。incremental モードで新しい意見の割り当てに使う
+MODEL_FILENAME = "hierarchical_clustering_model.joblib"
+# 新しい意見がこの割合を超えたら、既存のクラスタ構造が実態を表さなくなっているとみなす
+MAX_INCREMENTAL_FRACTION = 0.2
+# cluster_nums にこの値を指定すると、クラスタ数を自動で選ぶ
+AUTO_CLUSTER_NUMS = "auto"
+# 自動選択で、上位の階層のクラスタ数として試す最大値
+AUTO_MAX_TOP_CLUSTERS = 10
 
-def hierarchical_clustering(config):
-    UMAP = import_module("umap").UMAP
 
+def hierarchical_clustering(config):
     dataset = config["output_dir"]
     path = f"outputs/{dataset}/hierarchical_clusters.csv"
-    arguments_df = pd.read_csv(f"outputs/{dataset}/args.csv", usecols=["arg-id", "argument"])
-    embeddings_df = pd.read_pickle(f"outputs/{dataset}/embeddings.pkl")
-    embeddings_array = np.asarray(embeddings_df["embedding"].values.tolist())
+    model_path = f"outputs/{dataset}/{MODEL_FILENAME}"
+    arguments_df = artifact_context().read(f"outputs/{dataset}/args.csv")[["arg-id", "argument"]]
+    _, embeddings_array = load_embeddings(f"outputs/{dataset}")
     cluster_nums = config["hierarchical_clustering"]["cluster_nums"]
 
-    n_samples = embeddings_array.shape[0]
-    # デフォルト設定は15
-    default_n_neighbors = 15
+    n_jobs = config["hierarchical_clustering"]["n_jobs"]
+    reproducible = config["hierarchical_clustering"]["reproducible"]
 
-    # テスト等サンプルが少なすぎる場合、n_neighborsの設定値を下げる
-    if n_samples <= default_n_neighbors:
-        n_neighbors = max(2, n_samples - 1)  # 最低2以上
-    else:
-        n_neighbors = default_n_neighbors
+    # BLAS / OpenMP（KMeans・PCA・UMAPの変換）のスレッド数を n_jobs に揃える
+    with threadpool_limits(limits=_thread_limit(n_jobs)):
+        if config["hierarchical_clustering"]["incremental"]:
+            result_df = incremental_clustering(config, arguments_df, embeddings_array, path, model_path)
+            if result_df is not None:
+                write_artifact(result_df, path, artifact_format(config))
+                return
+            print("incremental clustering is not available, fitting from scratch")
 
-    umap_model = UMAP(random_state=42, n_components=2, n_neighbors=n_neighbors)
-    # TODO 詳細エラーメッセージを加える
-    # 以下のエラーの場合、おそらく元の意見件数が少なすぎることが原因
-    # TypeError: Cannot use scipy.linalg.eigh for sparse A with k >= N. Use scipy.linalg.eigh(A.toarray()) or reduce k.
-    umap_embeds = umap_model.fit_transform(embeddings_array)
+        pca_model, reduced_embeddings = reduce_dimensions(
+            embeddings_array, config["hierarchical_clustering"]["pca_components"]
+        )
+        if pca_model is not None:
+            explained_variance = float(pca_model.explained_variance_ratio_.sum())
+            print(f"PCA: {pca_model.n_components_} components retain {explained_variance:.1%} of the variance")
+            config["hierarchical_clustering_pca"] = {
+                "components": int(pca_model.n_components_),
+                "explained_variance_ratio": explained_variance,
+            }
+
+        umap_model, umap_embeds = fit_umap(reduced_embeddings, n_jobs=n_jobs, reproducible=reproducible)
+
+        if cluster_nums == AUTO_CLUSTER_NUMS:
+            cluster_nums, auto_report = select_cluster_nums(
+                umap_embeds,
+                max_clusters=config["hierarchical_clustering"]["auto_max_clusters"],
+                sample_size=config["hierarchical_clustering"]["auto_sample_size"],
+                time_budget=config["hierarchical_clustering"]["auto_time_budget"],
+            )
+            print(f"auto cluster_nums: {cluster_nums}")
+            config["hierarchical_clustering_auto"] = auto_report
+
+        cluster_results, cluster_centers, linkage_matrix = fit_hierarchy(
+            umap_embeds=umap_embeds,
+            cluster_nums=cluster_nums,
+            backend=config["hierarchical_clustering"]["backend"],
+            batch_size=config["hierarchical_clustering"]["batch_size"],
+        )
 
-    cluster_results = hierarchical_clustering_embeddings(
-        umap_embeds=umap_embeds,
-        cluster_nums=cluster_nums,
-    )
     result_df = pd.DataFrame(
         {
             "arg-id": arguments_df["arg-id"],
@@ -50,7 +87,232 @@ def hierarchical_clustering(config):
     for cluster_level, final_labels in enumerate(cluster_results.values(), start=1):
         result_df[f"cluster-level-{cluster_level}-id"] = [f"{cluster_level}_{label}" for label in final_labels]
 
-    result_df.to_csv(path, index=False)
+    write_artifact(result_df, path, artifact_format(config))
+
+    finest_labels = list(cluster_results.values())[-1]
+    joblib.dump(
+        {
+            "pca": pca_model,
+            "umap": umap_model,
+            "cluster_nums": sorted(cluster_nums),
+            "cluster_centers": cluster_centers,
+            "linkage_matrix": linkage_matrix,
+            "embedding_dim": embeddings_array.shape[1],
+            "backend": config["hierarchical_clustering"]["backend"],
+            "reproducible": reproducible,
+            # ドリフトの基準: フィット時の各点から所属クラスタ中心までの平均距離
+            "fit_mean_distance": float(np.linalg.norm(umap_embeds - cluster_centers[finest_labels], axis=1).mean()),
+        },
+        model_path,
+    )
+
+
+def incremental_clustering(
+    config: dict, arguments_df: pd.DataFrame, embeddings_array: np.ndarray, path: str, model_path: str
+) -> pd.DataFrame | None:
+    """前回フィットしたモデルで、新しく追加された意見だけを既存のクラスタに割り当てる
+
+    既存の意見の座標・クラスタは変えない。前回の結果やモデルがない、設定が変わったなどで
+    割り当てられない場合はNoneを返す（呼び出し側で全体をフィットし直す）。
+    arg-id は抽出し直すと別の意見に使われるため、arg-id と本文の両方が前回と一致する意見だけを既存の意見とみなす。
+    """
+    if not (artifact_exists(path) and os.path.exists(model_path)):
+        return None
+    model = joblib.load(model_path)
+    pca_components = model["pca"].n_components_ if model.get("pca") is not None else None
+    cluster_nums = config["hierarchical_clustering"]["cluster_nums"]
+    if (
+        # auto の場合は前回選んだクラスタ数をそのまま使う
+        (cluster_nums != AUTO_CLUSTER_NUMS and model["cluster_nums"] != sorted(cluster_nums))
+        or model["embedding_dim"] != embeddings_array.shape[1]
+        or model.get("backend") != config["hierarchical_clustering"]["backend"]
+        or model.get("reproducible") != config["hierarchical_clustering"]["reproducible"]
+        or pca_components
+        != _effective_pca_components(config["hierarchical_clustering"]["pca_components"], embeddings_array)
+    ):
+        return None
+
+    previous_df = artifact_context().read(path)
+    # 削除された意見と本文が変わった意見は除き、それ以外（新しい意見・本文が変わった意見）だけを割り当てる
+    current_keys = pd.MultiIndex.from_frame(arguments_df[["arg-id", "argument"]])
+    previous_keys = pd.MultiIndex.from_frame(previous_df[["arg-id", "argument"]])
+    changed_num = int((previous_df["arg-id"].isin(arguments_df["arg-id"]) & ~previous_keys.isin(current_keys)).sum())
+    previous_df = previous_df[previous_keys.isin(current_keys)]
+    is_new = ~current_keys.isin(pd.MultiIndex.from_frame(previous_df[["arg-id", "argument"]]))
+    new_df = arguments_df[is_new].reset_index(drop=True)
+    print(f"incremental clustering: {len(new_df)} new arguments ({changed_num} with changed text)")
+
+    if len(new_df) > 0:
+        umap_embeds, level_labels, distances = assign_new_points(model, embeddings_array[is_new])
+        new_df["x"] = umap_embeds[:, 0]
+        new_df["y"] = umap_embeds[:, 1]
+        for cluster_level, labels in enumerate(level_labels, start=1):
+            new_df[f"cluster-level-{cluster_level}-id"] = [f"{cluster_level}_{label}" for label in labels]
+        distance_ratio = float(distances.mean() / model["fit_mean_distance"]) if model["fit_mean_distance"] else 0.0
+    else:
+        distance_ratio = 0.0
+
+    new_fraction = len(new_df) / max(1, len(arguments_df))
+    drift_threshold = config["hierarchical_clustering"]["drift_threshold"]
+    refit_recommended = distance_ratio > drift_threshold or new_fraction > MAX_INCREMENTAL_FRACTION
+    config["hierarchical_clustering_drift"] = {
+        "new_arguments": len(new_df),
+        "changed_arguments": changed_num,
+        "new_fraction": new_fraction,
+        "distance_ratio": distance_ratio,
+        "refit_recommended": refit_recommended,
+    }
+    if refit_recommended:
+        logging.warning(
+            f"Clustering drift: distance ratio {distance_ratio:.2f}, new fraction {new_fraction:.2f}. "
+            "A full refit (incremental: false) is recommended."
+        )
+
+    # 元の意見の並び順に揃え、本文は常に今回の抽出結果を使う
+    result_df = pd.concat([previous_df, new_df], ignore_index=True)
+    result_df = result_df.set_index("arg-id").loc[arguments_df["arg-id"]].reset_index()
+    result_df["argument"] = arguments_df["argument"].to_numpy()
+    return result_df
+
+
+def assign_new_points(model: dict, embeddings: np.ndarray) -> tuple[np.ndarray, list[np.ndarray], np.ndarray]:
+    """フィット済みのUMAPで新しい点を射影し、最も近いクラスタ中心と樹形図から各階層のラベルを求める
+
+    Returns:
+        (2次元座標, 粗い階層から順の各階層のラベル, 最も近いクラスタ中心までの距離)
+    """
+    if model.get("pca") is not None:
+        embeddings = model["pca"].transform(embeddings)
+    umap_embeds = model["umap"].transform(embeddings)
+    centers = model["cluster_centers"]
+    distances_to_centers = np.linalg.norm(umap_embeds[:, None, :] - centers[None, :, :], axis=2)
+    finest_labels = distances_to_centers.argmin(axis=1)
+    level_labels = [
+        merge_clusters_with_hierarchy(model["linkage_matrix"], finest_labels, n_cluster_cut)
+        for n_cluster_cut in model["cluster_nums"][:-1]
+    ]
+    level_labels.append(finest_labels)
+    return umap_embeds, level_labels, distances_to_centers.min(axis=1)
+
+
+def _thread_limit(n_jobs: int | None) -> int | None:
+    """threadpool_limits に渡すスレッド数。未指定や -1（全コア）は制限しない"""
+    if n_jobs is None or n_jobs < 0:
+        return None
+    return n_jobs
+
+
+def fit_umap(embeddings: np.ndarray, n_jobs: int | None = None, reproducible: bool = True):
+    """UMAPで2次元に削減する。(UMAPモデル, 2次元座標) を返す
+
+    reproducible=True では乱数シードを固定する。umap-learn はシード固定時に単一スレッドで動くため、
+    同じ入力と設定から常に同じ座標が得られる。False ではシードを外して n_jobs（未指定なら全コア）で
+    並列にフィットする。大規模データでは大幅に速いが、実行ごとに座標が変わる。
+    """
+    UMAP = import_module("umap").UMAP
+
+    n_samples = embeddings.shape[0]
+    # デフォルト設定は15
+    default_n_neighbors = 15
+
+    # テスト等サンプルが少なすぎる場合、n_neighborsの設定値を下げる
+    if n_samples <= default_n_neighbors:
+        n_neighbors = max(2, n_samples - 1)  # 最低2以上
+    else:
+        n_neighbors = default_n_neighbors
+
+    if reproducible:
+        parallel_params = {"random_state": 42}
+    else:
+        parallel_params = {"n_jobs": n_jobs or -1}
+    umap_model = UMAP(n_components=2, n_neighbors=n_neighbors, **parallel_params)
+    # TODO 詳細エラーメッセージを加える
+    # 以下のエラーの場合、おそらく元の意見件数が少なすぎることが原因
+    # TypeError: Cannot use scipy.linalg.eigh for sparse A with k >= N. Use scipy.linalg.eigh(A.toarray()) or reduce k.
+    return umap_model, umap_model.fit_transform(embeddings)
+
+
+def _effective_pca_components(pca_components: int | None, embeddings: np.ndarray) -> int | None:
+    """PCAで実際に使う次元数。指定がない、または元の次元数以上なら None（PCAを行わない）"""
+    if not pca_components or pca_components >= min(embeddings.shape):
+        return None
+    return pca_components
+
+
+def reduce_dimensions(embeddings: np.ndarray, pca_components: int | None):
+    """UMAPの前に、ランダム化SVDによるPCAで次元を削減する
+
+    高次元の埋め込みのままUMAPの近傍グラフを作ると時間とメモリの大半を占めるため、
+    pca_components を指定した場合のみ事前に削減する。(PCAモデル, 削減後の埋め込み) を返す。
+    """
+    n_components = _effective_pca_components(pca_components, embeddings)
+    if n_components is None:
+        return None, embeddings
+    pca_model = PCA(n_components=n_components, svd_solver="randomized", random_state=42)
+    return pca_model, pca_model.fit_transform(embeddings)
+
+
+def select_cluster_nums(
+    umap_embeds: np.ndarray,
+    max_clusters: int | None = None,
+    sample_size: int = 10000,
+    time_budget: float = 60,
+    random_state: int = 42,
+) -> tuple[list[int], dict]:
+    """UMAP後の座標のサブサンプルでクラスタ数の候補を採点し、2階層分のクラスタ数を選ぶ
+
+    上位の階層は 2〜AUTO_MAX_TOP_CLUSTERS、下位の階層は上位の3倍以上から max_clusters までを
+    generate_cluster_count_list で間引いた値を候補とし、それぞれシルエット係数が最も高いものを選ぶ。
+    （評価指標は experimental/evaluation_report のシルエット評価と同じく2次元座標で計算する）
+    Calinski-Harabasz 指数は参考値として記録する。time_budget 秒を過ぎたら残りの候補は採点しない。
+
+    Returns:
+        (選んだクラスタ数のリスト, 候補ごとのスコアなどの記録)
+    """
+    started_at = time.monotonic()
+    n_samples = umap_embeds.shape[0]
+    rng = np.random.default_rng(random_state)
+    sample = umap_embeds[rng.choice(n_samples, min(sample_size, n_samples), replace=False)]
+    if max_clusters is None:
+        # 1クラスタあたり平均で数十件程度になる数を上限にする
+        max_clusters = int(np.clip(np.sqrt(n_samples), AUTO_MAX_TOP_CLUSTERS, 100))
+    # シルエット係数は各クラスタに2点以上、かつ クラスタ数 < サンプル数 が必要
+    max_clusters = max(2, min(max_clusters, len(sample) // 2))
+
+    scores: dict[int, dict[str, float]] = {}
+    timed_out = False
+
+    def best_of(candidates: list[int]) -> int | None:
+        nonlocal timed_out
+        for k in candidates:
+            if k in scores:
+                continue
+            if time.monotonic() - started_at > time_budget:
+                timed_out = True
+                break
+            labels = KMeans(n_clusters=k, random_state=random_state, n_init=1).fit_predict(sample)
+            scores[k] = {
+                "silhouette": float(silhouette_score(sample, labels)),
+                "calinski_harabasz": float(calinski_harabasz_score(sample, labels)),
+            }
+        scored = [k for k in candidates if k in scores]
+        return max(scored, key=lambda k: scores[k]["silhouette"]) if scored else None
+
+    top = best_of(list(range(2, min(AUTO_MAX_TOP_CLUSTERS, max_clusters) + 1))) or 2
+    cluster_nums = [top]
+    if max_clusters >= top * 3:
+        bottom = best_of(generate_cluster_count_list(top * 3, max_clusters)) or max_clusters
+        cluster_nums.append(bottom)
+
+    report = {
+        "cluster_nums": cluster_nums,
+        "sample_size": int(len(sample)),
+        "max_clusters": int(max_clusters),
+        "scores": {str(k): v for k, v in sorted(scores.items())},
+        "timed_out": timed_out,
+        "elapsed_seconds": round(time.monotonic() - started_at, 2),
+    }
+    return cluster_nums, report
 
 
 def generate_cluster_count_list(min_clusters: int, max_clusters: int):
@@ -83,50 +345,98 @@ def generate_cluster_count_list(min_clusters: int, max_clusters: int):
 
 
 def merge_clusters_with_hierarchy(
-    cluster_centers: np.ndarray,
+    linkage_matrix: np.ndarray,
     kmeans_labels: np.ndarray,
-    umap_array: np.ndarray,
     n_cluster_cut: int,
 ):
-    Z = sch.linkage(cluster_centers, method="ward")
-    cluster_labels_merged = sch.fcluster(Z, t=n_cluster_cut, criterion="maxclust")
+    """KMeansクラスタ中心のWard法の樹形図を n_cluster_cut 個に切り、各サンプルのラベルを求める"""
+    cluster_labels_merged = sch.fcluster(linkage_matrix, t=n_cluster_cut, criterion="maxclust")
+    # KMeansのラベルをインデックスとして、マージ後のラベルを一括で引く
+    return cluster_labels_merged[kmeans_labels]
+
+
+def fit_kmeans(umap_embeds: np.ndarray, n_clusters: int, batch_size: int) -> tuple[np.ndarray, np.ndarray]:
+    """全データでKMeansを実行する。(各サンプルのラベル, クラスタ中心) を返す"""
+    model = KMeans(n_clusters=n_clusters, random_state=42)
+    model.fit(umap_embeds)
+    return model.labels_, model.cluster_centers_
+
+
+def fit_minibatch_kmeans(umap_embeds: np.ndarray, n_clusters: int, batch_size: int) -> tuple[np.ndarray, np.ndarray]:
+    """ミニバッチで中心を更新するKMeans。大規模データでもKMeansより大幅に速い"""
+    model = MiniBatchKMeans(n_clusters=n_clusters, random_state=42, batch_size=batch_size, n_init=3)
+    model.fit(umap_embeds)
+    return model.labels_, model.cluster_centers_
 
-    n_samples = umap_array.shape[0]
-    final_labels = np.zeros(n_samples, dtype=int)
 
-    for i in range(n_samples):
-        original_label = kmeans_labels[i]
-        final_labels[i] = cluster_labels_merged[original_label]
+def fit_streaming_kmeans(umap_embeds: np.ndarray, n_clusters: int, batch_size: int) -> tuple[np.ndarray, np.ndarray]:
+    """batch_size件ずつ partial_fit / predict するKMeans。作業メモリはデータ件数によらず一定"""
+    # 初回のpartial_fitでは、クラスタ数以上のサンプルが必要
+    batch_size = max(batch_size, n_clusters)
+    model = MiniBatchKMeans(n_clusters=n_clusters, random_state=42, batch_size=batch_size, n_init=3)
+    n_samples = umap_embeds.shape[0]
+    # 入力の並び順の偏りで中心が引っ張られないよう、固定シードでシャッフルした順に学習する
+    order = np.random.default_rng(42).permutation(n_samples)
+    for start in range(0, n_samples, batch_size):
+        batch = umap_embeds[np.sort(order[start : start + batch_size])]
+        if len(batch) < n_clusters:
+            break
+        model.partial_fit(batch)
+    labels = np.empty(n_samples, dtype=np.int32)
+    for start in range(0, n_samples, batch_size):
+        labels[start : start + batch_size] = model.predict(umap_embeds[start : start + batch_size])
+    return labels, model.cluster_centers_
+
 
-    return final_labels
+CLUSTERING_BACKENDS = {
+    "kmeans": fit_kmeans,
+    "minibatch_kmeans": fit_minibatch_kmeans,
+    "streaming": fit_streaming_kmeans,
+}
 
 
 def hierarchical_clustering_embeddings(
     umap_embeds,
     cluster_nums,
+    backend: str = "kmeans",
+    batch_size: int = 10000,
+):
+    results, _, _ = fit_hierarchy(umap_embeds, cluster_nums, backend, batch_size)
+    return results
+
+
+def fit_hierarchy(
+    umap_embeds,
+    cluster_nums,
+    backend: str = "kmeans",
+    batch_size: int = 10000,
 ):
+    """各階層のラベルに加えて、新しい点の割り当てに使うクラスタ中心と樹形図を返す"""
+    if backend not in CLUSTERING_BACKENDS:
+        raise ValueError(f"Unknown clustering backend '{backend}'. Available: {', '.join(CLUSTERING_BACKENDS)}")
+
     # 最大分割数でクラスタリングを実施
-    print("start initial clustering")
+    print(f"start initial clustering (backend: {backend})")
     initial_cluster_num = cluster_nums[-1]
-    kmeans_model = KMeans(n_clusters=initial_cluster_num, random_state=42)
-    kmeans_model.fit(umap_embeds)
+    kmeans_labels, cluster_centers = CLUSTERING_BACKENDS[backend](umap_embeds, initial_cluster_num, batch_size)
     print("end initial clustering")
 
     results = {}
     print("start hierarchical clustering")
     cluster_nums.sort()
     print(cluster_nums)
+    # 樹形図は1回だけ作り、各階層はその切り方だけを変える
+    linkage_matrix = sch.linkage(cluster_centers, method="ward")
     for n_cluster_cut in cluster_nums[:-1]:
         print("n_cluster_cut: ", n_cluster_cut)
         final_labels = merge_clusters_with_hierarchy(
-            cluster_centers=kmeans_model.cluster_centers_,
-            kmeans_labels=kmeans_model.labels_,
-            umap_array=umap_embeds,
+            linkage_matrix=linkage_matrix,
+            kmeans_labels=kmeans_labels,
             n_cluster_cut=n_cluster_cut,
         )
         results[n_cluster_cut] = final_labels
 
-    results[initial_cluster_num] = kmeans_model.labels_
+    results[initial_cluster_num] = kmeans_labels
     print("end hierarchical clustering")
 
-    return results
+    return results, cluster_centers, linkage_matrix
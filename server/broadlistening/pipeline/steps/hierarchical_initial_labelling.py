@@ -4,10 +4,17 @@ from concurrent.futures import ThreadPoolExecutor
 from functools import partial
 from typing import TypedDict
 
+import numpy as np
 import pandas as pd
 from pydantic import BaseModel, Field
 
+from artifacts import artifact_context, artifact_format, write_artifact
+from hierarchical_utils import update_status
+from hierarchy import cluster_members
+from sampling import ArgumentSampler
+from services.batch_api import DEFAULT_POLL_INTERVAL, BatchRequest, create_batch_backend, run_batch
 from services.llm import request_to_chat_ai
+from services.parse_json_list import has_json_key
 
 
 class LabellingResult(TypedDict):
@@ -26,14 +33,17 @@ def hierarchical_initial_labelling(config: dict) -> None:
             - output_dir: 出力ディレクトリ名
             - hierarchical_initial_labelling: 初期ラベリングの設定
                 - sampling_num: サンプリング数
+                - sampling_strategy: サンプリング戦略（"random" / "centroid" / "mmr"）
+                - sampling_seed: サンプリングの乱数シード
                 - prompt: LLMへのプロンプト
                 - model: 使用するLLMモデル名
                 - workers: 並列処理のワーカー数
+                - execution_mode: "realtime"（通常のAPI）または "batch"（バッチAPI）
             - provider: LLMプロバイダー
     """
     dataset = config["output_dir"]
     path = f"outputs/{dataset}/hierarchical_initial_labels.csv"
-    clusters_argument_df = pd.read_csv(f"outputs/{dataset}/hierarchical_clusters.csv")
+    clusters_argument_df = artifact_context().read(f"outputs/{dataset}/hierarchical_clusters.csv")
 
     cluster_id_columns = [col for col in clusters_argument_df.columns if col.startswith("cluster-level-")]
     initial_cluster_id_column = cluster_id_columns[-1]
@@ -68,7 +78,7 @@ def hierarchical_initial_labelling(config: dict) -> None:
         }
     )
     print("end initial labelling")
-    initial_clusters_argument_df.to_csv(path, index=False)
+    write_artifact(initial_clusters_argument_df, path, artifact_format(config))
 
 
 def initial_labelling(
@@ -99,19 +109,66 @@ def initial_labelling(
     cluster_columns = [col for col in clusters_df.columns if col.startswith("cluster-level-")]
     initial_cluster_column = cluster_columns[-1]
     cluster_ids = clusters_df[initial_cluster_column].unique()
+    # クラスタごとの意見を1回のgroupbyでまとめて取り出し、設定した戦略でサンプリングする
+    arguments = clusters_df["argument"].to_numpy()
+    members = cluster_members(clusters_df, initial_cluster_column)
+    sampler = ArgumentSampler.from_config(
+        (config or {}).get("hierarchical_initial_labelling", {}), clusters_df, (config or {}).get("output_dir")
+    )
+    sampled_arguments = [
+        arguments[sampler.sample(cluster_id, members[cluster_id], sampling_num)] for cluster_id in cluster_ids
+    ]
     process_func = partial(
         process_initial_labelling,
-        df=clusters_df,
         prompt=prompt,
-        sampling_num=sampling_num,
-        target_column=initial_cluster_column,
         model=model,
         provider=provider,
         local_llm_address=local_llm_address,
         config=config,  # configを渡す
     )
+    if config is not None and config["hierarchical_initial_labelling"].get("execution_mode") == "batch":
+        return _initial_labelling_with_batch_api(cluster_ids, sampled_arguments, prompt, model, config)
     with ThreadPoolExecutor(max_workers=workers) as executor:
-        results = list(executor.map(process_func, cluster_ids))
+        results = list(executor.map(process_func, cluster_ids, sampled_arguments))
+    return pd.DataFrame(results)
+
+
+def _initial_labelling_with_batch_api(
+    cluster_ids,
+    sampled_arguments: list[np.ndarray],
+    prompt: str,
+    model: str,
+    config: dict,
+) -> pd.DataFrame:
+    """全クラスタのラベリングをバッチAPIでまとめて実行する"""
+    requests = [
+        BatchRequest(
+            custom_id=str(cluster_id),
+            messages=_initial_labelling_messages(arguments, prompt),
+            model=model,
+            json_schema=LabellingFromat,
+        )
+        for cluster_id, arguments in zip(cluster_ids, sampled_arguments, strict=True)
+    ]
+    responses = run_batch(
+        requests,
+        f"outputs/{config['output_dir']}/batch",
+        "hierarchical_initial_labelling",
+        create_batch_backend(config),
+        poll_interval=config.get("batch", {}).get("poll_interval", DEFAULT_POLL_INTERVAL),
+        on_wait=lambda: update_status(config, {}),
+    )
+    results = []
+    for cluster_id in cluster_ids:
+        response = responses[str(cluster_id)]
+        if response is None:
+            results.append(_error_result(cluster_id))
+            continue
+        response_text, token_input, token_output, token_total = response
+        config["total_token_usage"] = config.get("total_token_usage", 0) + token_total
+        config["token_usage_input"] = config.get("token_usage_input", 0) + token_input
+        config["token_usage_output"] = config.get("token_usage_output", 0) + token_output
+        results.append(_parse_labelling_response(cluster_id, response_text))
     return pd.DataFrame(results)
 
 
@@ -124,10 +181,8 @@ class LabellingFromat(BaseModel):
 
 def process_initial_labelling(
     cluster_id: str,
-    df: pd.DataFrame,
+    sampled_arguments: np.ndarray,
     prompt: str,
-    sampling_num: int,
-    target_column: str,
     model: str,
     provider: str = "openai",
     local_llm_address: str | None = None,
@@ -137,10 +192,8 @@ def process_initial_labelling(
 
     Args:
         cluster_id: 処理対象のクラスタID
-        df: クラスタリング結果のDataFrame
+        sampled_arguments: クラスタからサンプリングした意見
         prompt: LLMへのプロンプト
-        sampling_num: サンプリングする意見の数
-        target_column: クラスタIDが格納されている列名
         model: 使用するLLMモデル名
         provider: LLMプロバイダー
         local_llm_address: ローカルLLMのアドレス
@@ -149,14 +202,7 @@ def process_initial_labelling(
     Returns:
         クラスタのラベリング結果
     """
-    cluster_data = df[df[target_column] == cluster_id]
-    sampling_num = min(sampling_num, len(cluster_data))
-    cluster = cluster_data.sample(sampling_num)
-    input = "\n".join(cluster["argument"].values)
-    messages = [
-        {"role": "system", "content": prompt},
-        {"role": "user", "content": input},
-    ]
+    messages = _initial_labelling_messages(sampled_arguments, prompt)
     try:
         response_text, token_input, token_output, token_total = request_to_chat_ai(
             messages=messages,
@@ -165,6 +211,7 @@ def process_initial_labelling(
             json_schema=LabellingFromat,
             local_llm_address=local_llm_address,
             user_api_key=os.getenv("USER_API_KEY"),
+            validate=lambda response: has_json_key(response, "label"),
         )
 
         # トークン使用量を累積（configが渡されている場合）
@@ -173,6 +220,23 @@ def process_initial_labelling(
             config["token_usage_input"] = config.get("token_usage_input", 0) + token_input
             config["token_usage_output"] = config.get("token_usage_output", 0) + token_output
 
+        return _parse_labelling_response(cluster_id, response_text)
+    except Exception as e:
+        print(e)
+        return _error_result(cluster_id)
+
+
+def _initial_labelling_messages(sampled_arguments: np.ndarray, prompt: str) -> list[dict]:
+    """サンプリングした意見から、ラベリング用のメッセージを作成する"""
+    input = "\n".join(sampled_arguments)
+    return [
+        {"role": "system", "content": prompt},
+        {"role": "user", "content": input},
+    ]
+
+
+def _parse_labelling_response(cluster_id: str, response_text: str | dict) -> LabellingResult:
+    try:
         response_json = json.loads(response_text) if isinstance(response_text, str) else response_text
         return LabellingResult(
             cluster_id=cluster_id,
@@ -181,8 +245,12 @@ def process_initial_labelling(
         )
     except Exception as e:
         print(e)
-        return LabellingResult(
-            cluster_id=cluster_id,
-            label="エラーでラベル名が取得できませんでした",
-            description="エラーで解説が取得できませんでした",
-        )
+        return _error_result(cluster_id)
+
+
+def _error_result(cluster_id: str) -> LabellingResult:
+    return LabellingResult(
+        cluster_id=cluster_id,
+        label="エラーでラベル名が取得できませんでした",
+        description="エラーで解説が取得できませんでした",
+    )
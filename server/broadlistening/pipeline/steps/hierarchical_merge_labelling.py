@@ -9,7 +9,13 @@ import pandas as pd
 from pydantic import BaseModel, Field
 from tqdm import tqdm
 
+from artifacts import artifact_context, artifact_format, write_artifact
+from hierarchical_utils import update_status
+from hierarchy import ClusterHierarchy, cluster_members
+from sampling import ArgumentSampler
+from services.batch_api import DEFAULT_POLL_INTERVAL, BatchRequest, create_batch_backend, run_batch
 from services.llm import request_to_chat_ai
+from services.parse_json_list import has_json_key
 
 
 @dataclass
@@ -49,70 +55,33 @@ def hierarchical_merge_labelling(config: dict) -> None:
             - output_dir: 出力ディレクトリ名
             - hierarchical_merge_labelling: マージラベリングの設定
                 - sampling_num: サンプリング数
+                - sampling_strategy: サンプリング戦略（"random" / "centroid" / "mmr"）
+                - sampling_seed: サンプリングの乱数シード
                 - prompt: LLMへのプロンプト
                 - model: 使用するLLMモデル名
                 - workers: 並列処理のワーカー数
+                - execution_mode: "realtime"（通常のAPI）または "batch"（バッチAPI）
             - provider: LLMプロバイダー
     """
     dataset = config["output_dir"]
     merge_path = f"outputs/{dataset}/hierarchical_merge_labels.csv"
-    clusters_df = pd.read_csv(f"outputs/{dataset}/hierarchical_initial_labels.csv")
+    clusters_df = artifact_context().read(f"outputs/{dataset}/hierarchical_initial_labels.csv")
 
     cluster_id_columns: list[str] = _filter_id_columns(clusters_df.columns)
+    hierarchy = ClusterHierarchy.from_clusters(clusters_df, cluster_id_columns)
     # ボトムクラスタのラベル・説明とクラスタid付きの各argumentを入力し、各階層のクラスタラベル・説明を生成し、argumentに付けたdfを作成
     merge_result_df = merge_labelling(
         clusters_df=clusters_df,
         cluster_id_columns=sorted(cluster_id_columns, reverse=True),
         config=config,
+        hierarchy=hierarchy,
     )
     # 上記のdfから各クラスタのlevel, id, label, description, valueを取得してdfを作成
     melted_df = melt_cluster_data(merge_result_df)
     # 上記のdfに親子関係を追加
-    parent_child_df = _build_parent_child_mapping(merge_result_df, cluster_id_columns)
-    melted_df = melted_df.merge(parent_child_df, on=["level", "id"], how="left")
-    density_df = calculate_cluster_density(melted_df, config)
-    density_df.to_csv(merge_path, index=False)
-
-
-def _build_parent_child_mapping(df: pd.DataFrame, cluster_id_columns: list[str]):
-    """クラスタ間の親子関係をマッピングする
-
-    Args:
-        df: クラスタリング結果のDataFrame
-        cluster_id_columns: クラスタIDのカラム名のリスト
-
-    Returns:
-        親子関係のマッピング情報を含むDataFrame
-    """
-    results = []
-    top_cluster_column = cluster_id_columns[0]
-    top_cluster_values = df[top_cluster_column].unique()
-    for c in top_cluster_values:
-        results.append(
-            {
-                "level": 1,
-                "id": c,
-                "parent": "0",  # aggregationで追加する全体クラスタのid
-            }
-        )
-
-    for idx in range(len(cluster_id_columns) - 1):
-        current_column = cluster_id_columns[idx]
-        children_column = cluster_id_columns[idx + 1]
-        current_level = current_column.replace("-id", "").replace("cluster-level-", "")
-        # 現在のレベルのクラスタid
-        current_cluster_values = df[current_column].unique()
-        for current_id in current_cluster_values:
-            children_ids = df.loc[df[current_column] == current_id, children_column].unique()
-            for child_id in children_ids:
-                results.append(
-                    {
-                        "level": int(current_level) + 1,
-                        "id": child_id,
-                        "parent": current_id,
-                    }
-                )
-    return pd.DataFrame(results)
+    melted_df = melted_df.merge(hierarchy.to_frame(), on=["level", "id"], how="left")
+    density_df = calculate_cluster_density(melted_df, merge_result_df)
+    write_artifact(density_df, merge_path, artifact_format(config))
 
 
 def _filter_id_columns(columns: list[str]) -> list[str]:
@@ -167,37 +136,65 @@ def melt_cluster_data(df: pd.DataFrame) -> pd.DataFrame:
     return pd.DataFrame(all_rows)
 
 
-def merge_labelling(clusters_df: pd.DataFrame, cluster_id_columns: list[str], config) -> pd.DataFrame:
+def merge_labelling(
+    clusters_df: pd.DataFrame,
+    cluster_id_columns: list[str],
+    config,
+    hierarchy: ClusterHierarchy | None = None,
+) -> pd.DataFrame:
     """階層的なクラスタのマージラベリングを実行する
 
     Args:
         clusters_df: クラスタリング結果のDataFrame
         cluster_id_columns: クラスタIDのカラム名のリスト
         config: 設定情報を含む辞書
+        hierarchy: クラスタの階層構造（省略時は clusters_df から作る）
 
     Returns:
         マージラベリング結果を含むDataFrame
     """
+    if hierarchy is None:
+        hierarchy = ClusterHierarchy.from_clusters(clusters_df, cluster_id_columns)
+    sampling_num = config["hierarchical_merge_labelling"]["sampling_num"]
+    # サンプリングは全階層で同じ行の並びに対して行うため、埋め込みの読み込みと対応付けは1回で済ませる
+    sampling_df = clusters_df
+    arguments = sampling_df["argument"].to_numpy()
+    sampler = ArgumentSampler.from_config(config["hierarchical_merge_labelling"], sampling_df, config["output_dir"])
+
     for idx in tqdm(range(len(cluster_id_columns) - 1)):
         previous_columns = ClusterColumns.from_id_column(cluster_id_columns[idx])
         current_columns = ClusterColumns.from_id_column(cluster_id_columns[idx + 1])
 
-        process_fn = partial(
-            process_merge_labelling,
-            result_df=clusters_df,
-            current_columns=current_columns,
-            previous_columns=previous_columns,
-            config=config,
-        )
-
         current_cluster_ids = sorted(clusters_df[current_columns.id].unique())
-        with ThreadPoolExecutor(max_workers=config["hierarchical_merge_labelling"]["workers"]) as executor:
-            responses = list(
-                tqdm(
-                    executor.map(process_fn, current_cluster_ids),
-                    total=len(current_cluster_ids),
-                )
+        previous_values = _collect_previous_values(clusters_df, hierarchy, current_cluster_ids, previous_columns)
+        # クラスタごとの意見を1回のgroupbyでまとめて取り出し、設定した戦略でサンプリングする
+        members = cluster_members(sampling_df, current_columns.id)
+        sampled_arguments = {
+            cluster_id: arguments[sampler.sample(cluster_id, members[cluster_id], sampling_num)]
+            for cluster_id in current_cluster_ids
+        }
+        if config["hierarchical_merge_labelling"].get("execution_mode") == "batch":
+            responses = _merge_labelling_with_batch_api(
+                current_cluster_ids, sampled_arguments, current_columns, previous_values, config
+            )
+        else:
+            process_fn = partial(
+                process_merge_labelling,
+                current_columns=current_columns,
+                config=config,
             )
+            with ThreadPoolExecutor(max_workers=config["hierarchical_merge_labelling"]["workers"]) as executor:
+                responses = list(
+                    tqdm(
+                        executor.map(
+                            process_fn,
+                            current_cluster_ids,
+                            [previous_values[cluster_id] for cluster_id in current_cluster_ids],
+                            [sampled_arguments[cluster_id] for cluster_id in current_cluster_ids],
+                        ),
+                        total=len(current_cluster_ids),
+                    )
+                )
 
         current_result_df = pd.DataFrame(responses)
         clusters_df = clusters_df.merge(current_result_df, on=[current_columns.id])
@@ -213,39 +210,24 @@ class LabellingFromat(BaseModel):
 
 def process_merge_labelling(
     target_cluster_id: str,
-    result_df: pd.DataFrame,
+    previous_values: list[ClusterValues],
+    sampled_arguments: np.ndarray,
     current_columns: ClusterColumns,
-    previous_columns: ClusterColumns,
     config,
 ):
     """個別のクラスタに対してマージラベリングを実行する
 
     Args:
         target_cluster_id: 処理対象のクラスタID
-        result_df: クラスタリング結果のDataFrame
+        previous_values: 子クラスタ（前のレベル）のラベル・説明
+        sampled_arguments: クラスタからサンプリングした意見
         current_columns: 現在のレベルのカラム情報
-        previous_columns: 前のレベルのカラム情報
         config: 設定情報を含む辞書
 
     Returns:
         マージラベリング結果を含む辞書
     """
 
-    def filter_previous_values(df: pd.DataFrame, previous_columns: ClusterColumns) -> list[ClusterValues]:
-        """前のレベルのクラスタ情報を取得する"""
-        previous_records = df[df[current_columns.id] == target_cluster_id][
-            [previous_columns.label, previous_columns.description]
-        ].drop_duplicates()
-        previous_values = [
-            ClusterValues(
-                label=row[previous_columns.label],
-                description=row[previous_columns.description],
-            )
-            for _, row in previous_records.iterrows()
-        ]
-        return previous_values
-
-    previous_values = filter_previous_values(result_df, previous_columns)
     if len(previous_values) == 1:
         return {
             current_columns.id: target_cluster_id,
@@ -255,21 +237,7 @@ def process_merge_labelling(
     elif len(previous_values) == 0:
         raise ValueError(f"クラスタ {target_cluster_id} には前のレベルのクラスタが存在しません。")
 
-    current_cluster_data = result_df[result_df[current_columns.id] == target_cluster_id]
-    sampling_num = min(
-        config["hierarchical_merge_labelling"]["sampling_num"],
-        len(current_cluster_data),
-    )
-    sampled_data = current_cluster_data.sample(sampling_num)
-    sampled_argument_text = "\n".join(sampled_data["argument"].values)
-    cluster_text = "\n".join([value.to_prompt_text() for value in previous_values])
-    messages = [
-        {"role": "system", "content": config["hierarchical_merge_labelling"]["prompt"]},
-        {
-            "role": "user",
-            "content": "クラスタラベル\n" + cluster_text + "\n" + "クラスタの意見\n" + sampled_argument_text,
-        },
-    ]
+    messages = _merge_labelling_messages(sampled_arguments, previous_values, config)
     try:
         response_text, token_input, token_output, token_total = request_to_chat_ai(
             messages=messages,
@@ -278,6 +246,7 @@ def process_merge_labelling(
             provider=config["provider"],
             local_llm_address=config.get("local_llm_address"),
             user_api_key=os.getenv("USER_API_KEY"),
+            validate=lambda response: has_json_key(response, "label"),
         )
 
         config["total_token_usage"] = config.get("total_token_usage", 0) + token_total
@@ -285,6 +254,108 @@ def process_merge_labelling(
         config["token_usage_output"] = config.get("token_usage_output", 0) + token_output
         print(f"Merge labelling: input={token_input}, output={token_output}, total={token_total} tokens")
 
+        return _parse_merge_labelling_response(target_cluster_id, current_columns, response_text)
+    except Exception as e:
+        print(f"エラーが発生しました: {e}")
+        return _error_result(target_cluster_id, current_columns)
+
+
+def _merge_labelling_with_batch_api(
+    cluster_ids: list,
+    sampled_arguments: dict[str, np.ndarray],
+    current_columns: ClusterColumns,
+    previous_values_by_cluster: dict[str, list[ClusterValues]],
+    config: dict,
+) -> list[dict]:
+    """1つの階層の全クラスタのマージラベリングをバッチAPIでまとめて実行する"""
+    results = {}
+    requests = []
+    for cluster_id in cluster_ids:
+        previous_values = previous_values_by_cluster[cluster_id]
+        if len(previous_values) == 1:
+            results[cluster_id] = {
+                current_columns.id: cluster_id,
+                current_columns.label: previous_values[0].label,
+                current_columns.description: previous_values[0].description,
+            }
+        elif len(previous_values) == 0:
+            raise ValueError(f"クラスタ {cluster_id} には前のレベルのクラスタが存在しません。")
+        else:
+            requests.append(
+                BatchRequest(
+                    custom_id=str(cluster_id),
+                    messages=_merge_labelling_messages(sampled_arguments[cluster_id], previous_values, config),
+                    model=config["hierarchical_merge_labelling"]["model"],
+                    json_schema=LabellingFromat,
+                )
+            )
+
+    responses = run_batch(
+        requests,
+        f"outputs/{config['output_dir']}/batch",
+        f"hierarchical_merge_labelling_{current_columns.id}",
+        create_batch_backend(config),
+        poll_interval=config.get("batch", {}).get("poll_interval", DEFAULT_POLL_INTERVAL),
+        on_wait=lambda: update_status(config, {}),
+    )
+    for cluster_id in cluster_ids:
+        if cluster_id in results:
+            continue
+        response = responses[str(cluster_id)]
+        if response is None:
+            results[cluster_id] = _error_result(cluster_id, current_columns)
+            continue
+        response_text, token_input, token_output, token_total = response
+        config["total_token_usage"] = config.get("total_token_usage", 0) + token_total
+        config["token_usage_input"] = config.get("token_usage_input", 0) + token_input
+        config["token_usage_output"] = config.get("token_usage_output", 0) + token_output
+        results[cluster_id] = _parse_merge_labelling_response(cluster_id, current_columns, response_text)
+    return [results[cluster_id] for cluster_id in cluster_ids]
+
+
+def _collect_previous_values(
+    df: pd.DataFrame, hierarchy: ClusterHierarchy, cluster_ids: list[str], previous_columns: ClusterColumns
+) -> dict[str, list[ClusterValues]]:
+    """各クラスタの子クラスタ（前のレベル）のラベル・説明を、階層の親子関係からまとめて取得する
+
+    ラベル・説明が同じ子クラスタは1つにまとめる。
+    """
+    child_records = df[[previous_columns.id, previous_columns.label, previous_columns.description]].drop_duplicates(
+        previous_columns.id
+    )
+    child_values = {
+        child_id: (label, description) for child_id, label, description in child_records.itertuples(index=False)
+    }
+    previous_values = {}
+    for cluster_id in cluster_ids:
+        unique_values = dict.fromkeys(child_values[child_id] for child_id in hierarchy.children.get(cluster_id, []))
+        previous_values[cluster_id] = [
+            ClusterValues(label=label, description=description) for label, description in unique_values
+        ]
+    return previous_values
+
+
+def _merge_labelling_messages(
+    sampled_arguments: np.ndarray,
+    previous_values: list[ClusterValues],
+    config: dict,
+) -> list[dict]:
+    """サンプリングした意見と子クラスタのラベルから、マージラベリング用のメッセージを作成する"""
+    sampled_argument_text = "\n".join(sampled_arguments)
+    cluster_text = "\n".join([value.to_prompt_text() for value in previous_values])
+    return [
+        {"role": "system", "content": config["hierarchical_merge_labelling"]["prompt"]},
+        {
+            "role": "user",
+            "content": "クラスタラベル\n" + cluster_text + "\n" + "クラスタの意見\n" + sampled_argument_text,
+        },
+    ]
+
+
+def _parse_merge_labelling_response(
+    target_cluster_id: str, current_columns: ClusterColumns, response_text: str | dict
+) -> dict:
+    try:
         response_json = json.loads(response_text) if isinstance(response_text, str) else response_text
         return {
             current_columns.id: target_cluster_id,
@@ -293,32 +364,69 @@ def process_merge_labelling(
         }
     except Exception as e:
         print(f"エラーが発生しました: {e}")
-        return {
-            current_columns.id: target_cluster_id,
-            current_columns.label: "エラーでラベル名が取得できませんでした",
-            current_columns.description: "エラーで解説が取得できませんでした",
-        }
+        return _error_result(target_cluster_id, current_columns)
 
 
-def calculate_cluster_density(melted_df: pd.DataFrame, config: dict):
-    """クラスタ内の密度計算"""
-    hierarchical_cluster_df = pd.read_csv(f"outputs/{config['output_dir']}/hierarchical_clusters.csv")
+def _error_result(target_cluster_id: str, current_columns: ClusterColumns) -> dict:
+    return {
+        current_columns.id: target_cluster_id,
+        current_columns.label: "エラーでラベル名が取得できませんでした",
+        current_columns.description: "エラーで解説が取得できませんでした",
+    }
 
-    densities = []
-    for level, c_id in zip(melted_df["level"], melted_df["id"], strict=False):
-        cluster_embeds = hierarchical_cluster_df[hierarchical_cluster_df[f"cluster-level-{level}-id"] == c_id][
-            ["x", "y"]
-        ].values
-        density = calculate_density(cluster_embeds)
-        densities.append(density)
+
+def calculate_cluster_density(melted_df: pd.DataFrame, clusters_df: pd.DataFrame):
+    """クラスタ内の密度計算
+
+    Args:
+        melted_df: 行形式のクラスタ情報（level, id を含む）
+        clusters_df: 意見ごとの座標（x, y）と各階層のクラスタidを含むDataFrame
+    """
+    embeds = clusters_df[["x", "y"]].to_numpy(dtype=float)
+
+    # 階層ごとに全クラスタの密度をまとめて計算する
+    density_by_cluster = {}
+    for level in melted_df["level"].unique():
+        codes, cluster_ids = pd.factorize(clusters_df[f"cluster-level-{level}-id"])
+        valid = codes >= 0
+        densities = calculate_densities(embeds[valid], codes[valid], len(cluster_ids))
+        density_by_cluster.update(
+            ((level, c_id), density) for c_id, density in zip(cluster_ids, densities, strict=True)
+        )
 
     # 密度のランクを計算
-    melted_df["density"] = densities
+    melted_df["density"] = [
+        density_by_cluster.get((level, c_id), np.nan)
+        for level, c_id in zip(melted_df["level"], melted_df["id"], strict=False)
+    ]
     melted_df["density_rank"] = melted_df.groupby("level")["density"].rank(ascending=False, method="first")
     melted_df["density_rank_percentile"] = melted_df.groupby("level")["density_rank"].transform(lambda x: x / len(x))
     return melted_df
 
 
+def calculate_densities(embeds: np.ndarray, labels: np.ndarray, n_clusters: int) -> np.ndarray:
+    """calculate_density をクラスタごとに適用した結果を、ラベルの bincount だけでまとめて求める
+
+    Args:
+        embeds: 各点の座標 (N, d)
+        labels: 各点のクラスタ番号 (0 〜 n_clusters - 1)
+        n_clusters: クラスタ数
+
+    Returns:
+        クラスタ番号順の密度
+    """
+    counts = np.bincount(labels, minlength=n_clusters)
+    centers = (
+        np.column_stack(
+            [np.bincount(labels, weights=embeds[:, dim], minlength=n_clusters) for dim in range(embeds.shape[1])]
+        )
+        / counts[:, None]
+    )
+    distances = np.linalg.norm(embeds - centers[labels], axis=1)
+    avg_distances = np.bincount(labels, weights=distances, minlength=n_clusters) / counts
+    return 1 / (avg_distances + 1e-10)
+
+
 def calculate_density(embeds: np.ndarray):
     """平均距離に基づいて密度を計算"""
     center = np.mean(embeds, axis=0)
@@ -4,9 +4,9 @@ import json
 import os
 import re
 
-import pandas as pd
 from pydantic import BaseModel, Field
 
+from artifacts import artifact_context
 from services.llm import request_to_chat_ai
 
 
@@ -18,7 +18,7 @@ def hierarchical_overview(config):
     dataset = config["output_dir"]
     path = f"outputs/{dataset}/hierarchical_overview.txt"
 
-    hierarchical_label_df = pd.read_csv(f"outputs/{dataset}/hierarchical_merge_labels.csv")
+    hierarchical_label_df = artifact_context().read(f"outputs/{dataset}/hierarchical_merge_labels.csv")
 
     prompt = config["hierarchical_overview"]["prompt"]
     model = config["hierarchical_overview"]["model"]
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""hierarchical_aggregation._build_arguments のベンチマーク
+
+以前の行ごとの実装と現在の列ごとの実装を同じ合成データで実行し、
+hierarchical_result.json と同じ形式でシリアライズした結果がバイト単位で一致することと、処理時間を確認します。
+
+実行方法:
+    cd server && rye run python scripts/benchmark_aggregation.py --comments 50000
+"""
+
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "broadlistening" / "pipeline"))
+from steps.hierarchical_aggregation import Argument, _build_arguments  # noqa: E402
+
+
+def build_arguments_rowwise(
+    clusters: pd.DataFrame, comments: pd.DataFrame, relation_df: pd.DataFrame, config: dict
+) -> list[Argument]:
+    """以前の実装（行ごとにコメント全体を絞り込む）"""
+    cluster_columns = [col for col in clusters.columns if col.startswith("cluster-level-") and "id" in col]
+
+    # Prepare for merging with original comments to get attributes
+    comments_copy = comments.copy()
+    comments_copy["comment-id"] = comments_copy["comment-id"].astype(str)
+
+    # Get argument to comment mapping
+    arg_comment_map = {}
+    if "comment-id" in relation_df.columns:
+        relation_df["comment-id"] = relation_df["comment-id"].astype(str)
+        arg_comment_map = dict(zip(relation_df["arg-id"], relation_df["comment-id"], strict=False))
+
+    # Find attribute columns in comments dataframe
+    attribute_columns = [col for col in comments.columns if col.startswith("attribute_")]
+    print(f"属性カラム検出: {attribute_columns}")
+
+    arguments: list[Argument] = []
+    for _, row in clusters.iterrows():
+        cluster_ids = ["0"]
+        for cluster_column in cluster_columns:
+            cluster_ids.append(str(row[cluster_column]))  # Convert to string to ensure serializable
+
+        # Create base argument
+        argument: Argument = {
+            "arg_id": str(row["arg-id"]),  # Convert to string to ensure serializable
+            "argument": str(row["argument"]),
+            "x": float(row["x"]),  # Convert to native float
+            "y": float(row["y"]),  # Convert to native float
+            "p": 0,  # NOTE: 一旦全部0でいれる
+            "cluster_ids": cluster_ids,
+            "attributes": None,
+            "url": None,
+        }
+
+        # Add attributes and URL if available
+        if row["arg-id"] in arg_comment_map:
+            comment_id = arg_comment_map[row["arg-id"]]
+            comment_rows = comments_copy[comments_copy["comment-id"] == comment_id]
+
+            if not comment_rows.empty:
+                comment_row = comment_rows.iloc[0]
+
+                # Add URL if available and enabled
+                if config.get("enable_source_link", False) and "url" in comment_row and comment_row["url"] is not None:
+                    argument["url"] = str(comment_row["url"])
+
+                # Add attributes if available
+                if attribute_columns:
+                    attributes = {}
+                    for attr_col in attribute_columns:
+                        # Remove "attribute_" prefix for cleaner attribute names
+                        attr_name = attr_col[len("attribute_") :]
+                        # Convert potential numpy types to Python native types
+                        attr_value = comment_row.get(attr_col, None)
+                        if attr_value is not None:
+                            if isinstance(attr_value, np.integer):
+                                attr_value = int(attr_value)
+                            elif isinstance(attr_value, np.floating):
+                                attr_value = float(attr_value)
+                            elif isinstance(attr_value, np.ndarray):
+                                attr_value = attr_value.tolist()
+                        attributes[attr_name] = attr_value
+
+                    # Only add non-empty attributes
+                    if any(v is not None for v in attributes.values()):
+                        argument["attributes"] = attributes
+
+        arguments.append(argument)
+    return arguments
+
+
+def make_dataset(n_comments: int, args_per_comment: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    comment_ids = np.arange(n_comments)
+    comments = pd.DataFrame(
+        {
+            "comment-id": comment_ids,
+            "comment-body": [f"コメント{i}" for i in comment_ids],
+            "url": [f"https://example.com/{i}" if i % 7 else None for i in comment_ids],
+            "attribute_age": rng.integers(10, 80, n_comments),
+            "attribute_score": np.where(rng.random(n_comments) < 0.1, np.nan, rng.random(n_comments)),
+            "attribute_region": rng.choice(["北海道", "東京都", "大阪府", None], n_comments),
+        }
+    )
+    arg_ids = [f"A{c}_{j}" for c in comment_ids for j in range(args_per_comment)]
+    relation_df = pd.DataFrame({"arg-id": arg_ids, "comment-id": np.repeat(comment_ids, args_per_comment)})
+    n_args = len(arg_ids)
+    fine = rng.integers(0, 300, n_args)
+    clusters = pd.DataFrame(
+        {
+            "arg-id": arg_ids,
+            "argument": [f"意見{i}" for i in range(n_args)],
+            "x": rng.normal(size=n_args),
+            "y": rng.normal(size=n_args),
+            "cluster-level-1-id": [f"1_{label % 10}" for label in fine],
+            "cluster-level-2-id": [f"2_{label}" for label in fine],
+        }
+    )
+    return clusters, comments, relation_df
+
+
+def json_serialize_numpy(obj: Any) -> Any:
+    """以前の hierarchical_result.json の書き出しで使っていた、NumPyの型をPythonの型に再帰的に変換する処理"""
+    if isinstance(obj, np.integer):
+        return int(obj)
+    elif isinstance(obj, np.floating):
+        return float(obj)
+    elif isinstance(obj, np.ndarray):
+        return obj.tolist()
+    elif isinstance(obj, dict):
+        return {k: json_serialize_numpy(v) for k, v in obj.items()}
+    elif isinstance(obj, list):
+        return [json_serialize_numpy(item) for item in obj]
+    elif isinstance(obj, tuple):
+        return tuple(json_serialize_numpy(item) for item in obj)
+    else:
+        return obj
+
+
+def serialize(arguments) -> bytes:
+    return json.dumps(json_serialize_numpy(arguments), indent=2, ensure_ascii=False).encode("utf-8")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--comments", type=int, default=5000)
+    parser.add_argument("--args-per-comment", type=int, default=2)
+    parser.add_argument("--skip-rowwise", action="store_true", help="以前の実装の計測を省略する")
+    args = parser.parse_args()
+
+    clusters, comments, relation_df = make_dataset(args.comments, args.args_per_comment)
+    config = {"enable_source_link": True}
+    print(f"comments: {len(comments)}, arguments: {len(clusters)}")
+
+    started_at = time.perf_counter()
+    columnar = _build_arguments(clusters, comments, relation_df.copy(), config)
+    print(f"columnar: {time.perf_counter() - started_at:.2f}s")
+
+    if not args.skip_rowwise:
+        started_at = time.perf_counter()
+        rowwise = build_arguments_rowwise(clusters, comments, relation_df.copy(), config)
+        print(f"rowwise:  {time.perf_counter() - started_at:.2f}s")
+        assert serialize(columnar) == serialize(rowwise), "outputs differ"
+        print("outputs are byte-identical")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""中間ファイルの保存形式（CSV / Parquet）ごとの読み込み時間のベンチマーク
+
+hierarchical_clusters.csv と同じ列を持つ合成データを両方の形式で保存し、
+パイプラインと同じ read_artifact で読み込む時間とファイルサイズを比較します。
+
+実行方法:
+    cd server && rye run python scripts/benchmark_artifacts.py --rows 500000
+"""
+
+import argparse
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "broadlistening" / "pipeline"))
+from artifacts import ARTIFACT_FORMATS, read_artifact, write_artifact  # noqa: E402
+
+
+def make_clusters(n_rows: int) -> pd.DataFrame:
+    rng = np.random.default_rng(0)
+    fine = rng.integers(0, 100, size=n_rows)
+    return pd.DataFrame(
+        {
+            "arg-id": [f"A{i // 2}_{i % 2}" for i in range(n_rows)],
+            "argument": [f"意見{i}：公共交通の本数を増やしてほしい" for i in range(n_rows)],
+            "x": rng.normal(size=n_rows),
+            "y": rng.normal(size=n_rows),
+            "cluster-level-1-id": [f"1_{label % 10}" for label in fine],
+            "cluster-level-2-id": [f"2_{label}" for label in fine],
+        }
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=500000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    df = make_clusters(args.rows)
+    print(f"rows: {len(df)}")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for fmt in ARTIFACT_FORMATS:
+            output_dir = Path(tmp_dir) / fmt
+            output_dir.mkdir()
+            path = write_artifact(df, output_dir / "hierarchical_clusters.csv", fmt)
+
+            timings = []
+            for _ in range(args.repeat):
+                started_at = time.perf_counter()
+                loaded = read_artifact(path)
+                timings.append(time.perf_counter() - started_at)
+            assert loaded["arg-id"].tolist() == df["arg-id"].tolist()
+            print(f"{fmt:8s} {min(timings):6.2f}s  {path.stat().st_size / 1024 / 1024:7.1f}MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""hierarchical_result.json の書き出しのベンチマーク
+
+以前の書き出し（json_serialize_numpy でコピーしてから json.dump(indent=2)）と、
+write_result_json（orjson で arguments を1件ずつ書き出す）を、同じ合成データで別プロセスとして実行し、
+書き出し時間・最大RSS・ファイルサイズを比較します。
+
+実行方法:
+    cd server && rye run python scripts/benchmark_result_json.py --comments 50000
+"""
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "broadlistening" / "pipeline"))
+from benchmark_aggregation import json_serialize_numpy, make_dataset  # noqa: E402
+from steps.hierarchical_aggregation import _build_arguments, write_result_json  # noqa: E402
+
+WRITERS = ["json", "orjson", "orjson-compact"]
+
+
+def write_with_json(path: str, results: dict) -> None:
+    """以前の実装"""
+    results = json_serialize_numpy(results)
+    with open(path, "w") as file:
+        json.dump(results, file, indent=2, ensure_ascii=False)
+
+
+def run_writer(writer: str, n_comments: int, args_per_comment: int) -> None:
+    clusters, comments, relation_df = make_dataset(n_comments, args_per_comment)
+    results = {
+        "arguments": _build_arguments(clusters, comments, relation_df, {"enable_source_link": True}),
+        "clusters": [],
+        "comments": {},
+        "propertyMap": {},
+        "translations": {},
+        "overview": "",
+        "config": {},
+    }
+    del clusters, comments, relation_df
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "hierarchical_result.json")
+        started_at = time.perf_counter()
+        if writer == "json":
+            write_with_json(path, results)
+        else:
+            write_result_json(path, results, compact=writer == "orjson-compact")
+        elapsed = time.perf_counter() - started_at
+        size = os.path.getsize(path)
+
+    # ru_maxrss は Linux では KB 単位
+    rss_growth = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_before) / 1024
+    print(f"{writer:15s} {elapsed:6.2f}s  max RSS +{rss_growth:7.1f}MB  {size / 1024 / 1024:7.1f}MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--comments", type=int, default=50000)
+    parser.add_argument("--args-per-comment", type=int, default=2)
+    parser.add_argument("--writer", choices=WRITERS, help="指定した書き出し方法だけを現在のプロセスで実行する")
+    args = parser.parse_args()
+
+    if args.writer:
+        run_writer(args.writer, args.comments, args.args_per_comment)
+        return
+
+    print(f"arguments: {args.comments * args.args_per_comment}")
+    # 最大RSSを比較するため、書き出し方法ごとに別プロセスで実行する
+    for writer in WRITERS:
+        subprocess.run(
+            [
+                sys.executable,
+                __file__,
+                "--comments",
+                str(args.comments),
+                "--args-per-comment",
+                str(args.args_per_comment),
+                "--writer",
+                writer,
+            ],
+            check=True,
+        )
+
+
+if __name__ == "__main__":
+    main()
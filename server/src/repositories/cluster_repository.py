@@ -1,4 +1,8 @@
 import csv
+import os
+from pathlib import Path
+
+import pandas as pd
 
 from src.config import settings
 from src.core.exceptions import ClusterCSVParseError, ClusterFileNotFound
@@ -9,7 +13,11 @@ slogger = setup_logger()
 
 
 class ClusterRepository:
-    """クラスタの中間ファイル（csvファイル）を読み書きするrepository"""
+    """クラスタの中間ファイル（csvファイル、またはparquetファイル）を読み書きするrepository
+
+    パイプラインを artifact_format: parquet で実行した場合は parquet ファイルを読み書きする。
+    両方ある場合は、パイプラインと同じく後から書き込まれた方を使う。
+    """
 
     FIELDS = [
         "level",
@@ -25,7 +33,25 @@ class ClusterRepository:
 
     def __init__(self, slug: str):
         self.slug = slug
-        self.labels_path = settings.REPORT_DIR / slug / "hierarchical_merge_labels.csv"
+        self.labels_path = self._resolve_labels_path(settings.REPORT_DIR / slug)
+
+    @staticmethod
+    def _resolve_labels_path(report_dir: Path) -> Path:
+        csv_path = report_dir / "hierarchical_merge_labels.csv"
+        parquet_path = report_dir / "hierarchical_merge_labels.parquet"
+        if os.path.exists(parquet_path) and (
+            not os.path.exists(csv_path) or os.path.getmtime(parquet_path) > os.path.getmtime(csv_path)
+        ):
+            return parquet_path
+        return csv_path
+
+    def _read_rows(self) -> list[dict]:
+        """各行を、CSVと同じく欠損値を空文字にした辞書として読み込む"""
+        if self.labels_path.suffix == ".parquet":
+            df = pd.read_parquet(self.labels_path)
+            return df.astype(object).where(df.notna(), "").to_dict("records")
+        with open(self.labels_path, encoding="utf-8") as csvfile:
+            return list(csv.DictReader(csvfile))
 
     def read_from_csv(self) -> list[ClusterResponse]:
         """中間ファイル（CSVファイル）からクラスタのラベル・説明を読み込む"""
@@ -36,27 +62,25 @@ class ClusterRepository:
             raise ClusterFileNotFound(f"File not found: {self.labels_path}")
 
         try:
-            with open(self.labels_path, encoding="utf-8") as csvfile:
-                reader = csv.DictReader(csvfile)
-                for row in reader:
-                    try:
-                        cluster = ClusterResponse(
-                            level=int(row["level"]),
-                            id=row["id"],
-                            label=row["label"],
-                            description=row["description"],
-                            value=int(row["value"]),
-                            parent=row["parent"],
-                            density=float(row["density"]) if row["density"] else None,
-                            density_rank=int(float(row["density_rank"])) if row["density_rank"] else None,
-                            density_rank_percentile=float(row["density_rank_percentile"])
-                            if row["density_rank_percentile"]
-                            else None,
-                        )
-                        clusters.append(cluster)
-                    except KeyError as e:
-                        slogger.warning(f"KeyError: {e} in row: {row}")
-                        continue
+            for row in self._read_rows():
+                try:
+                    cluster = ClusterResponse(
+                        level=int(row["level"]),
+                        id=row["id"],
+                        label=row["label"],
+                        description=row["description"],
+                        value=int(row["value"]),
+                        parent=row["parent"],
+                        density=float(row["density"]) if row["density"] not in ("", None) else None,
+                        density_rank=int(float(row["density_rank"])) if row["density_rank"] not in ("", None) else None,
+                        density_rank_percentile=float(row["density_rank_percentile"])
+                        if row["density_rank_percentile"] not in ("", None)
+                        else None,
+                    )
+                    clusters.append(cluster)
+                except KeyError as e:
+                    slogger.warning(f"KeyError: {e} in row: {row}")
+                    continue
 
             return clusters
         except FileNotFoundError:
@@ -81,6 +105,10 @@ class ClusterRepository:
                     cluster["description"] = updated_cluster.description
                 merged_clusters.append(cluster)
 
+            if self.labels_path.suffix == ".parquet":
+                pd.DataFrame(merged_clusters, columns=self.FIELDS).to_parquet(self.labels_path, index=False)
+                return True
+
             with open(self.labels_path, mode="w", encoding="utf-8", newline="") as csvfile:
                 writer = csv.DictWriter(csvfile, fieldnames=self.FIELDS)
 
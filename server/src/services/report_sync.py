@@ -23,6 +23,11 @@ class ReportSyncService:
         "args.csv",
         "hierarchical_clusters.csv",
         "relations.csv",
+        # artifact_format: parquet で実行したレポートの中間ファイル
+        "hierarchical_merge_labels.parquet",
+        "args.parquet",
+        "hierarchical_clusters.parquet",
+        "relations.parquet",
         "hierarchical_overview.txt",
     )
 
@@ -0,0 +1,8 @@
+import sys
+from pathlib import Path
+
+# パイプラインのステップは broadlistening/pipeline をカレントディレクトリとして実行される前提で
+# `from services.llm import ...` のようにimportしているため、テスト時もパスに追加する
+PIPELINE_DIR = Path(__file__).parent.parent.parent / "broadlistening" / "pipeline"
+if str(PIPELINE_DIR) not in sys.path:
+    sys.path.insert(0, str(PIPELINE_DIR))
@@ -0,0 +1,158 @@
+import os
+
+import artifacts
+import numpy as np
+import pandas as pd
+import pytest
+from artifacts import (
+    ArtifactContext,
+    artifact_format,
+    export_csv,
+    find_artifact,
+    load_embeddings,
+    save_embeddings,
+    write_artifact,
+)
+
+
+class TestEmbeddingsArtifact:
+    """埋め込みアーティファクトの読み書きのテスト"""
+
+    def test_save_and_load(self, tmp_path):
+        """load_embeddings: 保存した埋め込みをメモリマップで読み込める"""
+        vectors = np.array([[0.1, 0.2], [0.3, 0.4]])
+        save_embeddings(str(tmp_path), ["A1_0", "A2_0"], vectors)
+
+        arg_ids, loaded = load_embeddings(str(tmp_path))
+
+        assert arg_ids == ["A1_0", "A2_0"]
+        assert isinstance(loaded, np.memmap)
+        assert loaded.dtype == np.float32
+        np.testing.assert_allclose(loaded, vectors, rtol=1e-6)
+
+    def test_load_legacy_pickle(self, tmp_path):
+        """load_embeddings: 旧形式の embeddings.pkl も読み込める"""
+        pd.DataFrame({"arg-id": ["A1_0", "A2_0"], "embedding": [[0.1, 0.2], [0.3, 0.4]]}).to_pickle(
+            tmp_path / "embeddings.pkl"
+        )
+
+        arg_ids, loaded = load_embeddings(str(tmp_path))
+
+        assert arg_ids == ["A1_0", "A2_0"]
+        np.testing.assert_allclose(loaded, [[0.1, 0.2], [0.3, 0.4]], rtol=1e-6)
+
+    def test_save_rejects_mismatched_ids(self, tmp_path):
+        """save_embeddings: arg-idの数と行数が一致しない場合はエラー"""
+        with pytest.raises(ValueError):
+            save_embeddings(str(tmp_path), ["A1_0"], np.zeros((2, 3)))
+
+    def test_load_missing(self, tmp_path):
+        """load_embeddings: 埋め込みが存在しない場合はFileNotFoundError"""
+        with pytest.raises(FileNotFoundError):
+            load_embeddings(str(tmp_path))
+
+
+class TestArtifactContext:
+    """中間ファイルの読み込みキャッシュのテスト"""
+
+    @pytest.fixture
+    def parse_count(self, monkeypatch):
+        calls = []
+        read_artifact = artifacts.read_artifact
+
+        def counting_read(path):
+            calls.append(path)
+            return read_artifact(path)
+
+        monkeypatch.setattr(artifacts, "read_artifact", counting_read)
+        return calls
+
+    def test_parses_each_file_once(self, tmp_path, parse_count):
+        """read: 同じファイルは1回だけパースし、呼び出し側の変更はキャッシュに影響しない"""
+        path = tmp_path / "args.csv"
+        pd.DataFrame({"arg-id": ["A1_0", "A2_0"], "argument": ["意見1", "意見2"]}).to_csv(path, index=False)
+        context = ArtifactContext()
+
+        first = context.read(path)
+        first.set_index("arg-id", inplace=True)
+        first["argument"] = "変更"
+        second = context.read(os.path.relpath(path))
+
+        assert len(parse_count) == 1
+        assert second["arg-id"].tolist() == ["A1_0", "A2_0"]
+        assert second["argument"].tolist() == ["意見1", "意見2"]
+
+    def test_rereads_rewritten_file(self, tmp_path, parse_count):
+        """read: ファイルが書き直された場合は読み直す"""
+        path = tmp_path / "relations.csv"
+        pd.DataFrame({"arg-id": ["A1_0"], "comment-id": [1]}).to_csv(path, index=False)
+        context = ArtifactContext()
+        context.read(path)
+
+        pd.DataFrame({"arg-id": ["A1_0", "A2_0"], "comment-id": [1, 2]}).to_csv(path, index=False)
+
+        assert len(context.read(path)) == 2
+        assert len(parse_count) == 2
+
+    def test_pins_string_columns(self, tmp_path):
+        """read: idや意見・ラベルの列は、数字だけでも文字列として読む"""
+        path = tmp_path / "hierarchical_clusters.csv"
+        pd.DataFrame(
+            {
+                "arg-id": ["A1_0"],
+                "argument": ["123"],
+                "x": [0.5],
+                "cluster-level-1-id": ["1_0"],
+                "cluster-level-1-label": ["2024"],
+            }
+        ).to_csv(path, index=False)
+
+        df = ArtifactContext().read(path)
+
+        assert df.loc[0, "argument"] == "123"
+        assert df.loc[0, "cluster-level-1-label"] == "2024"
+        assert df.loc[0, "x"] == 0.5
+
+
+class TestArtifactFormat:
+    """中間ファイルの保存形式（CSV / Parquet）のテスト"""
+
+    def test_artifact_format(self):
+        """artifact_format: 未指定ならcsv、未知の形式はエラー"""
+        assert artifact_format({}) == "csv"
+        assert artifact_format({"artifact_format": "parquet"}) == "parquet"
+        with pytest.raises(ValueError):
+            artifact_format({"artifact_format": "feather"})
+
+    def test_find_artifact_prefers_newer_file(self, tmp_path):
+        """find_artifact: CSVとParquetの両方がある場合は、後から書き込まれた方を返す"""
+        csv_path = tmp_path / "args.csv"
+        parquet_path = tmp_path / "args.parquet"
+        csv_path.write_text("")
+        parquet_path.write_text("")
+        os.utime(csv_path, ns=(1_000_000_000, 1_000_000_000))
+        os.utime(parquet_path, ns=(2_000_000_000, 2_000_000_000))
+
+        assert find_artifact(csv_path) == parquet_path
+        os.utime(csv_path, ns=(3_000_000_000, 3_000_000_000))
+        assert find_artifact(csv_path) == csv_path
+        assert find_artifact(tmp_path / "relations.csv") is None
+        # CSV/Parquet 以外のファイルはそのまま
+        (tmp_path / "hierarchical_result.json").write_text("{}")
+        assert find_artifact(tmp_path / "hierarchical_result.json") == tmp_path / "hierarchical_result.json"
+
+    def test_parquet_round_trip_and_csv_export(self, tmp_path):
+        """write_artifact: Parquetで保存したものを .csv の名前で読め、export_csv でCSVに書き出せる"""
+        pytest.importorskip("pyarrow")
+        df = pd.DataFrame({"arg-id": ["A1_0", "A2_0"], "argument": ["123", "意見"], "x": [0.5, np.nan]})
+
+        written = write_artifact(df, tmp_path / "args.csv", "parquet")
+        loaded = ArtifactContext().read(tmp_path / "args.csv")
+
+        assert written == tmp_path / "args.parquet"
+        assert not (tmp_path / "args.csv").exists()
+        pd.testing.assert_frame_equal(loaded, df)
+
+        assert export_csv(tmp_path) == [tmp_path / "args.csv"]
+        exported = ArtifactContext().read(tmp_path / "args.csv")
+        assert exported["argument"].tolist() == ["123", "意見"]
@@ -0,0 +1,54 @@
+from unittest.mock import patch
+
+import openai
+import pytest
+from steps.embedding import RateLimitBackoff, _make_batches, _request_with_backoff
+
+
+class TestMakeBatches:
+    """_make_batchesのテスト"""
+
+    def test_split_by_item_count(self):
+        """_make_batches: 件数の上限でバッチを分割する"""
+        batches = _make_batches(["a", "b", "c", "d", "e"], max_items=2, max_tokens=100)
+        assert batches == [["a", "b"], ["c", "d"], ["e"]]
+
+    def test_split_by_token_count(self):
+        """_make_batches: トークン数の上限でバッチを分割する"""
+        batches = _make_batches(["aaaa", "bbbb", "cc", "dddddd"], max_items=100, max_tokens=8)
+        assert batches == [["aaaa", "bbbb"], ["cc", "dddddd"]]
+
+    def test_oversized_text_gets_own_batch(self):
+        """_make_batches: 上限を超える長さのテキストも単独のバッチとして送る"""
+        batches = _make_batches(["a", "b" * 20, "c"], max_items=100, max_tokens=8)
+        assert batches == [["a"], ["b" * 20], ["c"]]
+
+
+class TestRequestWithBackoff:
+    """_request_with_backoffのテスト"""
+
+    @staticmethod
+    def _rate_limit_error():
+        response = type("Response", (), {"request": None, "status_code": 429, "headers": {}})()
+        return openai.RateLimitError("rate limit", response=response, body=None)
+
+    def test_retries_on_rate_limit(self):
+        """_request_with_backoff: レート制限エラーの場合は待ってから再送する"""
+        backoff = RateLimitBackoff(base_wait=0.001)
+        with patch(
+            "steps.embedding.request_to_embed",
+            side_effect=[self._rate_limit_error(), [[0.1, 0.2]]],
+        ) as mock_request:
+            result = _request_with_backoff(backoff, ["text"], "text-embedding-3-small")
+
+        assert result == [[0.1, 0.2]]
+        assert mock_request.call_count == 2
+
+    def test_raises_other_errors_immediately(self):
+        """_request_with_backoff: レート制限以外のエラーは再送せずに送出する"""
+        backoff = RateLimitBackoff(base_wait=0.001)
+        with patch("steps.embedding.request_to_embed", side_effect=ValueError("bad")) as mock_request:
+            with pytest.raises(ValueError):
+                _request_with_backoff(backoff, ["text"], "text-embedding-3-small")
+
+        assert mock_request.call_count == 1
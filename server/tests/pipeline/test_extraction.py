@@ -0,0 +1,383 @@
+import importlib
+import json
+import threading
+import time
+
+import pytest
+
+from tests.pipeline.conftest import PIPELINE_DIR
+
+
+@pytest.fixture
+def extraction_module(monkeypatch):
+    # utils.py がカレントディレクトリの specs.json を読み込むため
+    monkeypatch.chdir(PIPELINE_DIR)
+    return importlib.import_module("steps.extraction")
+
+
+class TestExtractStream:
+    """extract_streamのテスト"""
+
+    def test_yields_all_inputs_without_waiting_for_slowest(self, extraction_module, monkeypatch):
+        """extract_stream: 遅いリクエストを待たずに、完了したものから返す"""
+
+        def fake_extract(input, *args, **kwargs):
+            if input == "slow":
+                time.sleep(0.5)
+            return [f"意見:{input}"], 1, 2, 3
+
+        monkeypatch.setattr(extraction_module, "extract_arguments", fake_extract)
+        config = {}
+        inputs = ["slow", "a", "b", "c", "d"]
+
+        results = list(extraction_module.extract_stream(inputs, "prompt", "model", workers=2, config=config))
+
+        assert [index for index, _, _ in results][-1] == 0
+        assert sorted(results) == [(i, [f"意見:{input}"], None) for i, input in enumerate(inputs)]
+        assert config["total_token_usage"] == 15
+        assert config["token_usage_input"] == 5
+        assert config["token_usage_output"] == 10
+
+    def test_timed_out_request_gives_none(self, extraction_module, monkeypatch):
+        """extract_stream: タイムアウトしたリクエストは結果をNoneとし、残りの処理を続ける"""
+
+        def fake_extract(input, *args, **kwargs):
+            if input == "hang":
+                time.sleep(1)
+            return [input], 0, 0, 0
+
+        monkeypatch.setattr(extraction_module, "extract_arguments", fake_extract)
+
+        results = {
+            index: (items, error)
+            for index, items, error in extraction_module.extract_stream(
+                ["hang", "a", "b"], "prompt", "model", workers=2, timeout=0.2
+            )
+        }
+
+        assert results == {0: (None, "timed out after 0.2s"), 1: (["a"], None), 2: (["b"], None)}
+
+    def test_timed_out_request_does_not_block_worker(self, extraction_module, monkeypatch):
+        """extract_stream: タイムアウトしたリクエストが終わるのを待たずに、次のリクエストを送信する"""
+        release = threading.Event()
+
+        def fake_extract(input, *args, **kwargs):
+            if input == "hang":
+                release.wait(timeout=5)
+            return [input], 0, 0, 0
+
+        monkeypatch.setattr(extraction_module, "extract_arguments", fake_extract)
+
+        started_at = time.monotonic()
+        try:
+            results = {
+                index: (items, error)
+                for index, items, error in extraction_module.extract_stream(
+                    ["hang", "a", "b"], "prompt", "model", workers=1, timeout=0.2
+                )
+            }
+            elapsed = time.monotonic() - started_at
+        finally:
+            release.set()
+
+        assert results == {0: (None, "timed out after 0.2s"), 1: (["a"], None), 2: (["b"], None)}
+        assert elapsed < 2
+
+    def test_passes_timeout_to_llm_request(self, extraction_module, monkeypatch):
+        """extract_stream: 再試行のタイムアウトをLLMへのリクエストのタイムアウトとしても渡す"""
+        timeouts = []
+
+        def fake_request(messages, **kwargs):
+            timeouts.append(kwargs["timeout"])
+            return '{"extractedOpinionList": ["意見"]}', 1, 1, 2
+
+        monkeypatch.setattr(extraction_module, "request_to_chat_ai", fake_request)
+
+        results = list(extraction_module.extract_stream(["a", "b"], "prompt", "model", workers=2, timeout=120))
+
+        assert sorted(results) == [(0, ["意見"], None), (1, ["意見"], None)]
+        assert timeouts == [120, 120]
+
+    def test_failed_request_gives_none(self, extraction_module, monkeypatch):
+        """extract_stream: 例外が発生したリクエストは結果をNoneとする"""
+
+        def fake_extract(input, *args, **kwargs):
+            if input == "error":
+                raise RuntimeError("boom")
+            return [input], 0, 0, 0
+
+        monkeypatch.setattr(extraction_module, "extract_arguments", fake_extract)
+
+        results = {
+            index: (items, error)
+            for index, items, error in extraction_module.extract_stream(["error", "a"], "prompt", "model", workers=1)
+        }
+
+        assert results == {0: (None, "RuntimeError: boom"), 1: (["a"], None)}
+
+
+def test_extraction_assigns_arg_ids_in_input_order(extraction_module, monkeypatch, tmp_path):
+    """extraction: 完了順に関わらず、重複する意見には入力順で最初のコメントのarg-idを付ける"""
+
+    def fake_extract(input, *args, **kwargs):
+        if input == "最初のコメント":
+            time.sleep(0.3)
+        return ["共通の意見"], 0, 0, 0
+
+    monkeypatch.setattr(extraction_module, "extract_arguments", fake_extract)
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "inputs").mkdir()
+    (tmp_path / "outputs" / "test").mkdir(parents=True)
+    (tmp_path / "inputs" / "test.csv").write_text(
+        "comment-id,comment-body\n1,最初のコメント\n2,次のコメント\n", encoding="utf-8"
+    )
+    config = {
+        "input": "test",
+        "output_dir": "test",
+        "provider": "openai",
+        "extraction": {
+            "model": "model",
+            "prompt": "prompt",
+            "workers": 2,
+            "limit": 10,
+            "properties": [],
+            "timeout": 30,
+            "retry_timeouts": [],
+            "comments_per_request": 1,
+            "request_max_tokens": 4000,
+            "execution_mode": "realtime",
+        },
+    }
+
+    extraction_module.extraction(config)
+
+    args = (tmp_path / "outputs" / "test" / "args.csv").read_text(encoding="utf-8")
+    relations = (tmp_path / "outputs" / "test" / "relations.csv").read_text(encoding="utf-8")
+    assert args.splitlines() == ["arg-id,argument", "A1_0,共通の意見"]
+    assert relations.splitlines() == ["arg-id,comment-id", "A1_0,1", "A1_0,2"]
+
+
+@pytest.fixture
+def workspace(extraction_module, monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "inputs").mkdir()
+    (tmp_path / "outputs" / "test").mkdir(parents=True)
+    (tmp_path / "inputs" / "test.csv").write_text(
+        "comment-id,comment-body\n1,コメント1\n2,コメント2\n3,コメント3\n", encoding="utf-8"
+    )
+    return tmp_path
+
+
+def make_config(resume=False, retry_timeouts=None, comments_per_request=1, execution_mode="realtime"):
+    return {
+        "input": "test",
+        "output_dir": "test",
+        "provider": "openai",
+        "plan": [{"step": "extraction", "run": True, "reason": "test", "resume": resume}],
+        "extraction": {
+            "model": "model",
+            "prompt": "prompt",
+            "workers": 2,
+            "limit": 10,
+            "properties": [],
+            "timeout": 30,
+            "retry_timeouts": retry_timeouts or [],
+            "comments_per_request": comments_per_request,
+            "request_max_tokens": 4000,
+            "execution_mode": execution_mode,
+        },
+    }
+
+
+class TestCheckpoint:
+    """チェックポイントからの再開のテスト"""
+
+    def test_resumes_from_checkpoint(self, extraction_module, monkeypatch, workspace):
+        """extraction: 保存済みのコメントはリクエストせず、失敗したコメントは次回の再開時に再度リクエストする"""
+        requested = []
+
+        def fake_extract(input, *args, **kwargs):
+            requested.append(input)
+            if input == "コメント3" and len(requested) <= 3:
+                raise RuntimeError("boom")
+            return [f"意見:{input}"], 0, 0, 0
+
+        monkeypatch.setattr(extraction_module, "extract_arguments", fake_extract)
+
+        extraction_module.extraction(make_config(resume=False))
+        assert sorted(requested) == ["コメント1", "コメント2", "コメント3"]
+
+        extraction_module.extraction(make_config(resume=True))
+        assert requested[3:] == ["コメント3"]
+
+        args = (workspace / "outputs" / "test" / "args.csv").read_text(encoding="utf-8")
+        assert args.splitlines() == [
+            "arg-id,argument",
+            "A1_0,意見:コメント1",
+            "A2_0,意見:コメント2",
+            "A3_0,意見:コメント3",
+        ]
+
+    def test_changed_prompt_is_not_reused(self, extraction_module, monkeypatch, workspace):
+        """extraction: プロンプトが変わった場合は保存済みの結果を再利用しない"""
+        requested = []
+
+        def fake_extract(input, *args, **kwargs):
+            requested.append(input)
+            return [input], 0, 0, 0
+
+        monkeypatch.setattr(extraction_module, "extract_arguments", fake_extract)
+        extraction_module.extraction(make_config(resume=False))
+
+        config = make_config(resume=True)
+        config["extraction"]["prompt"] = "new prompt"
+        extraction_module.extraction(config)
+
+        assert len(requested) == 6
+
+    def test_ignores_partial_line(self, extraction_module, tmp_path):
+        """_load_checkpoint: 書き込み途中で中断された末尾の行は無視する"""
+        path = tmp_path / "checkpoint.jsonl"
+        path.write_text(
+            '{"comment-id": "1", "key": "k", "arguments": ["意見"]}\n{"comment-id": "2", "ke', encoding="utf-8"
+        )
+
+        assert extraction_module._load_checkpoint(str(path)) == {"1": {"key": "k", "arguments": ["意見"]}}
+
+
+class TestRetryQueue:
+    """失敗したコメントの再試行のテスト"""
+
+    def test_failed_comments_are_retried_at_end(self, extraction_module, monkeypatch, workspace):
+        """extraction: 失敗したコメントはステップの最後に再試行し、回復した件数を記録する"""
+        failed_once = set()
+
+        def fake_extract(input, *args, **kwargs):
+            if input == "コメント2" and input not in failed_once:
+                failed_once.add(input)
+                raise RuntimeError("boom")
+            return [f"意見:{input}"], 0, 0, 0
+
+        monkeypatch.setattr(extraction_module, "extract_arguments", fake_extract)
+        config = make_config(retry_timeouts=[60])
+
+        extraction_module.extraction(config)
+
+        args = (workspace / "outputs" / "test" / "args.csv").read_text(encoding="utf-8")
+        assert args.splitlines() == [
+            "arg-id,argument",
+            "A1_0,意見:コメント1",
+            "A2_0,意見:コメント2",
+            "A3_0,意見:コメント3",
+        ]
+        assert config["extraction_retry_summary"] == {"retried": 1, "recovered": 1, "failed": 0}
+        assert not (workspace / "outputs" / "test" / "extraction_failed.csv").exists()
+
+    def test_exhausted_comments_go_to_failure_report(self, extraction_module, monkeypatch, workspace):
+        """extraction: 再試行しても失敗したコメントは意見なしとして扱い、一覧をCSVに残す"""
+
+        def fake_extract(input, *args, **kwargs):
+            if input == "コメント2":
+                raise RuntimeError("boom")
+            return [f"意見:{input}"], 0, 0, 0
+
+        monkeypatch.setattr(extraction_module, "extract_arguments", fake_extract)
+        config = make_config(retry_timeouts=[60, 120])
+
+        extraction_module.extraction(config)
+
+        report = (workspace / "outputs" / "test" / "extraction_failed.csv").read_text(encoding="utf-8")
+        assert report.splitlines() == ["comment-id,attempts,error", "2,3,RuntimeError: boom"]
+        assert config["extraction_retry_summary"] == {"retried": 1, "recovered": 0, "failed": 1}
+        relations = (workspace / "outputs" / "test" / "relations.csv").read_text(encoding="utf-8")
+        assert relations.splitlines() == ["arg-id,comment-id", "A1_0,1", "A3_0,3"]
+
+
+class TestBatchedExtraction:
+    """複数コメントをまとめて抽出するモードのテスト"""
+
+    def test_packs_comments_into_one_request(self, extraction_module, monkeypatch, workspace):
+        """extraction: comments_per_requestの件数ずつまとめて1リクエストで抽出する"""
+        requests = []
+
+        def fake_request(messages, **kwargs):
+            comments = json.loads(messages[1]["content"])["comments"]
+            requests.append([c["commentId"] for c in comments])
+            results = [{"commentId": c["commentId"], "extractedOpinionList": [f"意見:{c['text']}"]} for c in comments]
+            return {"results": results}, 10, 5, 15
+
+        monkeypatch.setattr(extraction_module, "request_to_chat_ai", fake_request)
+        config = make_config(comments_per_request=2)
+
+        extraction_module.extraction(config)
+
+        assert sorted(requests) == [["1", "2"], ["3"]]
+        assert config["total_token_usage"] == 30
+        args = (workspace / "outputs" / "test" / "args.csv").read_text(encoding="utf-8")
+        assert args.splitlines() == [
+            "arg-id,argument",
+            "A1_0,意見:コメント1",
+            "A2_0,意見:コメント2",
+            "A3_0,意見:コメント3",
+        ]
+
+    def test_missing_comment_falls_back_to_single_request(self, extraction_module, monkeypatch):
+        """extract_arguments_batch: 結果が欠けたコメントだけ1件ずつ抽出し直す"""
+
+        def fake_request(messages, **kwargs):
+            return '{"results": [{"commentId": "1", "extractedOpinionList": ["意見1", ""]}]}', 10, 5, 15
+
+        def fake_extract(input, *args, **kwargs):
+            return [f"単独:{input}"], 1, 1, 2
+
+        monkeypatch.setattr(extraction_module, "request_to_chat_ai", fake_request)
+        monkeypatch.setattr(extraction_module, "extract_arguments", fake_extract)
+
+        result = extraction_module.extract_arguments_batch([("1", "コメント1"), ("2", "コメント2")], "prompt", "model")
+
+        assert result == ([["意見1"], ["単独:コメント2"]], 11, 6, 17)
+
+    def test_pack_comments_respects_token_budget(self, extraction_module):
+        """_pack_comments: 件数とトークン数の上限を超えないようにまとめる"""
+        inputs = ["a" * 10, "b" * 10, "c" * 30, "d", "e", "f"]
+
+        groups = extraction_module._pack_comments(list(range(6)), inputs, max_comments=2, max_tokens=25)
+
+        assert groups == [[0, 1], [2], [3, 4], [5]]
+
+
+class TestBatchAPIExtraction:
+    """バッチAPIを使う抽出のテスト"""
+
+    @pytest.mark.parametrize("comments_per_request", [1, 2])
+    def test_extracts_via_local_file_backend(self, extraction_module, monkeypatch, workspace, comments_per_request):
+        """extraction: execution_mode=batchではジョブファイルを投入し、結果から同じargs.csvを作成する"""
+        batch_api = importlib.import_module("services.batch_api")
+
+        def fake_request(messages, **kwargs):
+            if kwargs["json_schema"]["json_schema"]["name"] == "BatchExtractionResponse":
+                comments = json.loads(messages[1]["content"])["comments"]
+                results = [
+                    {"commentId": c["commentId"], "extractedOpinionList": [f"意見:{c['text']}"]} for c in comments
+                ]
+                return {"results": results}, 10, 5, 15
+            return {"extractedOpinionList": [f"意見:{messages[1]['content']}"]}, 10, 5, 15
+
+        monkeypatch.setattr(batch_api, "request_to_chat_ai", fake_request)
+        monkeypatch.setattr(
+            extraction_module, "extract_arguments", lambda *args, **kwargs: pytest.fail("realtime API was called")
+        )
+        config = make_config(comments_per_request=comments_per_request, execution_mode="batch")
+        config["batch"] = {"backend": "local_file"}
+
+        extraction_module.extraction(config)
+
+        args = (workspace / "outputs" / "test" / "args.csv").read_text(encoding="utf-8")
+        assert args.splitlines() == [
+            "arg-id,argument",
+            "A1_0,意見:コメント1",
+            "A2_0,意見:コメント2",
+            "A3_0,意見:コメント3",
+        ]
+        assert (workspace / "outputs" / "test" / "batch" / "extraction_input.jsonl").exists()
+        assert config["total_token_usage"] == 15 * (3 if comments_per_request == 1 else 2)
@@ -0,0 +1,167 @@
+import json
+
+import numpy as np
+import orjson
+import pandas as pd
+import pytest
+from steps.hierarchical_aggregation import (
+    _build_arguments,
+    _build_cluster_value,
+    _build_property_map,
+    write_result_json,
+)
+
+
+def test_build_arguments_joins_comment_attributes_and_url():
+    """_build_arguments: 意見ごとに元コメントの属性とURLを付け、コメントがない意見には付けない"""
+    clusters = pd.DataFrame(
+        {
+            "arg-id": ["A1_0", "A1_1", "A2_0", "A9_0"],
+            "argument": ["意見1", "意見2", "意見3", "意見4"],
+            "x": [0.5, 1.0, 1.5, 2.0],
+            "y": [-0.5, -1.0, -1.5, -2.0],
+            "cluster-level-1-id": ["1_0", "1_0", "1_1", "1_1"],
+            "cluster-level-2-id": ["2_0", "2_1", "2_2", "2_3"],
+        }
+    )
+    comments = pd.DataFrame(
+        {
+            "comment-id": [1, 2, 2],
+            "url": ["https://example.com/1", "https://example.com/2", "https://example.com/dup"],
+            "attribute_age": [30, 40, 50],
+            "attribute_score": [0.5, np.nan, 1.0],
+        }
+    )
+    relation_df = pd.DataFrame({"arg-id": ["A1_0", "A1_1", "A2_0", "A9_0"], "comment-id": [1, 1, 2, 9]})
+
+    arguments = _build_arguments(clusters, comments, relation_df, {"enable_source_link": True})
+
+    assert arguments[0] == {
+        "arg_id": "A1_0",
+        "argument": "意見1",
+        "x": 0.5,
+        "y": -0.5,
+        "p": 0,
+        "cluster_ids": ["0", "1_0", "2_0"],
+        "attributes": {"age": 30, "score": 0.5},
+        "url": "https://example.com/1",
+    }
+    # 同じcomment-idが複数ある場合は最初の行を使う
+    assert arguments[2]["attributes"]["age"] == 40
+    assert np.isnan(arguments[2]["attributes"]["score"])
+    assert arguments[2]["url"] == "https://example.com/2"
+    # 対応するコメントがない意見
+    assert arguments[3]["attributes"] is None
+    assert arguments[3]["url"] is None
+    assert all(type(argument["attributes"]["age"]) is int for argument in arguments[:3])
+
+
+def test_build_arguments_without_source_link():
+    """_build_arguments: enable_source_link が無効ならURLを付けない"""
+    clusters = pd.DataFrame(
+        {"arg-id": ["A1_0"], "argument": ["意見1"], "x": [0.0], "y": [0.0], "cluster-level-1-id": ["1_0"]}
+    )
+    comments = pd.DataFrame({"comment-id": [1], "url": ["https://example.com/1"]})
+    relation_df = pd.DataFrame({"arg-id": ["A1_0"], "comment-id": [1]})
+
+    arguments = _build_arguments(clusters, comments, relation_df, {})
+
+    assert arguments[0]["url"] is None
+    assert arguments[0]["attributes"] is None
+
+
+def test_build_arguments_stringifies_missing_values():
+    """_build_arguments: 欠損した意見・クラスタidは以前と同じく "nan" という文字列にする"""
+    clusters = pd.DataFrame(
+        {"arg-id": ["A1_0"], "argument": [np.nan], "x": [0.0], "y": [0.0], "cluster-level-1-id": [np.nan]}
+    )
+    relation_df = pd.DataFrame({"arg-id": ["A1_0"], "comment-id": [1]})
+
+    arguments = _build_arguments(clusters, pd.DataFrame({"comment-id": [1]}), relation_df, {})
+
+    assert arguments[0]["argument"] == "nan"
+    assert arguments[0]["cluster_ids"] == ["0", "nan"]
+
+
+def test_build_property_map_stringifies_values_and_maps_nan_to_none():
+    """_build_property_map: 値は文字列にし、NaNはNoneにする"""
+    arguments = pd.DataFrame(
+        {
+            "arg-id": ["A1_0", "A2_0", "A3_0"],
+            "argument": ["意見1", "意見2", "意見3"],
+            "age": [30, 40, 50],
+            "score": [0.5, np.nan, 1.0],
+            "flag": [True, False, True],
+            "category": ["教育", None, "医療"],
+        }
+    ).set_index("arg-id")
+    config = {"extraction": {"categories": {"category": {}}}}
+
+    property_map = _build_property_map(arguments, pd.DataFrame(), {"age": [], "score": [], "flag": []}, config)
+
+    assert property_map == {
+        "age": {"A1_0": "30", "A2_0": "40", "A3_0": "50"},
+        "score": {"A1_0": "0.5", "A2_0": None, "A3_0": "1.0"},
+        "flag": {"A1_0": "True", "A2_0": "False", "A3_0": "True"},
+        "category": {"A1_0": "教育", "A2_0": None, "A3_0": "医療"},
+    }
+
+
+def test_build_cluster_value():
+    """_build_cluster_value: 全体クラスタに続けて、各クラスタをPythonの型で返す"""
+    melted_labels = pd.DataFrame(
+        {
+            "level": [1, 2],
+            "id": ["1_0", "2_0"],
+            "label": ["ラベル1", "ラベル2"],
+            "description": ["説明1", "説明2"],
+            "value": [10, 4],
+            "parent": ["0", "1_0"],
+            "density_rank_percentile": [0.5, 1.0],
+        }
+    )
+
+    clusters = _build_cluster_value(melted_labels, 10)
+
+    assert clusters[0]["id"] == "0"
+    assert clusters[2] == {
+        "level": 2,
+        "id": "2_0",
+        "label": "ラベル2",
+        "takeaway": "説明2",
+        "value": 4,
+        "parent": "1_0",
+        "density_rank_percentile": 1.0,
+    }
+    assert type(clusters[1]["level"]) is int
+    assert type(clusters[1]["value"]) is int
+
+
+@pytest.mark.parametrize("compact", [False, True])
+def test_write_result_json_matches_whole_serialization(tmp_path, compact):
+    """write_result_json: 分割して書き出しても、結果全体をまとめてシリアライズした場合と同じ内容になる"""
+    results = {
+        "arguments": [
+            {"arg_id": "A1_0", "x": np.float32(0.5), "cluster_ids": ["0", "1_0"], "attributes": {"score": np.nan}},
+            {"arg_id": "A2_0", "x": np.float64(1.5), "cluster_ids": np.array(["0", "1_1"]), "attributes": None},
+        ],
+        "clusters": [{"level": np.int64(1), "id": "1_0", "value": 2}],
+        "comments": {},
+        "propertyMap": {"age": {"A1_0": "30"}},
+        "overview": "概要\n2行目",
+        "config": {"columns": np.arange(6).reshape(2, 3)[:, 1]},
+        "comment_num": 2,
+    }
+    path = tmp_path / "hierarchical_result.json"
+
+    write_result_json(path, results, compact=compact)
+
+    option = orjson.OPT_SERIALIZE_NUMPY if compact else orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_INDENT_2
+    expected = orjson.dumps(json.loads(path.read_text()), option=option)
+    assert path.read_bytes() == expected
+    result = json.loads(path.read_text())
+    assert result["arguments"][0]["attributes"] == {"score": None}
+    assert result["arguments"][1]["cluster_ids"] == ["0", "1_1"]
+    assert result["config"]["columns"] == [1, 4]
+    assert result["overview"] == "概要\n2行目"
+    assert (b"\n" in path.read_bytes()) is not compact
@@ -0,0 +1,275 @@
+import sys
+import types
+
+import joblib
+import numpy as np
+import pandas as pd
+import pytest
+import scipy.cluster.hierarchy as sch
+from steps.hierarchical_clustering import (
+    fit_hierarchy,
+    fit_streaming_kmeans,
+    fit_umap,
+    hierarchical_clustering_embeddings,
+    incremental_clustering,
+    merge_clusters_with_hierarchy,
+    reduce_dimensions,
+    select_cluster_nums,
+)
+
+
+def test_merge_clusters_with_hierarchy_matches_per_sample_mapping():
+    """merge_clusters_with_hierarchy: 各サンプルのKMeansラベルをマージ後のラベルに置き換える"""
+    rng = np.random.default_rng(0)
+    centers = rng.normal(size=(20, 2))
+    kmeans_labels = rng.integers(0, 20, size=1000)
+    linkage_matrix = sch.linkage(centers, method="ward")
+
+    labels = merge_clusters_with_hierarchy(linkage_matrix, kmeans_labels, n_cluster_cut=5)
+
+    merged = sch.fcluster(sch.linkage(centers, method="ward"), t=5, criterion="maxclust")
+    np.testing.assert_array_equal(labels, [merged[label] for label in kmeans_labels])
+
+
+@pytest.mark.parametrize("backend", ["kmeans", "minibatch_kmeans", "streaming"])
+def test_hierarchical_clustering_embeddings_levels_are_nested(backend):
+    """hierarchical_clustering_embeddings: 細かい階層のクラスタは、粗い階層の1つのクラスタに含まれる"""
+    rng = np.random.default_rng(0)
+    umap_embeds = rng.normal(size=(300, 2))
+
+    results = hierarchical_clustering_embeddings(umap_embeds, [3, 6, 12], backend=backend, batch_size=50)
+
+    assert list(results) == [3, 6, 12]
+    assert len(set(results[12])) == 12
+    for coarse, fine in [(3, 6), (6, 12)]:
+        for label in set(results[fine]):
+            assert len(set(results[coarse][results[fine] == label])) == 1
+
+
+def test_streaming_kmeans_is_reproducible():
+    """fit_streaming_kmeans: 同じ入力からは同じラベルを返す"""
+    umap_embeds = np.random.default_rng(0).normal(size=(500, 2))
+
+    labels1, _ = fit_streaming_kmeans(umap_embeds, 10, batch_size=100)
+    labels2, _ = fit_streaming_kmeans(umap_embeds, 10, batch_size=100)
+
+    np.testing.assert_array_equal(labels1, labels2)
+
+
+def test_unknown_backend_raises():
+    """hierarchical_clustering_embeddings: 未知のバックエンドはエラーにする"""
+    with pytest.raises(ValueError):
+        hierarchical_clustering_embeddings(np.zeros((10, 2)), [2, 4], backend="unknown")
+
+
+def test_reduce_dimensions_keeps_most_variance_of_low_rank_embeddings():
+    """reduce_dimensions: 指定した次元数に削減し、低ランクの埋め込みの分散をほぼすべて保持する"""
+    rng = np.random.default_rng(0)
+    embeddings = rng.normal(size=(200, 5)) @ rng.normal(size=(5, 64))
+
+    pca_model, reduced = reduce_dimensions(embeddings, 10)
+
+    assert reduced.shape == (200, 10)
+    assert pca_model.explained_variance_ratio_.sum() > 0.99
+
+
+@pytest.mark.parametrize("pca_components", [None, 0, 64, 100])
+def test_reduce_dimensions_skips_when_not_smaller(pca_components):
+    """reduce_dimensions: 指定がない、または元の次元数以上ならPCAを行わない"""
+    embeddings = np.random.default_rng(0).normal(size=(200, 64))
+
+    pca_model, reduced = reduce_dimensions(embeddings, pca_components)
+
+    assert pca_model is None
+    assert reduced is embeddings
+
+
+def test_select_cluster_nums_finds_blob_structure():
+    """select_cluster_nums: 上位の階層は塊の数を、下位の階層は上位の3倍以上のクラスタ数を選ぶ"""
+    rng = np.random.default_rng(0)
+    blob_centers = np.array([[0, 0], [20, 0], [0, 20], [20, 20]])
+    umap_embeds = np.vstack([center + rng.normal(size=(250, 2)) for center in blob_centers])
+
+    cluster_nums, report = select_cluster_nums(umap_embeds, max_clusters=40, sample_size=500)
+
+    assert cluster_nums[0] == 4
+    assert 12 <= cluster_nums[1] <= 40
+    assert report["sample_size"] == 500
+    assert not report["timed_out"]
+    assert set(report["scores"]) >= {"2", "4", "10"}
+
+
+def test_select_cluster_nums_stops_at_time_budget():
+    """select_cluster_nums: 時間切れでも、それまでに採点した候補から選ぶ"""
+    umap_embeds = np.random.default_rng(0).normal(size=(200, 2))
+
+    cluster_nums, report = select_cluster_nums(umap_embeds, max_clusters=30, time_budget=0)
+
+    assert report["timed_out"]
+    assert cluster_nums == [2, 30]
+
+
+class RecordingUMAP:
+    """コンストラクタの引数を記録するUMAPの代わり"""
+
+    instances = []
+
+    def __init__(self, **kwargs):
+        self.kwargs = kwargs
+        RecordingUMAP.instances.append(self)
+
+    def fit_transform(self, embeddings):
+        return np.asarray(embeddings)[:, :2]
+
+
+@pytest.mark.parametrize(
+    ("reproducible", "n_jobs", "expected"),
+    [
+        (True, 8, {"random_state": 42}),
+        (False, 8, {"n_jobs": 8}),
+        (False, None, {"n_jobs": -1}),
+    ],
+)
+def test_fit_umap_parallel_params(monkeypatch, reproducible, n_jobs, expected):
+    """fit_umap: 再現モードではシードを固定し、高速モードではシードを外して並列にフィットする"""
+    monkeypatch.setitem(sys.modules, "umap", types.SimpleNamespace(UMAP=RecordingUMAP))
+    RecordingUMAP.instances.clear()
+
+    _, umap_embeds = fit_umap(np.zeros((30, 4)), n_jobs=n_jobs, reproducible=reproducible)
+
+    kwargs = RecordingUMAP.instances[0].kwargs
+    assert umap_embeds.shape == (30, 2)
+    assert {key: kwargs[key] for key in ("random_state", "n_jobs") if key in kwargs} == expected
+
+
+class IdentityReducer:
+    """2次元の埋め込みをそのまま返すUMAPの代わり"""
+
+    def transform(self, embeddings):
+        return np.asarray(embeddings, dtype=float)
+
+
+class TestIncrementalClustering:
+    """incremental_clusteringのテスト"""
+
+    @pytest.fixture
+    def fitted(self, tmp_path):
+        rng = np.random.default_rng(0)
+        embeddings = np.vstack([rng.normal(loc, 0.1, size=(20, 2)) for loc in [(0, 0), (5, 5), (10, 0)]])
+        results, centers, linkage_matrix = fit_hierarchy(embeddings, [2, 3])
+        arg_ids = [f"A{i}" for i in range(len(embeddings))]
+        previous_df = pd.DataFrame(
+            {"arg-id": arg_ids, "argument": arg_ids, "x": embeddings[:, 0], "y": embeddings[:, 1]}
+        )
+        for level, labels in enumerate(results.values(), start=1):
+            previous_df[f"cluster-level-{level}-id"] = [f"{level}_{label}" for label in labels]
+        path = tmp_path / "hierarchical_clusters.csv"
+        model_path = tmp_path / "model.joblib"
+        previous_df.to_csv(path, index=False)
+        joblib.dump(
+            {
+                "umap": IdentityReducer(),
+                "cluster_nums": [2, 3],
+                "cluster_centers": centers,
+                "linkage_matrix": linkage_matrix,
+                "embedding_dim": 2,
+                "backend": "kmeans",
+                "reproducible": True,
+                "fit_mean_distance": float(np.linalg.norm(embeddings - centers[results[3]], axis=1).mean()),
+            },
+            model_path,
+        )
+        return embeddings, previous_df, str(path), str(model_path)
+
+    @staticmethod
+    def make_config(cluster_nums=None, pca_components=None, backend="kmeans", reproducible=True):
+        return {
+            "hierarchical_clustering": {
+                "cluster_nums": cluster_nums or [2, 3],
+                "drift_threshold": 1.5,
+                "pca_components": pca_components,
+                "backend": backend,
+                "reproducible": reproducible,
+            }
+        }
+
+    def test_assigns_only_new_arguments(self, fitted):
+        """incremental_clustering: 既存の意見はそのままに、新しい意見を最も近いクラスタに割り当てる"""
+        embeddings, previous_df, path, model_path = fitted
+        new_embedding = np.array([[5.05, 4.95]])
+        arguments_df = pd.DataFrame(
+            {"arg-id": ["NEW", *previous_df["arg-id"]], "argument": ["NEW", *previous_df["arg-id"]]}
+        )
+        config = self.make_config()
+
+        result = incremental_clustering(config, arguments_df, np.vstack([new_embedding, embeddings]), path, model_path)
+
+        assert result["arg-id"].tolist() == arguments_df["arg-id"].tolist()
+        pd.testing.assert_frame_equal(result.iloc[1:].reset_index(drop=True), previous_df)
+        neighbour = previous_df.iloc[25]  # (5, 5) 付近の既存の意見
+        for level in [1, 2]:
+            assert result.iloc[0][f"cluster-level-{level}-id"] == neighbour[f"cluster-level-{level}-id"]
+        assert config["hierarchical_clustering_drift"]["new_arguments"] == 1
+        assert not config["hierarchical_clustering_drift"]["refit_recommended"]
+
+    def test_reassigns_reused_arg_id_with_changed_text(self, fitted):
+        """incremental_clustering: 抽出し直して同じarg-idが別の意見になった場合は、今回の本文で割り当て直す"""
+        embeddings, previous_df, path, model_path = fitted
+        arguments_df = previous_df[["arg-id", "argument"]].copy()
+        arguments_df.loc[0, "argument"] = "抽出し直した意見"
+        moved_embeddings = embeddings.copy()
+        moved_embeddings[0] = [10.05, 0.05]  # (10, 0) 付近へ
+        config = self.make_config()
+
+        result = incremental_clustering(config, arguments_df, moved_embeddings, path, model_path)
+
+        assert result["argument"].tolist() == arguments_df["argument"].tolist()
+        assert result.loc[0, ["x", "y"]].tolist() == [10.05, 0.05]
+        neighbour = previous_df.iloc[45]  # (10, 0) 付近の既存の意見
+        for level in [1, 2]:
+            assert result.loc[0, f"cluster-level-{level}-id"] == neighbour[f"cluster-level-{level}-id"]
+        pd.testing.assert_frame_equal(
+            result.iloc[1:].reset_index(drop=True), previous_df.iloc[1:].reset_index(drop=True)
+        )
+        assert config["hierarchical_clustering_drift"]["new_arguments"] == 1
+        assert config["hierarchical_clustering_drift"]["changed_arguments"] == 1
+
+    def test_recommends_refit_on_drift(self, fitted):
+        """incremental_clustering: 既存のクラスタから遠い意見が増えたら再フィットを推奨する"""
+        embeddings, previous_df, path, model_path = fitted
+        arguments_df = pd.DataFrame(
+            {"arg-id": [*previous_df["arg-id"], "FAR"], "argument": [*previous_df["arg-id"], "FAR"]}
+        )
+        config = self.make_config()
+
+        incremental_clustering(config, arguments_df, np.vstack([embeddings, [[50.0, 50.0]]]), path, model_path)
+
+        assert config["hierarchical_clustering_drift"]["refit_recommended"]
+
+    def test_returns_none_when_cluster_nums_changed(self, fitted):
+        """incremental_clustering: クラスタ数の設定が変わった場合は全体を再フィットさせる"""
+        embeddings, previous_df, path, model_path = fitted
+        arguments_df = previous_df[["arg-id", "argument"]]
+
+        assert incremental_clustering(self.make_config([2, 4]), arguments_df, embeddings, path, model_path) is None
+
+    def test_returns_none_when_pca_components_changed(self, fitted):
+        """incremental_clustering: PCAの次元数の設定が変わった場合は全体を再フィットさせる"""
+        embeddings, previous_df, path, model_path = fitted
+        arguments_df = previous_df[["arg-id", "argument"]]
+        embeddings = np.hstack([embeddings, np.zeros((len(embeddings), 2))])
+        model = joblib.load(model_path)
+        model["embedding_dim"] = 4
+        joblib.dump(model, model_path)
+
+        config = self.make_config(pca_components=2)
+
+        assert incremental_clustering(config, arguments_df, embeddings, path, model_path) is None
+
+    @pytest.mark.parametrize("changed", [{"backend": "minibatch_kmeans"}, {"reproducible": False}])
+    def test_returns_none_when_fit_settings_changed(self, fitted, changed):
+        """incremental_clustering: バックエンドや再現性の設定が変わった場合は全体を再フィットさせる"""
+        embeddings, previous_df, path, model_path = fitted
+        arguments_df = previous_df[["arg-id", "argument"]]
+
+        assert incremental_clustering(self.make_config(**changed), arguments_df, embeddings, path, model_path) is None
@@ -0,0 +1,143 @@
+import importlib
+
+import numpy as np
+import pandas as pd
+import pytest
+
+
+@pytest.fixture
+def batch_workspace(monkeypatch, tmp_path):
+    batch_api = importlib.import_module("services.batch_api")
+    requested = []
+
+    def fake_request(messages, **kwargs):
+        requested.append(messages)
+        return {"label": f"ラベル{len(requested)}", "description": "説明"}, 10, 5, 15
+
+    monkeypatch.setattr(batch_api, "request_to_chat_ai", fake_request)
+    monkeypatch.chdir(tmp_path)
+    return requested
+
+
+def test_initial_labelling_with_batch_api(batch_workspace):
+    """initial_labelling: execution_mode=batchでは全クラスタを1つのバッチで実行する"""
+    initial_labelling = importlib.import_module("steps.hierarchical_initial_labelling")
+    clusters_df = pd.DataFrame(
+        {
+            "arg-id": ["A1", "A2", "A3"],
+            "argument": ["意見1", "意見2", "意見3"],
+            "cluster-level-1-id": ["1_0", "1_0", "1_1"],
+        }
+    )
+    config = {
+        "output_dir": "test",
+        "provider": "openai",
+        "batch": {"backend": "local_file"},
+        "hierarchical_initial_labelling": {"execution_mode": "batch"},
+    }
+
+    result = initial_labelling.initial_labelling("prompt", clusters_df, 3, "model", 1, config=config)
+
+    assert result["cluster_id"].tolist() == ["1_0", "1_1"]
+    assert result["label"].tolist() == ["ラベル1", "ラベル2"]
+    assert config["total_token_usage"] == 30
+
+
+def test_merge_labelling_with_batch_api(batch_workspace):
+    """merge_labelling: execution_mode=batchでは子クラスタが1つのクラスタを除いてバッチで実行する"""
+    merge_labelling = importlib.import_module("steps.hierarchical_merge_labelling")
+    clusters_df = pd.DataFrame(
+        {
+            "arg-id": ["A1", "A2", "A3"],
+            "argument": ["意見1", "意見2", "意見3"],
+            "cluster-level-1-id": ["1_0", "1_0", "1_1"],
+            "cluster-level-2-id": ["2_0", "2_1", "2_2"],
+            "cluster-level-2-label": ["子1", "子2", "子3"],
+            "cluster-level-2-description": ["説明1", "説明2", "説明3"],
+        }
+    )
+    config = {
+        "output_dir": "test",
+        "provider": "openai",
+        "batch": {"backend": "local_file"},
+        "hierarchical_merge_labelling": {
+            "execution_mode": "batch",
+            "sampling_num": 3,
+            "prompt": "prompt",
+            "model": "model",
+            "workers": 1,
+        },
+    }
+
+    result = merge_labelling.merge_labelling(clusters_df, ["cluster-level-2-id", "cluster-level-1-id"], config)
+
+    assert len(batch_workspace) == 1
+    labels = result.drop_duplicates("cluster-level-1-id").set_index("cluster-level-1-id")["cluster-level-1-label"]
+    assert labels.to_dict() == {"1_0": "ラベル1", "1_1": "子3"}
+
+
+def test_merge_labelling_builds_sampler_once(monkeypatch):
+    """merge_labelling: 階層の数によらず、サンプラー（埋め込みの読み込み）は1回だけ作る"""
+    merge_labelling = importlib.import_module("steps.hierarchical_merge_labelling")
+    clusters_df = pd.DataFrame(
+        {
+            "arg-id": ["A1", "A2", "A3", "A4"],
+            "argument": ["意見1", "意見2", "意見3", "意見4"],
+            "cluster-level-1-id": ["1_0", "1_0", "1_0", "1_1"],
+            "cluster-level-2-id": ["2_0", "2_0", "2_1", "2_2"],
+            "cluster-level-3-id": ["3_0", "3_1", "3_2", "3_3"],
+            "cluster-level-3-label": ["子1", "子2", "子3", "子4"],
+            "cluster-level-3-description": ["説明1", "説明2", "説明3", "説明4"],
+        }
+    )
+    config = {
+        "output_dir": "test",
+        "provider": "openai",
+        "hierarchical_merge_labelling": {"sampling_num": 3, "prompt": "prompt", "model": "model", "workers": 1},
+    }
+    from_config_calls = []
+    from_config = merge_labelling.ArgumentSampler.from_config
+
+    def spy_from_config(*args, **kwargs):
+        from_config_calls.append(args)
+        return from_config(*args, **kwargs)
+
+    monkeypatch.setattr(merge_labelling.ArgumentSampler, "from_config", spy_from_config)
+    monkeypatch.setattr(
+        merge_labelling,
+        "request_to_chat_ai",
+        lambda messages, **kwargs: ({"label": "ラベル", "description": "説明"}, 1, 1, 2),
+    )
+
+    result = merge_labelling.merge_labelling(
+        clusters_df, ["cluster-level-3-id", "cluster-level-2-id", "cluster-level-1-id"], config
+    )
+
+    assert len(from_config_calls) == 1
+    assert result["cluster-level-1-label"].tolist() == ["ラベル", "ラベル", "ラベル", "子4"]
+
+
+def test_calculate_cluster_density_matches_per_cluster_density():
+    """calculate_cluster_density: 各クラスタの点だけで calculate_density を計算した結果と一致する"""
+    merge_labelling = importlib.import_module("steps.hierarchical_merge_labelling")
+    rng = np.random.default_rng(0)
+    n_samples = 500
+    fine_labels = rng.integers(0, 12, size=n_samples)
+    clusters_df = pd.DataFrame(
+        {
+            "x": rng.normal(size=n_samples),
+            "y": rng.normal(size=n_samples),
+            "cluster-level-1-id": [f"1_{label % 3}" for label in fine_labels],
+            "cluster-level-2-id": [f"2_{label}" for label in fine_labels],
+        }
+    )
+    melted_df = pd.DataFrame(
+        [{"level": 1, "id": f"1_{i}"} for i in range(3)] + [{"level": 2, "id": f"2_{i}"} for i in range(12)]
+    )
+
+    result = merge_labelling.calculate_cluster_density(melted_df, clusters_df)
+
+    for _, row in result.iterrows():
+        members = clusters_df[clusters_df[f"cluster-level-{row['level']}-id"] == row["id"]][["x", "y"]].values
+        assert row["density"] == pytest.approx(merge_labelling.calculate_density(members))
+    assert sorted(result.loc[result["level"] == 2, "density_rank"]) == list(range(1, 13))
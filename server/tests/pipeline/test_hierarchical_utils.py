@@ -0,0 +1,140 @@
+import hierarchical_utils
+
+
+def test_decide_what_to_run_resumes_extraction_from_checkpoint(monkeypatch, tmp_path):
+    """decide_what_to_run: 抽出のチェックポイントがあれば、強制実行でない限り再開する"""
+    monkeypatch.setattr(hierarchical_utils, "PIPELINE_DIR", tmp_path)
+    (tmp_path / "outputs" / "test").mkdir(parents=True)
+    (tmp_path / "outputs" / "test" / "extraction_checkpoint.jsonl").write_text("", encoding="utf-8")
+    config = {"output_dir": "test", "without-html": True}
+
+    plan = hierarchical_utils.decide_what_to_run(config, previous=False)
+    extraction_plan = [x for x in plan if x["step"] == "extraction"][0]
+    assert extraction_plan["run"]
+    assert extraction_plan["resume"]
+
+    plan = hierarchical_utils.decide_what_to_run({**config, "force": True}, previous=False)
+    assert "resume" not in [x for x in plan if x["step"] == "extraction"][0]
+
+
+def test_decide_what_to_run_accepts_parquet_artifacts(monkeypatch, tmp_path):
+    """decide_what_to_run: 中間ファイルがParquetで保存されていても前回の結果として扱う"""
+    monkeypatch.setattr(hierarchical_utils, "PIPELINE_DIR", tmp_path)
+    (tmp_path / "outputs" / "test").mkdir(parents=True)
+    (tmp_path / "outputs" / "test" / "args.parquet").write_bytes(b"")
+    extraction_params = {"limit": 1000}
+    config = {
+        "output_dir": "test",
+        "extraction": extraction_params,
+        "previous": {"completed_jobs": [{"step": "extraction", "params": extraction_params}]},
+    }
+
+    plan = hierarchical_utils.decide_what_to_run(config, previous=False)
+
+    assert [x for x in plan if x["step"] == "extraction"][0]["reason"] == "nothing changed"
+
+
+def test_decide_what_to_run_accepts_legacy_embeddings(monkeypatch, tmp_path):
+    """decide_what_to_run: 旧形式の embeddings.pkl しかない出力も前回の埋め込みとして扱う"""
+    monkeypatch.setattr(hierarchical_utils, "PIPELINE_DIR", tmp_path)
+    embedding_spec = [x for x in hierarchical_utils.specs if x["step"] == "embedding"]
+    monkeypatch.setattr(hierarchical_utils, "specs", embedding_spec)
+    (tmp_path / "outputs" / "test").mkdir(parents=True)
+    (tmp_path / "outputs" / "test" / "embeddings.pkl").write_bytes(b"")
+    embedding_params = {"model": "text-embedding-3-small"}
+    config = {
+        "output_dir": "test",
+        "embedding": embedding_params,
+        "previous": {"completed_jobs": [{"step": "embedding", "params": embedding_params}]},
+    }
+
+    plan = hierarchical_utils.decide_what_to_run(config, previous=False)
+
+    assert not plan[0]["run"]
+    assert plan[0]["reason"] == "nothing changed"
+
+
+def test_decide_what_to_run_refits_when_reproducible_changes(monkeypatch, tmp_path):
+    """decide_what_to_run: reproducible を切り替えたらクラスタリングをやり直す"""
+    monkeypatch.setattr(hierarchical_utils, "PIPELINE_DIR", tmp_path)
+    clustering_spec = [x for x in hierarchical_utils.specs if x["step"] == "hierarchical_clustering"]
+    monkeypatch.setattr(hierarchical_utils, "specs", clustering_spec)
+    (tmp_path / "outputs" / "test").mkdir(parents=True)
+    (tmp_path / "outputs" / "test" / "hierarchical_clusters.csv").write_text("")
+    previous_params = {"cluster_nums": [3, 6], "backend": "kmeans", "pca_components": None, "reproducible": False}
+    config = {
+        "output_dir": "test",
+        "hierarchical_clustering": {**previous_params, "reproducible": True},
+        "previous": {"completed_jobs": [{"step": "hierarchical_clustering", "params": previous_params}]},
+    }
+
+    plan = hierarchical_utils.decide_what_to_run(config, previous=False)
+
+    assert plan[0]["run"]
+    assert plan[0]["reason"] == "some parameters changed: reproducible"
+
+
+def test_decide_what_to_run_treats_missing_previous_params_as_defaults(monkeypatch, tmp_path):
+    """decide_what_to_run: 前回の実行に値がないパラメータは、デフォルト値で実行したものとみなす"""
+    monkeypatch.setattr(hierarchical_utils, "PIPELINE_DIR", tmp_path)
+    clustering_spec = [x for x in hierarchical_utils.specs if x["step"] == "hierarchical_clustering"]
+    monkeypatch.setattr(hierarchical_utils, "specs", clustering_spec)
+    (tmp_path / "outputs" / "test").mkdir(parents=True)
+    (tmp_path / "outputs" / "test" / "hierarchical_clusters.csv").write_text("")
+    previous_params = {"cluster_nums": [3, 6]}
+    config = {
+        "output_dir": "test",
+        "hierarchical_clustering": {**clustering_spec[0]["options"], "cluster_nums": [3, 6]},
+        "previous": {"completed_jobs": [{"step": "hierarchical_clustering", "params": previous_params}]},
+    }
+
+    plan = hierarchical_utils.decide_what_to_run(config, previous=False)
+    assert plan[0]["reason"] == "nothing changed"
+
+    config["hierarchical_clustering"]["batch_size"] = 5000
+    plan = hierarchical_utils.decide_what_to_run(config, previous=False)
+    assert plan[0]["reason"] == "some parameters changed: batch_size"
+
+
+def test_decide_what_to_run_keeps_labels_from_runs_before_sampling_options(monkeypatch, tmp_path):
+    """decide_what_to_run: sampling_strategy・sampling_seed を追加する前のラベリング結果は、デフォルト値のまま再利用する"""
+    monkeypatch.setattr(hierarchical_utils, "PIPELINE_DIR", tmp_path)
+    labelling_spec = [x for x in hierarchical_utils.specs if x["step"] == "hierarchical_initial_labelling"]
+    monkeypatch.setattr(hierarchical_utils, "specs", labelling_spec)
+    (tmp_path / "outputs" / "test").mkdir(parents=True)
+    (tmp_path / "outputs" / "test" / "hierarchical_initial_labels.csv").write_text("")
+    previous_params = {"sampling_num": 3, "prompt": "prompt", "model": "gpt-4o-mini"}
+    config = {
+        "output_dir": "test",
+        "hierarchical_initial_labelling": {**labelling_spec[0]["options"], **previous_params},
+        "previous": {"completed_jobs": [{"step": "hierarchical_initial_labelling", "params": previous_params}]},
+    }
+
+    plan = hierarchical_utils.decide_what_to_run(config, previous=False)
+    assert plan[0]["reason"] == "nothing changed"
+
+    config["hierarchical_initial_labelling"]["sampling_strategy"] = "mmr"
+    plan = hierarchical_utils.decide_what_to_run(config, previous=False)
+    assert plan[0]["reason"] == "some parameters changed: sampling_strategy"
+
+
+def test_decide_what_to_run_keeps_result_from_runs_before_compact_json(monkeypatch, tmp_path):
+    """decide_what_to_run: compact_json を追加する前の集約結果は、デフォルト値（インデントあり）のまま再利用する"""
+    monkeypatch.setattr(hierarchical_utils, "PIPELINE_DIR", tmp_path)
+    aggregation_spec = [x for x in hierarchical_utils.specs if x["step"] == "hierarchical_aggregation"]
+    monkeypatch.setattr(hierarchical_utils, "specs", aggregation_spec)
+    (tmp_path / "outputs" / "test").mkdir(parents=True)
+    (tmp_path / "outputs" / "test" / "hierarchical_result.json").write_text("{}")
+    previous_params = {"sampling_num": 5000, "hidden_properties": {}}
+    config = {
+        "output_dir": "test",
+        "hierarchical_aggregation": {**aggregation_spec[0]["options"], **previous_params},
+        "previous": {"completed_jobs": [{"step": "hierarchical_aggregation", "params": previous_params}]},
+    }
+
+    plan = hierarchical_utils.decide_what_to_run(config, previous=False)
+    assert plan[0]["reason"] == "nothing changed"
+
+    config["hierarchical_aggregation"]["compact_json"] = True
+    plan = hierarchical_utils.decide_what_to_run(config, previous=False)
+    assert plan[0]["reason"] == "some parameters changed: compact_json"
@@ -0,0 +1,61 @@
+import numpy as np
+import pandas as pd
+import pytest
+from hierarchy import ROOT_CLUSTER_ID, ClusterHierarchy, cluster_members
+
+ID_COLUMNS = ["cluster-level-1-id", "cluster-level-2-id", "cluster-level-3-id"]
+
+
+@pytest.fixture
+def clusters_df():
+    rng = np.random.default_rng(0)
+    fine_labels = rng.permutation(np.repeat(np.arange(24), 5))
+    return pd.DataFrame(
+        {
+            "cluster-level-1-id": [f"1_{label // 6}" for label in fine_labels],
+            "cluster-level-2-id": [f"2_{label // 3}" for label in fine_labels],
+            "cluster-level-3-id": [f"3_{label}" for label in fine_labels],
+        }
+    )
+
+
+def build_parent_child_rows(df: pd.DataFrame) -> list[dict]:
+    """クラスタごとにDataFrameを絞り込んで親子関係を作る、素朴な実装"""
+    rows = [{"level": 1, "id": c, "parent": "0"} for c in df[ID_COLUMNS[0]].unique()]
+    for level, (current_column, children_column) in enumerate(
+        zip(ID_COLUMNS[:-1], ID_COLUMNS[1:], strict=False), start=2
+    ):
+        for current_id in df[current_column].unique():
+            for child_id in df.loc[df[current_column] == current_id, children_column].unique():
+                rows.append({"level": level, "id": child_id, "parent": current_id})
+    return rows
+
+
+class TestClusterHierarchy:
+    """ClusterHierarchyのテスト"""
+
+    def test_to_frame_matches_per_cluster_filtering(self, clusters_df):
+        """to_frame: クラスタごとに絞り込んだ場合と同じ親子関係を同じ順序で返す"""
+        hierarchy = ClusterHierarchy.from_clusters(clusters_df, list(reversed(ID_COLUMNS)))
+
+        assert hierarchy.to_frame().to_dict("records") == build_parent_child_rows(clusters_df)
+
+    def test_children_and_parents(self, clusters_df):
+        """from_clusters: 各クラスタの子クラスタと親クラスタを返す"""
+        hierarchy = ClusterHierarchy.from_clusters(clusters_df, ID_COLUMNS)
+
+        assert set(hierarchy.children[ROOT_CLUSTER_ID]) == {"1_0", "1_1", "1_2", "1_3"}
+        assert sorted(hierarchy.children["2_0"]) == ["3_0", "3_1", "3_2"]
+        assert hierarchy.parents["3_23"] == "2_7"
+        assert sorted(hierarchy.levels) == [1, 2, 3]
+        assert len(hierarchy.levels[3]) == 24
+
+
+def test_cluster_members_matches_filtering(clusters_df):
+    """cluster_members: 各クラスタに属する行の位置を、クラスタごとに絞り込んだ場合と同じく返す"""
+    members = cluster_members(clusters_df, "cluster-level-2-id")
+
+    assert set(members) == set(clusters_df["cluster-level-2-id"])
+    for cluster_id, rows in members.items():
+        expected = np.flatnonzero(clusters_df["cluster-level-2-id"] == cluster_id)
+        np.testing.assert_array_equal(rows, expected)
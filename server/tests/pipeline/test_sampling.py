@@ -0,0 +1,64 @@
+import numpy as np
+import pandas as pd
+import pytest
+from artifacts import save_embeddings
+from sampling import ArgumentSampler, sample_centroid, sample_mmr
+
+
+def test_sample_centroid_picks_nearest_to_centroid():
+    """sample_centroid: 重心に近い順に選ぶ"""
+    rows = np.arange(10, 15)
+    embeddings = np.array([[5.0, 0.0], [0.1, 0.0], [-3.0, 0.0], [0.0, -0.2], [-2.0, 0.0]])
+
+    selected = sample_centroid(rows, 2, embeddings, np.random.default_rng(0))
+
+    np.testing.assert_array_equal(selected, [11, 13])
+
+
+def test_sample_mmr_avoids_near_duplicates():
+    """sample_mmr: ほぼ同じ意見を重ねて選ばない"""
+    rows = np.arange(4)
+    embeddings = np.array([[1.0, 0.1], [1.0, 0.1001], [1.0, 0.1002], [0.3, 1.0]])
+
+    selected = sample_mmr(rows, 2, embeddings, np.random.default_rng(0))
+
+    assert 3 in selected
+    assert len(set(selected.tolist()) & {0, 1, 2}) == 1
+
+
+class TestArgumentSampler:
+    """ArgumentSamplerのテスト"""
+
+    def test_random_is_reproducible_per_cluster(self):
+        """sample: 同じシードとクラスタidからは常に同じ行を選び、クラスタごとに乱数が異なる"""
+        rows = np.arange(100)
+        sampler = ArgumentSampler("random", seed=42)
+
+        first = sampler.sample("1_0", rows, 5)
+
+        np.testing.assert_array_equal(first, ArgumentSampler("random", seed=42).sample("1_0", rows, 5))
+        assert not np.array_equal(first, sampler.sample("1_1", rows, 5))
+        assert not np.array_equal(first, ArgumentSampler("random", seed=0).sample("1_0", rows, 5))
+
+    def test_returns_all_rows_when_cluster_is_small(self):
+        """sample: クラスタの件数がsampling_num以下なら全件を返す"""
+        rows = np.array([3, 7])
+
+        np.testing.assert_array_equal(ArgumentSampler().sample("1_0", rows, 5), rows)
+
+    def test_from_config_aligns_embeddings_by_arg_id(self, monkeypatch, tmp_path):
+        """from_config: 埋め込みを arg-id で各行に対応付ける"""
+        monkeypatch.chdir(tmp_path)
+        (tmp_path / "outputs" / "test").mkdir(parents=True)
+        save_embeddings(str(tmp_path / "outputs" / "test"), ["A2", "A1", "A3"], np.array([[9.0], [0.0], [1.0]]))
+        clusters_df = pd.DataFrame({"arg-id": ["A1", "A2", "A3"]})
+
+        sampler = ArgumentSampler.from_config({"sampling_strategy": "centroid"}, clusters_df, "test")
+
+        # 重心は 10/3 で、A3（1.0）が最も近い
+        np.testing.assert_array_equal(sampler.sample("1_0", np.arange(3), 1), [2])
+
+    def test_unknown_strategy_raises(self):
+        """ArgumentSampler: 未知の戦略はエラーにする"""
+        with pytest.raises(ValueError):
+            ArgumentSampler("unknown")
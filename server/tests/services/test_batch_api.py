@@ -0,0 +1,136 @@
+import json
+from unittest.mock import patch
+
+import pytest
+from pydantic import BaseModel, Field
+
+from broadlistening.pipeline.services.batch_api import (
+    BATCH_COMPLETED,
+    BATCH_FAILED,
+    BatchBackend,
+    BatchRequest,
+    LocalFileBatchBackend,
+    create_batch_backend,
+    register_batch_backend,
+    run_batch,
+)
+
+
+class DummySchema(BaseModel):
+    label: str = Field(..., description="ラベル")
+
+
+MESSAGES = [{"role": "user", "content": "こんにちは"}]
+
+
+class RecordingBackend(BatchBackend):
+    """投入回数を記録し、固定の結果ファイルを返すテスト用バックエンド"""
+
+    def __init__(self, output_lines, statuses=None, **kwargs):
+        self.output_lines = output_lines
+        self.statuses = list(statuses or [BATCH_COMPLETED])
+        self.submitted = []
+
+    def submit(self, input_path):
+        self.submitted.append(input_path)
+        return f"batch-{len(self.submitted)}"
+
+    def poll(self, batch_id):
+        return self.statuses.pop(0) if len(self.statuses) > 1 else self.statuses[0]
+
+    def download(self, batch_id, output_path):
+        with open(output_path, "w", encoding="utf-8") as f:
+            for line in self.output_lines:
+                f.write(json.dumps(line, ensure_ascii=False) + "\n")
+
+
+def success_line(custom_id, content):
+    return {
+        "custom_id": custom_id,
+        "response": {
+            "status_code": 200,
+            "body": {
+                "choices": [{"message": {"content": content}}],
+                "usage": {"prompt_tokens": 3, "completion_tokens": 2, "total_tokens": 5},
+            },
+        },
+        "error": None,
+    }
+
+
+def test_to_job_line_uses_openai_batch_format():
+    """BatchRequest.to_job_line: OpenAI Batch APIの形式で、Pydanticスキーマはresponse_formatに変換する"""
+    line = BatchRequest(custom_id="1", messages=MESSAGES, model="gpt-4o-mini", json_schema=DummySchema).to_job_line()
+
+    assert line["custom_id"] == "1"
+    assert line["url"] == "/v1/chat/completions"
+    assert line["body"]["temperature"] == 0
+    assert line["body"]["response_format"]["type"] == "json_schema"
+    assert line["body"]["response_format"]["json_schema"]["name"] == "DummySchema"
+    assert line["body"]["response_format"]["json_schema"]["strict"] is True
+    schema = line["body"]["response_format"]["json_schema"]["schema"]
+    assert schema["required"] == ["label"]
+    assert schema["additionalProperties"] is False
+
+
+class TestRunBatch:
+    """run_batchのテスト"""
+
+    def test_returns_results_by_custom_id(self, tmp_path):
+        """run_batch: custom_idごとの結果を返し、失敗したリクエストはNoneになる"""
+        backend = RecordingBackend(
+            [success_line("a", "応答"), {"custom_id": "b", "response": None, "error": {"message": "boom"}}]
+        )
+        requests = [BatchRequest(custom_id=c, messages=MESSAGES, model="gpt-4o-mini") for c in ["a", "b"]]
+
+        results = run_batch(requests, str(tmp_path), "job", backend, poll_interval=0)
+
+        assert results == {"a": ("応答", 3, 2, 5), "b": None}
+
+    def test_resumes_submitted_batch(self, tmp_path):
+        """run_batch: 同じ内容のジョブは再投入せず、前回投入したバッチの完了を待つ"""
+        backend = RecordingBackend([success_line("a", "応答")])
+        requests = [BatchRequest(custom_id="a", messages=MESSAGES, model="gpt-4o-mini")]
+        (tmp_path / "job_state.json").write_text(
+            json.dumps({"batch_id": "previous", "job_hash": "other"}), encoding="utf-8"
+        )
+
+        run_batch(requests, str(tmp_path), "job", backend, poll_interval=0)
+        run_batch(requests, str(tmp_path), "job", backend, poll_interval=0)
+
+        assert len(backend.submitted) == 1
+
+    def test_waits_until_completed(self, tmp_path):
+        """run_batch: 完了するまでon_waitを呼びながら待ち、失敗したバッチは例外にする"""
+        backend = RecordingBackend([success_line("a", "応答")], statuses=["in_progress", "in_progress", BATCH_FAILED])
+        requests = [BatchRequest(custom_id="a", messages=MESSAGES, model="gpt-4o-mini")]
+        waits = []
+
+        with pytest.raises(RuntimeError):
+            run_batch(requests, str(tmp_path), "job", backend, poll_interval=0, on_wait=lambda: waits.append(1))
+
+        assert len(waits) == 2
+        assert not (tmp_path / "job_state.json").exists()
+
+
+def test_local_file_backend_runs_requests(tmp_path):
+    """LocalFileBatchBackend: 各リクエストを request_to_chat_ai で実行し、Batch APIと同じ形式で結果を返す"""
+    requests = [BatchRequest(custom_id="a", messages=MESSAGES, model="gpt-4o-mini", json_schema=DummySchema)]
+
+    with patch(
+        "broadlistening.pipeline.services.batch_api.request_to_chat_ai",
+        return_value=({"label": "ラベル"}, 10, 5, 15),
+    ) as mock_request:
+        results = run_batch(requests, str(tmp_path), "job", LocalFileBatchBackend(), poll_interval=0)
+
+    assert results == {"a": ('{"label": "ラベル"}', 10, 5, 15)}
+    assert mock_request.call_args.kwargs["json_schema"]["type"] == "json_schema"
+
+
+def test_create_batch_backend_uses_registered_backend():
+    """create_batch_backend: 設定の batch.backend に対応するバックエンドを作成する"""
+    register_batch_backend("recording", lambda **kwargs: RecordingBackend([], **kwargs))
+
+    assert isinstance(create_batch_backend({"provider": "openai", "batch": {"backend": "recording"}}), RecordingBackend)
+    with pytest.raises(ValueError):
+        create_batch_backend({"provider": "openai", "batch": {"backend": "unknown"}})
@@ -0,0 +1,86 @@
+import os
+
+import numpy as np
+
+from broadlistening.pipeline.services import embedding_cache
+from broadlistening.pipeline.services.embedding_cache import EmbeddingCache
+
+
+class TestEmbeddingCache:
+    """EmbeddingCacheのテスト"""
+
+    def test_add_and_get(self, tmp_path):
+        """get_many: 保存済みのテキストはベクトルを、未知のテキストはNoneを返す"""
+        cache = EmbeddingCache(str(tmp_path))
+        cache.add_many(["意見1", "意見2"], [[0.1, 0.2, 0.3], [0.4, 0.5, 0.6]])
+
+        result = cache.get_many(["意見2", "未知の意見", "意見1"])
+
+        np.testing.assert_allclose(result[0], [0.4, 0.5, 0.6], rtol=1e-6)
+        assert result[1] is None
+        np.testing.assert_allclose(result[2], [0.1, 0.2, 0.3], rtol=1e-6)
+        assert len(cache) == 2
+
+    def test_persists_across_instances(self, tmp_path):
+        """get_many: 別インスタンス（再実行）からも読み出せる"""
+        EmbeddingCache(str(tmp_path)).add_many(["意見1"], [[1.0, 2.0]])
+
+        result = EmbeddingCache(str(tmp_path)).get_many(["意見1"])
+
+        assert result[0].dtype == np.float32
+        np.testing.assert_array_equal(result[0], [1.0, 2.0])
+
+    def test_discards_partial_record(self, tmp_path):
+        """_load: 書き込み途中で中断された末尾のレコードは捨てて、続きから追記できる"""
+        cache = EmbeddingCache(str(tmp_path))
+        cache.add_many(["意見1"], [[1.0, 2.0]])
+        with open(cache.vectors_path, "ab") as f:
+            f.write(b"broken")
+
+        reopened = EmbeddingCache(str(tmp_path))
+        reopened.add_many(["意見2"], [[3.0, 4.0]])
+
+        result = EmbeddingCache(str(tmp_path)).get_many(["意見1", "意見2"])
+        np.testing.assert_array_equal(result[0], [1.0, 2.0])
+        np.testing.assert_array_equal(result[1], [3.0, 4.0])
+
+    def test_add_many_indexes_only_appended_records(self, tmp_path, monkeypatch):
+        """add_many: 既存のキャッシュを読み直さず、追記したレコード（他インスタンスの追記を含む）だけを索引に加える"""
+        cache = EmbeddingCache(str(tmp_path))
+        cache.add_many(["意見1"], [[1.0, 2.0]])
+        EmbeddingCache(str(tmp_path)).add_many(["別プロセスの意見"], [[5.0, 6.0]])
+
+        def fail_load():
+            raise AssertionError("_load should not be called on append")
+
+        monkeypatch.setattr(cache, "_load", fail_load)
+        cache.add_many(["意見2", "意見3"], [[3.0, 4.0], [7.0, 8.0]])
+
+        result = cache.get_many(["意見1", "別プロセスの意見", "意見2", "意見3"])
+        np.testing.assert_array_equal(np.vstack(result), [[1.0, 2.0], [5.0, 6.0], [3.0, 4.0], [7.0, 8.0]])
+        assert len(cache) == 4
+
+    def test_skips_dimension_mismatch(self, tmp_path):
+        """add_many: 次元数が異なるベクトルは保存しない"""
+        cache = EmbeddingCache(str(tmp_path))
+        cache.add_many(["意見1"], [[1.0, 2.0]])
+        cache.add_many(["意見2"], [[1.0, 2.0, 3.0]])
+
+        assert cache.get_many(["意見2"]) == [None]
+
+
+def test_get_embedding_cache_is_separated_by_provider_and_model(tmp_path):
+    """get_embedding_cache: プロバイダー・モデルごとに別のキャッシュを返し、無効時はNoneを返す"""
+    embedding_cache.enable_embedding_cache(str(tmp_path))
+    try:
+        small = embedding_cache.get_embedding_cache("openai", "text-embedding-3-small")
+        large = embedding_cache.get_embedding_cache("openai", "text-embedding-3-large")
+        small.add_many(["意見1"], [[1.0]])
+
+        assert small is embedding_cache.get_embedding_cache("openai", "text-embedding-3-small")
+        assert large.get_many(["意見1"]) == [None]
+        assert os.path.isdir(small.directory)
+    finally:
+        embedding_cache.disable_embedding_cache()
+
+    assert embedding_cache.get_embedding_cache("openai", "text-embedding-3-small") is None
@@ -592,7 +592,7 @@ class TestLLMService:
         assert token_input == 50
         assert token_output == 50
         assert token_total == 100
-        mock_request_to_openai.assert_called_once_with(messages, "gpt-4o", False, None, None)
+        mock_request_to_openai.assert_called_once_with(messages, "gpt-4o", False, None, None, 30)
 
     def test_request_to_chat_openai_use_azure(self, mock_openai_response):
         """request_to_chat_openai: provider=azureの場合はrequest_to_azure_chatcompletionを使用する"""
@@ -614,7 +614,7 @@ class TestLLMService:
         assert token_input == 75
         assert token_output == 75
         assert token_total == 150
-        mock_request_to_azure.assert_called_once_with(messages, True, None, None)
+        mock_request_to_azure.assert_called_once_with(messages, True, None, None, 30)
 
     def test_request_to_chat_openai_with_json_schema(self, mock_openai_response):
         """request_to_chat_openai: json_schemaパラメータを指定できる"""
@@ -650,7 +650,7 @@ class TestLLMService:
         assert token_input == 100
         assert token_output == 100
         assert token_total == 200
-        mock_request_to_openai.assert_called_once_with(messages, "gpt-4o", False, json_schema, None)
+        mock_request_to_openai.assert_called_once_with(messages, "gpt-4o", False, json_schema, None, 30)
 
     def test_request_to_chat_openai_with_pydantic_model(self, mock_openai_response):
         """request_to_chat_openai: Pydantic BaseModelを指定できる"""
@@ -675,7 +675,7 @@ class TestLLMService:
         assert token_input == 125
         assert token_output == 125
         assert token_total == 250
-        mock_request_to_openai.assert_called_once_with(messages, "gpt-4o", False, TestModel, None)
+        mock_request_to_openai.assert_called_once_with(messages, "gpt-4o", False, TestModel, None, 30)
 
     def test_validate_model_valid(self):
         """_validate_model: 有効なモデルの場合は例外を発生させない"""
@@ -998,3 +998,29 @@ class TestLLMService:
         response = {"data": []}
         values = extract_embedding_values(response)
         assert values is None
+
+
+@pytest.mark.parametrize("provider", ["openai", "azure", "local", "openrouter"])
+def test_request_to_chat_ai_passes_timeout_to_client(provider):
+    """request_to_chat_ai: timeout をプロバイダーのクライアント呼び出しまで渡す"""
+    mock_client = MagicMock()
+    mock_client.chat.completions.create.return_value = MagicMock(
+        choices=[MagicMock(message=MagicMock(content="response"))],
+        usage=MagicMock(prompt_tokens=1, completion_tokens=1, total_tokens=2),
+    )
+    env_vars = {
+        "AZURE_CHATCOMPLETION_ENDPOINT": "https://example.azure.com",
+        "AZURE_CHATCOMPLETION_DEPLOYMENT_NAME": "test-deployment",
+        "AZURE_CHATCOMPLETION_API_KEY": "test-api-key",
+        "AZURE_CHATCOMPLETION_VERSION": "2023-05-15",
+        "OPENROUTER_API_KEY": "test-api-key",
+    }
+
+    with (
+        patch.dict(os.environ, env_vars),
+        patch("broadlistening.pipeline.services.llm.OpenAI", return_value=mock_client),
+        patch("broadlistening.pipeline.services.llm.AzureOpenAI", return_value=mock_client),
+    ):
+        request_to_chat_ai([{"role": "user", "content": "Hello!"}], model="gpt-4o", provider=provider, timeout=120)
+
+    assert mock_client.chat.completions.create.call_args.kwargs["timeout"] == 120
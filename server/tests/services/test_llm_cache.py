@@ -0,0 +1,150 @@
+from unittest.mock import patch
+
+import pytest
+from pydantic import BaseModel, Field
+
+from broadlistening.pipeline.services import llm_cache
+from broadlistening.pipeline.services.llm import request_to_chat_ai
+from broadlistening.pipeline.services.llm_cache import LLMResponseCache, build_cache_key
+from broadlistening.pipeline.services.parse_json_list import has_json_key
+
+
+class DummySchema(BaseModel):
+    label: str = Field(..., description="ラベル")
+
+
+MESSAGES = [
+    {"role": "system", "content": "You are a helpful assistant."},
+    {"role": "user", "content": "Hello, world!"},
+]
+
+
+def has_valid_label(response):
+    return has_json_key(response, "label")
+
+
+class TestBuildCacheKey:
+    """キャッシュキー生成のテスト"""
+
+    def test_same_request_gives_same_key(self):
+        """build_cache_key: 同一リクエストは同一キーになる"""
+        key1 = build_cache_key("openai", "gpt-4o-mini", MESSAGES, json_schema=DummySchema)
+        key2 = build_cache_key("openai", "gpt-4o-mini", [dict(m) for m in MESSAGES], json_schema=DummySchema)
+        assert key1 == key2
+
+    @pytest.mark.parametrize(
+        "kwargs",
+        [
+            {"provider": "azure"},
+            {"model": "gpt-4o"},
+            {"messages": [{"role": "user", "content": "Hello"}]},
+            {"json_schema": None},
+            {"is_json": True},
+        ],
+    )
+    def test_different_request_gives_different_key(self, kwargs):
+        """build_cache_key: プロバイダー・モデル・メッセージ・スキーマのいずれかが異なればキーも異なる"""
+        base = {
+            "provider": "openai",
+            "model": "gpt-4o-mini",
+            "messages": MESSAGES,
+            "is_json": False,
+            "json_schema": DummySchema,
+        }
+        assert build_cache_key(**base) != build_cache_key(**{**base, **kwargs})
+
+
+class TestLLMResponseCache:
+    """LLMResponseCacheのテスト"""
+
+    def test_set_and_get(self, tmp_path):
+        """get: 保存したレスポンスを型を保ったまま返す"""
+        cache = LLMResponseCache(str(tmp_path / "cache.sqlite3"))
+        cache.set("str-key", "テスト")
+        cache.set("dict-key", {"label": "ラベル"})
+
+        assert cache.get("str-key") == "テスト"
+        assert cache.get("dict-key") == {"label": "ラベル"}
+        assert cache.get("missing") is None
+        assert cache.hits == 2
+        assert cache.misses == 1
+
+    def test_persists_across_instances(self, tmp_path):
+        """get: 別インスタンス（再実行）からも読み出せる"""
+        path = str(tmp_path / "cache.sqlite3")
+        LLMResponseCache(path).set("key", "value")
+        assert LLMResponseCache(path).get("key") == "value"
+
+    def test_evicts_least_recently_used(self, tmp_path):
+        """set: 上限を超えたら最終アクセスが古いものから削除する"""
+        cache = LLMResponseCache(str(tmp_path / "cache.sqlite3"), max_size_bytes=30)
+        cache.set("old", "a" * 10)
+        cache.set("recent", "b" * 10)
+        cache.get("old")  # oldを最近使ったことにする
+        cache.set("new", "c" * 10)
+
+        assert cache.get("recent") is None
+        assert cache.get("old") == "a" * 10
+        assert cache.get("new") == "c" * 10
+
+
+class TestRequestToChatAIWithCache:
+    """request_to_chat_aiのキャッシュ利用のテスト"""
+
+    @pytest.fixture
+    def enabled_cache(self, tmp_path):
+        cache = llm_cache.enable_llm_cache(path=str(tmp_path / "cache.sqlite3"))
+        yield cache
+        llm_cache.disable_llm_cache()
+
+    def test_second_call_is_served_from_cache(self, enabled_cache):
+        """request_to_chat_ai: 2回目の同一リクエストはプロバイダーを呼ばず、トークン使用量0で返す"""
+        with patch(
+            "broadlistening.pipeline.services.llm.request_to_openai",
+            return_value=("response", 10, 5, 15),
+        ) as mock_request:
+            first = request_to_chat_ai(MESSAGES, model="gpt-4o-mini", provider="openai")
+            second = request_to_chat_ai(MESSAGES, model="gpt-4o-mini", provider="openai")
+
+        assert first == ("response", 10, 5, 15)
+        assert second == ("response", 0, 0, 0)
+        assert mock_request.call_count == 1
+
+    def test_unparsable_response_is_not_cached(self, enabled_cache):
+        """request_to_chat_ai: validate を満たさないレスポンスはキャッシュせず、次の呼び出しで送信し直す"""
+        with patch(
+            "broadlistening.pipeline.services.llm.request_to_openai",
+            side_effect=[("{broken", 10, 5, 15), ('{"label": "交通"}', 10, 5, 15)],
+        ) as mock_request:
+            first = request_to_chat_ai(MESSAGES, model="gpt-4o-mini", provider="openai", validate=has_valid_label)
+            second = request_to_chat_ai(MESSAGES, model="gpt-4o-mini", provider="openai", validate=has_valid_label)
+            third = request_to_chat_ai(MESSAGES, model="gpt-4o-mini", provider="openai", validate=has_valid_label)
+
+        assert first == ("{broken", 10, 5, 15)
+        assert second == ('{"label": "交通"}', 10, 5, 15)
+        assert third == ('{"label": "交通"}', 0, 0, 0)
+        assert mock_request.call_count == 2
+
+    def test_cached_response_failing_validation_is_discarded(self, enabled_cache):
+        """request_to_chat_ai: キャッシュ済みのレスポンスが validate を満たさない場合は削除して送信し直す"""
+        with patch(
+            "broadlistening.pipeline.services.llm.request_to_openai",
+            side_effect=[("{broken", 10, 5, 15), ('{"label": "交通"}', 10, 5, 15)],
+        ) as mock_request:
+            request_to_chat_ai(MESSAGES, model="gpt-4o-mini", provider="openai")
+            result = request_to_chat_ai(MESSAGES, model="gpt-4o-mini", provider="openai", validate=has_valid_label)
+
+        assert result == ('{"label": "交通"}', 10, 5, 15)
+        assert mock_request.call_count == 2
+        assert len(enabled_cache._conn.execute("SELECT key FROM responses").fetchall()) == 1
+
+    def test_cache_disabled_by_default(self):
+        """request_to_chat_ai: キャッシュを有効化していなければ毎回プロバイダーを呼ぶ"""
+        with patch(
+            "broadlistening.pipeline.services.llm.request_to_openai",
+            return_value=("response", 10, 5, 15),
+        ) as mock_request:
+            request_to_chat_ai(MESSAGES, model="gpt-4o-mini", provider="openai")
+            request_to_chat_ai(MESSAGES, model="gpt-4o-mini", provider="openai")
+
+        assert mock_request.call_count == 2
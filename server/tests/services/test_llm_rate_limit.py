@@ -0,0 +1,125 @@
+from unittest.mock import MagicMock, patch
+
+import openai
+import pytest
+
+from broadlistening.pipeline.services import llm
+from broadlistening.pipeline.services.llm import (
+    RateLimiter,
+    TokenBucket,
+    configure_rate_limits,
+    get_rate_limiter,
+    request_to_chat_ai,
+)
+
+MESSAGES = [{"role": "user", "content": "こんにちは"}]
+
+
+@pytest.fixture(autouse=True)
+def reset_rate_limits():
+    yield
+    configure_rate_limits([])
+
+
+class TestTokenBucket:
+    """TokenBucketのテスト"""
+
+    def test_acquire_within_capacity_does_not_wait(self):
+        """acquire: 容量内であれば待たずに取得できる"""
+        bucket = TokenBucket(per_minute=600)  # 容量は10秒分の100
+        with patch("broadlistening.pipeline.services.llm.time.sleep") as mock_sleep:
+            for _ in range(100):
+                bucket.acquire(1)
+        mock_sleep.assert_not_called()
+
+    def test_acquire_waits_when_exhausted(self):
+        """acquire: 容量を使い切ったら補充されるまで待つ"""
+        bucket = TokenBucket(per_minute=600)
+        bucket.acquire(100)
+        with patch(
+            "broadlistening.pipeline.services.llm.time.sleep", side_effect=lambda s: bucket.adjust(-s * 10)
+        ) as mock_sleep:
+            bucket.acquire(10)
+        assert mock_sleep.call_count >= 1
+        assert mock_sleep.call_args_list[0].args[0] == pytest.approx(1.0, abs=0.05)
+
+    def test_oversized_request_is_allowed_with_full_bucket(self):
+        """acquire: 容量を超える量でも満杯なら取得でき、超過分は負債になる"""
+        bucket = TokenBucket(per_minute=600)
+        with patch("broadlistening.pipeline.services.llm.time.sleep") as mock_sleep:
+            bucket.acquire(250)
+        mock_sleep.assert_not_called()
+        assert bucket._tokens < 0
+
+
+class TestRateLimitRegistry:
+    """レート制限の設定のテスト"""
+
+    def test_model_limit_takes_precedence_over_provider_limit(self):
+        """get_rate_limiter: モデル単位の制限を優先し、なければプロバイダー全体の制限を返す"""
+        configure_rate_limits(
+            [
+                {"provider": "openai", "requests_per_minute": 100},
+                {"provider": "openai", "model": "gpt-4o", "requests_per_minute": 10},
+            ]
+        )
+        assert get_rate_limiter("openai", "gpt-4o").requests.rate_per_second == pytest.approx(10 / 60)
+        assert get_rate_limiter("openai", "gpt-4o-mini").requests.rate_per_second == pytest.approx(100 / 60)
+        assert get_rate_limiter("azure", "gpt-4o") is None
+
+    def test_reads_env_when_not_given(self, monkeypatch):
+        """configure_rate_limits: 引数がNoneなら環境変数 LLM_RATE_LIMITS から読み込む"""
+        monkeypatch.setenv("LLM_RATE_LIMITS", '[{"provider": "openai", "tokens_per_minute": 60000}]')
+        configure_rate_limits(None)
+        limiter = get_rate_limiter("openai", "gpt-4o-mini")
+        assert limiter.requests is None
+        assert limiter.tokens.rate_per_second == pytest.approx(1000)
+
+
+class TestRequestToChatAIWithRateLimit:
+    """request_to_chat_aiのレート制限利用のテスト"""
+
+    def test_acquires_and_settles_actual_usage(self):
+        """request_to_chat_ai: 送信前に見積もりで取得し、実際のトークン使用量で精算する"""
+        configure_rate_limits([{"provider": "openai", "requests_per_minute": 60, "tokens_per_minute": 6000}])
+        with (
+            patch.object(RateLimiter, "acquire") as mock_acquire,
+            patch.object(RateLimiter, "settle") as mock_settle,
+            patch.object(llm, "request_to_openai", return_value=("response", 10, 5, 15)),
+        ):
+            result = request_to_chat_ai(MESSAGES, model="gpt-4o-mini", provider="openai")
+
+        assert result == ("response", 10, 5, 15)
+        mock_acquire.assert_called_once_with(len("こんにちは"))
+        mock_settle.assert_called_once_with(len("こんにちは"), 15)
+
+    def test_acquires_again_on_each_retry(self):
+        """request_to_chat_ai: レート制限エラーでリトライする場合も、試行ごとにトークンを取得する"""
+        configure_rate_limits([{"provider": "openai", "requests_per_minute": 60}])
+        mock_client = MagicMock()
+        usage = MagicMock(prompt_tokens=10, completion_tokens=5, total_tokens=15)
+        mock_client.chat.completions.create.side_effect = [
+            openai.RateLimitError(message="Rate limit exceeded", response=MagicMock(), body=MagicMock()),
+            MagicMock(choices=[MagicMock(message=MagicMock(content="response"))], usage=usage),
+        ]
+        with (
+            patch.object(RateLimiter, "acquire") as mock_acquire,
+            patch.object(llm, "OpenAI", return_value=mock_client),
+            patch.object(llm.request_to_openai.retry, "sleep"),
+        ):
+            result = request_to_chat_ai(MESSAGES, model="gpt-4o-mini", provider="openai")
+
+        assert result == ("response", 10, 5, 15)
+        assert mock_acquire.call_count == 2
+
+    def test_azure_limit_is_keyed_by_deployment(self, monkeypatch):
+        """request_to_chat_ai: Azureではmodel引数ではなくデプロイメント名の制限を使う"""
+        monkeypatch.setenv("AZURE_CHATCOMPLETION_DEPLOYMENT_NAME", "my-gpt-4o")
+        configure_rate_limits([{"provider": "azure", "model": "my-gpt-4o", "requests_per_minute": 60}])
+        with (
+            patch.object(RateLimiter, "acquire") as mock_acquire,
+            patch.object(llm, "request_to_azure_chatcompletion", return_value=("response", 10, 5, 15)),
+        ):
+            request_to_chat_ai(MESSAGES, model="gpt-4o-mini", provider="azure")
+
+        mock_acquire.assert_called_once_with(len("こんにちは"))
@@ -1,4 +1,7 @@
-from broadlistening.pipeline.services.parse_json_list import parse_extraction_response
+from broadlistening.pipeline.services.parse_json_list import (
+    parse_batch_extraction_response,
+    parse_extraction_response,
+)
 
 
 class TestParseJsonList:
@@ -38,3 +41,18 @@ class TestParseJsonList:
         response = '{"extractedOpinionList": null}'
         result = parse_extraction_response(response)
         assert result == []  # 実際の実装ではNoneが返されるかもしれないが、空リストを期待
+
+    def test_parse_batch_extraction_response_valid(self):
+        """parse_batch_extraction_response: commentIdごとの意見のリストを返す"""
+        response = (
+            '{"results": [{"commentId": "1", "extractedOpinionList": ["テスト1"]},'
+            ' {"commentId": 2, "extractedOpinionList": ["テスト2", "テスト3"]}]}'
+        )
+        result = parse_batch_extraction_response(response)
+        assert result == {"1": ["テスト1"], "2": ["テスト2", "テスト3"]}
+
+    def test_parse_batch_extraction_response_invalid(self):
+        """parse_batch_extraction_response: 解釈できない要素は含めず、全体が無効なら空の辞書を返す"""
+        response = {"results": [{"commentId": "1", "extractedOpinionList": "テスト"}]}
+        assert parse_batch_extraction_response(response) == {}
+        assert parse_batch_extraction_response("invalid json") == {}
@@ -1,6 +1,8 @@
+import os
 from pathlib import Path
 from unittest.mock import MagicMock, mock_open, patch
 
+import pandas as pd
 import pytest
 
 from src.core.exceptions import ClusterCSVParseError, ClusterFileNotFound
@@ -226,3 +228,26 @@ class TestClusterRepository:
 
         # 検証
         assert result is False
+
+    def test_read_and_update_parquet(self, test_slug, tmp_path, expected_clusters):
+        """Parquetの中間ファイルがCSVより新しい場合は、Parquetを読み書きすることを確認"""
+        pytest.importorskip("pyarrow")
+        report_dir = tmp_path / test_slug
+        report_dir.mkdir()
+        (report_dir / "hierarchical_merge_labels.csv").write_text("")
+        os.utime(report_dir / "hierarchical_merge_labels.csv", (0, 0))
+        rows = [cluster.model_dump() for cluster in expected_clusters]
+        pd.DataFrame(rows, columns=ClusterRepository.FIELDS).to_parquet(
+            report_dir / "hierarchical_merge_labels.parquet"
+        )
+
+        with patch("src.repositories.cluster_repository.settings.REPORT_DIR", tmp_path):
+            repository = ClusterRepository(test_slug)
+        updated = repository.update_csv(ClusterUpdate(id="cluster-2", label="更新されたラベル", description="説明"))
+        result = repository.read_from_csv()
+
+        assert repository.labels_path.suffix == ".parquet"
+        assert updated is True
+        assert result[1].label == "更新されたラベル"
+        assert result[2].density is None
+        assert [cluster.id for cluster in result] == ["cluster-1", "cluster-2", "cluster-3"]